@@ -0,0 +1,249 @@
+"""英文コーパスをブラウザなしで一括解析するコマンドラインツール
+
+使い方:
+    python annotate_corpus.py 教材.txt 教材フォルダ/ -o annotated/ --jobs 4
+
+TSV・JSON・JSON Lines・テキストのファイル（またはフォルダ内のファイル）を読み込み、
+未入力の日本語訳・文法ポイントをアプリと同じ処理で生成して <元の名前>.annotated.json に書き出す。
+生成結果はチェックポイントとLLMキャッシュに残るため、中断しても再実行で続きから処理できる。
+書き出したファイルはそのままアプリにアップロードでき、APIを呼ばずに読み込める。
+OPENAI_API_KEYがない場合や --rules-first を指定した場合は、ルールで判定できる文の文法ポイントを
+APIを使わずに作る（ルールで処理した文には日本語訳が付かない）。
+--format prepared を指定すると、文法カテゴリー・ハイライト・統計を含む準備済みコーパス
+（<元の名前>.corpus.sqlite3）を書き出し、アプリで大きなコーパスもすぐに開けるようにする。
+出力には元のファイルの内容のハッシュを残し、元のファイルが変わっていない解析済みの出力だけをスキップする。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from english_study_streamlit import (
+    DEFAULT_MAX_CONCURRENCY,
+    AnnotationCheckpoint,
+    LLMCache,
+    LLM_CACHE_PATH,
+    PREPARED_CORPUS_EXTENSION,
+    PreparedSentenceStore,
+    RequestScheduler,
+    annotate_sentences,
+    export_prepared_corpus,
+    hash_stream,
+    parse_uploaded_file,
+)
+
+INPUT_EXTENSIONS = ('.tsv', '.json', '.jsonl', '.txt')
+OUTPUT_SUFFIXES = {
+    'json': '.annotated.json',
+    'prepared': '.corpus' + PREPARED_CORPUS_EXTENSION
+}
+
+def collect_inputs(paths: List[str]) -> List[tuple]:
+    """ファイル・フォルダの指定から (入力ファイル, 出力先の相対パス) の一覧を作る"""
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(INPUT_EXTENSIONS) and \
+                            not name.endswith(tuple(OUTPUT_SUFFIXES.values())):
+                        file_path = os.path.join(root, name)
+                        inputs.append((file_path, os.path.relpath(file_path, path)))
+        elif path.endswith(INPUT_EXTENSIONS):
+            inputs.append((path, os.path.basename(path)))
+        else:
+            print(f"対応していないファイル形式のためスキップします: {path}", file=sys.stderr)
+    return inputs
+
+def output_path_for(
+    input_path: str,
+    relative_path: str,
+    output_dir: Optional[str],
+    output_format: str = 'json'
+) -> str:
+    """入力ファイルに対応する出力ファイルのパス（出力先の指定がなければ入力と同じ場所）"""
+    suffix = OUTPUT_SUFFIXES[output_format]
+    if output_dir is None:
+        return os.path.splitext(input_path)[0] + suffix
+    return os.path.join(output_dir, os.path.splitext(relative_path)[0] + suffix)
+
+def source_hash_of(path: str) -> str:
+    """入力ファイルの内容のSHA-256"""
+    with open(path, 'rb') as f:
+        return hash_stream(f)
+
+def is_complete_output(path: str, source_hash: str) -> bool:
+    """出力ファイルが既にあり、同じ内容の入力から作られ、すべての文が解析済みか"""
+    if not os.path.exists(path):
+        return False
+    try:
+        if path.endswith(PREPARED_CORPUS_EXTENSION):
+            # 確認だけでファイルを書き換えないよう、読み取り専用で開く
+            store = PreparedSentenceStore(path, read_only=True)
+            try:
+                return store.source_hash == source_hash and store.incomplete_count() == 0
+            finally:
+                store.close()
+        with open(path, encoding='utf-8') as f:
+            corpus = json.load(f)
+        return corpus.get('source_hash') == source_hash and corpus['stats']['incomplete'] == 0
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return False
+
+def write_corpus(path: str, sentences, source_hash: Optional[str] = None) -> Dict[str, int]:
+    """解析済みの文を、アプリで読み込めるJSONとして書き出す"""
+    records = [
+        {
+            'english': sentence['english'],
+            'japanese': sentence['japanese'],
+            'grammar': sentence['grammar']
+        }
+        for sentence in sentences
+    ]
+
+    stats = {
+        'total': len(records),
+        'incomplete': sentences.incomplete_count()
+    }
+    corpus = {
+        'source_hash': source_hash,
+        'stats': stats,
+        'sentences': records
+    }
+
+    # 書き込み途中で中断されても壊れたファイルが残らないよう、一時ファイルから置き換える
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return stats
+
+def process_file(
+    input_path: str,
+    output_path: str,
+    max_concurrency: int,
+    batch_mode: bool,
+    cache: LLMCache,
+    scheduler: Optional[RequestScheduler],
+    near_duplicates: bool = False,
+    rules_first: bool = False
+) -> Dict[str, int]:
+    """1ファイルを読み込み、未入力の欄を生成して書き出す"""
+    with open(input_path, 'rb') as f:
+        source_hash = hash_stream(f)
+        sentences = parse_uploaded_file(
+            os.path.basename(input_path), f, max_concurrency, cache, scheduler
+        )
+
+    checkpoint = AnnotationCheckpoint.for_sentences(sentences)
+    restored = len(checkpoint.restore(sentences))
+    dedup = {'skipped': 0}
+    # スケジューラがない場合は、ルールで判定できる文の文法ポイントだけを埋める
+    annotate_sentences(
+        sentences,
+        max_concurrency,
+        batch_mode=batch_mode,
+        cache=cache,
+        checkpoint=checkpoint,
+        scheduler=scheduler,
+        near_duplicates=near_duplicates,
+        dedup_callback=dedup.update,
+        rules_first=rules_first
+    )
+
+    if output_path.endswith(PREPARED_CORPUS_EXTENSION):
+        stats = export_prepared_corpus(output_path, sentences, source_hash=source_hash)
+    else:
+        stats = write_corpus(output_path, sentences, source_hash)
+    if stats['incomplete'] == 0:
+        checkpoint.remove()
+    stats['restored'] = restored
+    stats['deduplicated'] = dedup['skipped']
+    return stats
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="英文コーパスの日本語訳・文法ポイントを一括生成する")
+    parser.add_argument('inputs', nargs='+', help="入力ファイルまたはフォルダ")
+    parser.add_argument('-o', '--output-dir', help="出力先フォルダ（省略時は入力ファイルと同じ場所）")
+    parser.add_argument('-j', '--jobs', type=int, default=2, help="同時に処理するファイル数")
+    parser.add_argument(
+        '-c', '--concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY,
+        help="1ファイルあたりの同時リクエスト数"
+    )
+    parser.add_argument(
+        '--format', choices=sorted(OUTPUT_SUFFIXES), default='json',
+        help="出力形式（json: アプリで読み込めるJSON、prepared: すぐに開ける準備済みコーパス）"
+    )
+    parser.add_argument('--no-batch', action='store_true', help="1文ずつリクエストする")
+    parser.add_argument(
+        '--near-duplicates', action='store_true',
+        help="ほぼ同じ文は生成済みの似た文の結果を使う"
+    )
+    parser.add_argument(
+        '--rules-first', action='store_true',
+        help="ルールで文法ポイントを作れる文はAPIを使わず、判定できない文だけを生成する"
+    )
+    parser.add_argument('--force', action='store_true', help="解析済みの出力があっても処理し直す")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        print("OPENAI_API_KEYが設定されていないため、ルールで判定できる文法ポイントのみ生成します", file=sys.stderr)
+
+    # CLIではst.cache_resourceが効かないため、キャッシュとスケジューラを1つずつ作って全ファイルで共有する
+    cache = LLMCache(LLM_CACHE_PATH)
+    scheduler = RequestScheduler(api_key) if api_key else None
+
+    jobs = []
+    for input_path, relative_path in collect_inputs(args.inputs):
+        output_path = output_path_for(input_path, relative_path, args.output_dir, args.format)
+        if not args.force and is_complete_output(output_path, source_hash_of(input_path)):
+            print(f"解析済みのためスキップ: {input_path}")
+            continue
+        jobs.append((input_path, output_path))
+
+    failed = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {
+            executor.submit(
+                process_file, input_path, output_path,
+                args.concurrency, not args.no_batch, cache, scheduler,
+                args.near_duplicates, args.rules_first
+            ): (input_path, output_path)
+            for input_path, output_path in jobs
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            input_path, output_path = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(jobs)}] 失敗: {input_path}: {e}", file=sys.stderr)
+                continue
+            print(
+                f"[{done}/{len(jobs)}] {input_path} -> {output_path}: "
+                f"{stats['total']}文（未完了 {stats['incomplete']}、復元 {stats['restored']}、"
+                f"重複で省略 {stats['deduplicated']}）"
+            )
+
+    elapsed = time.perf_counter() - started
+    summary = f"{len(jobs) - failed}/{len(jobs)}ファイルを{elapsed:.1f}秒で処理しました"
+    if scheduler is not None:
+        request_stats = scheduler.stats()
+        summary += f"（リクエスト {request_stats['requests']}回、リトライ {request_stats['retries']}回）"
+    cache_stats = cache.stats()
+    summary += f" キャッシュヒット {cache_stats['hits']}件"
+    print(summary)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
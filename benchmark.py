@@ -0,0 +1,468 @@
+"""大きなコーパスやAPIの遅延に対する性能を測定するベンチマーク
+
+使い方:
+    python benchmark.py --sizes 10,1000,100000 --latency 0.3 --error-rate 0.02 --rate-limit-rate 0.05
+
+TSV・JSON・パイプ区切り・プレーンテキストの合成コーパスを生成し、解析・文法カテゴリー抽出・
+ハイライト・日本語訳の生成（ローカルで起動するOpenAI互換の模擬サーバーを使用）を測定する。
+アプリのモジュールを新しいプロセスで読み込む起動時間も測定する。
+スループット・レイテンシ（中央値と、20回以上測定した場合はp99、それ未満は最小値）・ピークメモリを
+表示し、結果をJSONに保存する。
+--baseline に以前の結果を指定すると、測定値の変化率を表示する。
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+from english_study_streamlit import (
+    BATCH_PROMPT_TEMPLATE,
+    SPLIT_PROMPT_TEMPLATE,
+    SPLIT_SYSTEM_PROMPT,
+    TRANSLATION_PROMPT_TEMPLATE,
+    GrammarHighlighter,
+    LLMCache,
+    RequestScheduler,
+    SentenceStore,
+    VocabularyIndex,
+    annotate_sentences,
+    extract_grammar_categories,
+    highlight_grammar_points,
+    load_highlight_words,
+    parse_json_content,
+    parse_pipe_text,
+    parse_plain_text,
+    parse_tsv_content,
+)
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+FORMATS = ('tsv', 'json', 'pipe', 'plain')
+RESULTS_DIR = 'benchmark_results'
+
+# 合成コーパスの材料（文法カテゴリーやハイライトの対象になる語を含める）
+SUBJECTS = ['The student', 'My teacher', 'Our team', 'The researcher', 'She', 'They', 'The committee']
+VERBS = ['has finished', 'had completed', 'was asked', 'decided to study', 'enjoys reading',
+         'would have chosen', 'is more careful than', 'found the most useful']
+OBJECTS = ['the report', 'a new method', 'the book which we bought', 'the problem that nobody solved',
+           'the results', 'an old friend who lives abroad', 'the longest chapter']
+CLAUSES = ['', ' because it was important', ' although the deadline was close', ' and then left',
+           ' when the class ended', ' if there was time', ' but nobody noticed']
+GRAMMAR_NOTES = ['現在完了形 (have + 過去分詞)', '過去完了形', '関係代名詞 which', '受動態 was asked',
+                 '不定詞 to study', '動名詞 reading', '仮定法 would have', '比較級 more careful',
+                 '最上級 the most', '接続詞 because']
+
+def generate_sentences(count: int, seed: int = 0) -> List[Dict[str, str]]:
+    """合成した文のリストを生成"""
+    rng = random.Random(seed)
+    sentences = []
+    for i in range(count):
+        english = f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)}{rng.choice(CLAUSES)}."
+        sentences.append({
+            'english': english,
+            'japanese': f"合成された日本語訳 {i}",
+            'grammar': '、'.join(rng.sample(GRAMMAR_NOTES, 2))
+        })
+    return sentences
+
+def render_corpus(sentences: List[Dict[str, str]], corpus_format: str) -> str:
+    """文のリストを各形式のファイル内容に変換"""
+    if corpus_format == 'tsv':
+        return '\n'.join(f"{s['english']}\t{s['japanese']}\t{s['grammar']}" for s in sentences)
+    if corpus_format == 'json':
+        return json.dumps({'sentences': sentences}, ensure_ascii=False)
+    if corpus_format == 'pipe':
+        return '\n'.join(f"{s['english']}｜{s['japanese']}｜{s['grammar']}" for s in sentences)
+    # プレーンテキストは英文のみを段落にまとめる
+    paragraphs = [' '.join(s['english'] for s in sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+    return '\n\n'.join(paragraphs)
+
+PARSERS: Dict[str, Callable[[str], list]] = {
+    'tsv': parse_tsv_content,
+    'json': parse_json_content,
+    'pipe': parse_pipe_text,
+    'plain': parse_plain_text,
+}
+
+# OpenAI互換の模擬サーバー
+class MockOpenAIServer:
+    """遅延・エラー・429を設定できる、チャット補完APIのローカルの代役"""
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 0.1, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self) -> 'MockOpenAIServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _decide(self) -> tuple:
+        """遅延時間と、返すべきエラーのステータスコード（なければNone）を決める"""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self._rng.gauss(self.latency, self.jitter))
+            roll = self._rng.random()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return delay, 429
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return delay, 500
+            return delay, None
+
+    @staticmethod
+    def _strip_template(content: str, template: str) -> str:
+        prefix, suffix = template.split('{text}')
+        if content.startswith(prefix):
+            content = content[len(prefix):]
+        if suffix and content.endswith(suffix):
+            content = content[:-len(suffix)]
+        return content.strip()
+
+    def _reply(self, request: dict) -> str:
+        messages = request['messages']
+        system, user = messages[0]['content'], messages[-1]['content']
+        if system == SPLIT_SYSTEM_PROMPT:
+            text = self._strip_template(user, SPLIT_PROMPT_TEMPLATE)
+            parts = [p.strip() for p in re.split(r'(?<=[.!?])\s+', text) if p.strip()]
+            return '\n'.join(f"{n}. {part}" for n, part in enumerate(parts, start=1))
+        if request.get('response_format', {}).get('type') == 'json_object':
+            text = self._strip_template(user, BATCH_PROMPT_TEMPLATE.replace('{{', '{').replace('}}', '}'))
+            ids = [int(n) for n in re.findall(r'^(\d+)\. ', text, re.MULTILINE)]
+            return json.dumps({'results': [
+                {'id': n, 'japanese': f"模擬の日本語訳 {n}", 'grammar': '関係代名詞 which、比較級 more'}
+                for n in ids
+            ]}, ensure_ascii=False)
+        text = self._strip_template(user, TRANSLATION_PROMPT_TEMPLATE)
+        return f"日本語訳: 模擬の日本語訳（{len(text)}文字）\n文法・語彙のポイント: 現在完了形 have + 過去分詞"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                delay, error = server._decide()
+                time.sleep(delay)
+                if error == 429:
+                    self._send(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                               {'Retry-After': str(server.retry_after)})
+                    return
+                if error is not None:
+                    self._send(error, {'error': {'message': 'Internal error', 'type': 'server_error'}})
+                    return
+                content = server._reply(request)
+                self._send(200, {
+                    'id': f"chatcmpl-mock-{server.requests}",
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': request.get('model', ''),
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': content},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+                })
+
+        return Handler
+
+class TimedScheduler(RequestScheduler):
+    """リクエストごとの所要時間（リトライ・待機を含む）を記録するスケジューラ"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies: List[float] = []
+
+    def chat(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().chat(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.latencies.append(elapsed)
+
+# 測定
+# p99を求めるのに必要な最小の測定回数（これより少ない場合、p99は最大値と変わらない）
+TAIL_PERCENTILE_MIN_RUNS = 20
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize_timings(timings: List[float]) -> Dict[str, float]:
+    """所要時間の中央値と、測定回数に応じてp99または最小値（ミリ秒）"""
+    summary = {'p50_ms': percentile(timings, 50) * 1000}
+    if len(timings) >= TAIL_PERCENTILE_MIN_RUNS:
+        summary['p99_ms'] = percentile(timings, 99) * 1000
+    else:
+        summary['min_ms'] = min(timings, default=0.0) * 1000
+    return summary
+
+def peak_memory(func: Callable[[], object]) -> int:
+    """1回実行したときのPythonのメモリ確保量のピーク（バイト）"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def measure(name: str, size: int, func: Callable[[], object], repeat: int) -> Dict[str, object]:
+    """所要時間を繰り返し測定し、スループット・レイテンシ・ピークメモリをまとめる"""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    median = percentile(timings, 50)
+    return {
+        'name': name,
+        'size': size,
+        'throughput': size / median if median else 0.0,
+        **summarize_timings(timings),
+        'peak_memory_bytes': peak_memory(func),
+        'runs': repeat
+    }
+
+def bench_hot_paths(sizes: List[int], formats: List[str], repeat: int) -> List[Dict[str, object]]:
+    """解析・文法カテゴリー抽出・ハイライト・語彙インデックスの作成を測定"""
+    results = []
+    words = load_highlight_words()
+    for size in sizes:
+        sentences = generate_sentences(size)
+        # 大きなコーパスは繰り返し回数を減らして所要時間を抑える
+        runs = repeat if size <= 10000 else max(1, repeat // 5)
+        for corpus_format in formats:
+            content = render_corpus(sentences, corpus_format)
+            parser = PARSERS[corpus_format]
+            results.append(measure(f"parse_{corpus_format}", size, lambda: parser(content), runs))
+        results.append(measure(
+            'extract_grammar_categories', size, lambda: extract_grammar_categories(sentences), runs
+        ))
+
+        def highlight_all():
+            # 文ごとのキャッシュが効かない初回表示を測るため、毎回新しいハイライターを使う
+            highlighter = GrammarHighlighter(list(words[0]), list(words[1]))
+            for sentence in sentences:
+                highlight_grammar_points(sentence['english'], highlighter)
+        results.append(measure('highlight_grammar_points', size, highlight_all, runs))
+        results.append(measure('vocabulary_index', size, lambda: VocabularyIndex(sentences), runs))
+        for result in results[-len(formats) - 3:]:
+            print_result(result)
+    return results
+
+STARTUP_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+import english_study_streamlit
+print(time.perf_counter() - started, 'openai' in sys.modules)
+"""
+
+def bench_startup(repeat: int) -> List[Dict[str, object]]:
+    """新しいプロセスでアプリのモジュールを読み込む時間（ワーカー起動時の読み込み）を測定"""
+    timings = []
+    openai_loaded = False
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.split()
+        timings.append(float(output[0]))
+        openai_loaded = openai_loaded or output[1] == 'True'
+    result = {
+        'name': 'import_app_module',
+        'size': 1,
+        # 文を処理する測定ではないため、スループットは表示しない
+        'throughput': None,
+        **summarize_timings(timings),
+        'peak_memory_bytes': None,
+        'runs': repeat,
+        # 生成済みのコーパスしか使わない場合に、OpenAI SDKが読み込まれていないか
+        'openai_loaded': openai_loaded
+    }
+    print_result(result)
+    return [result]
+
+def bench_annotation(sizes: List[int], server: MockOpenAIServer, concurrency: int,
+                     batch_mode: bool, max_size: int) -> List[Dict[str, object]]:
+    """模擬サーバーに対して日本語訳・文法ポイントの生成を測定"""
+    results = []
+    for size in sizes:
+        if size > max_size:
+            continue
+        sentences = SentenceStore.from_records(
+            {'english': s['english'] + f" (#{i})", 'japanese': '', 'grammar': ''}
+            for i, s in enumerate(generate_sentences(size, seed=1))
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            # キャッシュが効かないよう、空のキャッシュを使う
+            cache = LLMCache(os.path.join(tmp, 'cache.sqlite3'))
+            scheduler = TimedScheduler('mock', rpm_limit=1_000_000, tpm_limit=1_000_000_000,
+                                       base_url=server.base_url)
+            requests_before = server.requests
+            started = time.perf_counter()
+            annotate_sentences(sentences, concurrency, batch_mode=batch_mode,
+                               cache=cache, scheduler=scheduler)
+            elapsed = time.perf_counter() - started
+        latencies = scheduler.latencies
+        result = {
+            'name': 'annotate' + ('_batch' if batch_mode else '_single'),
+            'size': size,
+            'throughput': size / elapsed if elapsed else 0.0,
+            **summarize_timings(latencies),
+            'peak_memory_bytes': None,
+            'runs': 1,
+            'elapsed_s': elapsed,
+            'requests': server.requests - requests_before,
+            'retries': scheduler.stats()['retries'],
+            'incomplete': sentences.incomplete_count()
+        }
+        print_result(result)
+        results.append(result)
+    return results
+
+# 結果の表示と保存
+def format_bytes(value: Optional[int]) -> str:
+    return '-' if value is None else f"{value / 1024 / 1024:.1f}MB"
+
+def print_result(result: Dict[str, object]) -> None:
+    # 測定回数が少ない場合はp99の代わりに最小値を表示する
+    tail = f"p99 {result['p99_ms']:>9.2f}ms" if 'p99_ms' in result else f"min {result['min_ms']:>9.2f}ms"
+    # 起動時間など文を処理しない測定はスループットを表示しない
+    if result['throughput'] is None:
+        throughput = f"{'-':>12}" + ' ' * 8
+    else:
+        throughput = f"{result['throughput']:>12.0f} 文/秒  "
+    line = (
+        f"{result['name']:<28} n={result['size']:<7} {throughput}"
+        f"p50 {result['p50_ms']:>9.2f}ms  {tail}  "
+        f"peak {format_bytes(result['peak_memory_bytes'])}"
+    )
+    if 'openai_loaded' in result:
+        line += f"  openai {'読み込み済み' if result['openai_loaded'] else '未読み込み'}"
+    if 'requests' in result:
+        line += f"  requests {result['requests']} retries {result['retries']} 未完了 {result['incomplete']}"
+    print(line, flush=True)
+
+def compare_with_baseline(results: List[Dict[str, object]], baseline_path: str) -> None:
+    """以前の結果と比べたスループットとp50の変化率を表示"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    print(f"\n{baseline_path} との比較（スループットは高いほど、p50は低いほど良い）")
+    for result in results:
+        before = baseline.get((result['name'], result['size']))
+        if before is None or not before['p50_ms']:
+            continue
+        p50 = (result['p50_ms'] / before['p50_ms'] - 1) * 100
+        if result['throughput'] and before['throughput']:
+            throughput = f"{(result['throughput'] / before['throughput'] - 1) * 100:+7.1f}%"
+        else:
+            throughput = f"{'-':>8}"
+        print(f"{result['name']:<28} n={result['size']:<7} スループット {throughput}  p50 {p50:+7.1f}%")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="英語学習アプリの処理性能を測定する")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="合成コーパスの文数（カンマ区切り）")
+    parser.add_argument('--formats', default=','.join(FORMATS), help="測定するファイル形式（カンマ区切り）")
+    parser.add_argument('--repeat', type=int, default=5, help="各測定の繰り返し回数")
+    parser.add_argument('--latency', type=float, default=0.2, help="模擬サーバーの平均応答時間（秒）")
+    parser.add_argument('--jitter', type=float, default=0.05, help="応答時間のばらつき（標準偏差・秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="500エラーを返す割合")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="429を返す割合")
+    parser.add_argument('--concurrency', type=int, default=8, help="生成の同時リクエスト数")
+    parser.add_argument('--annotate-max', type=int, default=1000, help="生成を測定する最大の文数")
+    parser.add_argument('--no-batch', action='store_true', help="1文ずつリクエストして生成を測定する")
+    parser.add_argument('--skip-annotation', action='store_true', help="生成の測定を省略する")
+    parser.add_argument('--skip-startup', action='store_true', help="起動時間の測定を省略する")
+    parser.add_argument('--output', help="結果の保存先（省略時は benchmark_results/ に日時で保存）")
+    parser.add_argument('--baseline', help="比較する以前の結果のJSON")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    formats = [f for f in args.formats.split(',') if f]
+    # 解析の測定ではプレーンテキストの文分割にAPIを使わない
+    os.environ.pop('OPENAI_API_KEY', None)
+
+    results = [] if args.skip_startup else bench_startup(args.repeat)
+    results += bench_hot_paths(sizes, formats, args.repeat)
+    server_stats = None
+    if not args.skip_annotation:
+        with MockOpenAIServer(args.latency, args.jitter, args.error_rate, args.rate_limit_rate) as server:
+            results += bench_annotation(sizes, server, args.concurrency, not args.no_batch, args.annotate_max)
+            server_stats = {
+                'requests': server.requests,
+                'errors': server.errors,
+                'rate_limited': server.rate_limited
+            }
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'settings': vars(args),
+            'server': server_stats,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を {output} に保存しました")
+
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
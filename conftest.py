@@ -0,0 +1,14 @@
+import pytest
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "request(request_id): 対象のコードを追加した変更依頼のID"
+    )
+
+
+@pytest.fixture(autouse=True)
+def isolated_environment(tmp_path, monkeypatch):
+    """APIキーを外し、キャッシュ・チェックポイントなどの相対パスを一時ディレクトリに向ける"""
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.chdir(tmp_path)
@@ -1,16 +1,125 @@
+import time
+# スクリプトの実行開始時刻（起動時間と再実行ごとの読み込み時間の計測に使う）
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
 import json
 import re
-from typing import List, Dict
-import openai
+from typing import List, Dict, Callable, Optional, Iterator, Iterable, BinaryIO, TextIO, Tuple, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import hashlib
+import sqlite3
+import random
+import functools
+import contextlib
+import shutil
+import tempfile
+import io
+import sys
+import bisect
+import heapq
+import math
+from array import array
+from collections import deque, OrderedDict
+from urllib.request import pathname2url
 import os
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-# ページ設定
-st.set_page_config(
-    page_title="英語学習アプリ - 文法・語彙解析",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# 同時に実行するOpenAI APIリクエスト数の既定値
+DEFAULT_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '8'))
+
+# 生成途中の結果を保存するチェックポイントの保存先
+ANNOTATION_CHECKPOINT_DIR = os.getenv('ANNOTATION_CHECKPOINT_DIR', '.annotation_checkpoints')
+
+# ハイライトする語のリスト（HIGHLIGHT_WORDS_PATHのJSONファイルで上書きできる）
+HIGHLIGHT_WORDS_PATH = os.getenv('HIGHLIGHT_WORDS_PATH', '')
+HIGHLIGHT_CONJUNCTIONS = ['However', 'Therefore', 'Although', 'Because', 'Since', 'While', 'When', 'If', 'Unless', 'As']
+HIGHLIGHT_RELATIVES = ['which', 'who', 'whom', 'whose', 'that', 'where', 'when']
+HIGHLIGHT_CACHE_SIZE = 100000
+
+# 語彙レベルの一覧（「語<TAB>レベル」の行か {"語": "レベル"} のJSON、省略時はレベルを付けない）
+VOCABULARY_LEVELS_PATH = os.getenv('VOCABULARY_LEVELS_PATH', '')
+
+# 全文表示モードで1ページに表示する文の数
+DEFAULT_PAGE_SIZE = int(os.getenv('SHOW_ALL_PAGE_SIZE', '20'))
+PAGE_SIZE_OPTIONS = sorted({10, 20, 50, 100, DEFAULT_PAGE_SIZE})
+
+# プロセス全体で共有するコーパスの最大数
+CORPUS_STORE_MAX_ENTRIES = int(os.getenv('CORPUS_STORE_MAX_ENTRIES', '32'))
+
+# 準備済みコーパス（文と派生データを保存したSQLiteファイル）の形式と保存先
+PREPARED_CORPUS_FORMAT = 'english-study-prepared-corpus/1'
+PREPARED_CORPUS_EXTENSION = '.sqlite3'
+PREPARED_CORPUS_DIR = os.getenv('PREPARED_CORPUS_DIR', '.prepared_corpora')
+
+# バックグラウンド生成中に画面を更新する間隔（秒）
+ANNOTATION_POLL_INTERVAL = float(os.getenv('ANNOTATION_POLL_INTERVAL', '1.0'))
+# この時間再実行されていないセッションは閉じられたとみなし、表示中のセッションがなくなれば生成を取り消す（秒）
+ANNOTATION_WATCHER_TIMEOUT = float(os.getenv('ANNOTATION_WATCHER_TIMEOUT', '30'))
+
+# OpenAI APIのレート制限・リトライの設定
+OPENAI_RPM_LIMIT = int(os.getenv('OPENAI_RPM_LIMIT', '500'))
+OPENAI_TPM_LIMIT = int(os.getenv('OPENAI_TPM_LIMIT', '200000'))
+OPENAI_REQUEST_TIMEOUT = float(os.getenv('OPENAI_REQUEST_TIMEOUT', '60'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '5'))
+OPENAI_BACKOFF_BASE = 1.0
+OPENAI_BACKOFF_MAX = 60.0
+
+# LLMキャッシュの設定
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '.llm_cache.sqlite3')
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '50000'))
+LLM_CACHE_MAX_AGE_DAYS = float(os.getenv('LLM_CACHE_MAX_AGE_DAYS', '30'))
+
+# LLMの設定とプロンプト
+LLM_MODEL = "gpt-4o-mini"
+
+SPLIT_SYSTEM_PROMPT = "あなたは英文を適切に分割する専門家です。"
+SPLIT_PROMPT_TEMPLATE = """以下のテキストを、意味のある文単位に正確に分割してください。
+各文は独立して理解できる完全な文になるようにしてください。
+略語（Dr., Mr., etc.）や数字（1.5, 3:00）に注意してください。
+
+テキスト:
+{text}
+
+以下の形式で、分割された文を1行ずつ出力してください：
+1. [最初の文]
+2. [2番目の文]
+3. [3番目の文]
+...以下同様"""
+SPLIT_TEMPERATURE = 0.3
+
+TRANSLATION_SYSTEM_PROMPT = "あなたは英語教育の専門家です。"
+TRANSLATION_PROMPT_TEMPLATE = """以下の英文について、日本語訳と文法・語彙のポイントを提供してください。
+
+英文: {text}
+
+以下の形式で回答してください：
+日本語訳: [自然な日本語訳]
+文法・語彙のポイント: [重要な文法事項、語彙、表現の解説]"""
+TRANSLATION_TEMPERATURE = 0.7
+
+# 長いテキストを文分割する際のチャンクサイズ（文字数）
+SPLIT_CHUNK_CHARS = int(os.getenv('SPLIT_CHUNK_CHARS', '3000'))
+
+# 複数の文をまとめて1回のリクエストで生成するバッチモードの設定
+BATCH_TOKEN_BUDGET = int(os.getenv('OPENAI_BATCH_TOKEN_BUDGET', '4000'))
+BATCH_MAX_SIZE = int(os.getenv('OPENAI_BATCH_MAX_SIZE', '20'))
+BATCH_OUTPUT_TOKENS_PER_SENTENCE = 200
+BATCH_PROMPT_TEMPLATE = """以下の番号付きの英文それぞれについて、日本語訳と文法・語彙のポイントを提供してください。
+
+{text}
+
+次のJSON形式のみで回答してください。idは英文の番号と一致させ、全ての英文について回答してください：
+{{"results": [{{"id": 1, "japanese": "自然な日本語訳", "grammar": "重要な文法事項、語彙、表現の解説"}}]}}"""
+
+# ほぼ同じ文の結果を再利用する際の類似度（文字5-gramのJaccard係数）の下限
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.8'))
+NEAR_DUPLICATE_SHINGLE_SIZE = 5
+# MinHashの署名長と、候補を探すバンドの数（バンドあたりの行数は署名長÷バンド数）
+MINHASH_NUM_PERM = 32
+MINHASH_BANDS = 8
 
 # セッション状態の初期化関数
 def init_session_state():
@@ -26,12 +135,37 @@ def init_session_state():
         st.session_state.grammar_filter = []
     if 'file_loaded' not in st.session_state:
         st.session_state.file_loaded = False
-
-# 初期化を実行
-init_session_state()
+    if 'max_concurrency' not in st.session_state:
+        st.session_state.max_concurrency = DEFAULT_MAX_CONCURRENCY
+    if 'batch_mode' not in st.session_state:
+        st.session_state.batch_mode = True
+    if 'near_duplicates' not in st.session_state:
+        st.session_state.near_duplicates = False
+    if 'rules_first' not in st.session_state:
+        st.session_state.rules_first = False
+    if 'corpus' not in st.session_state:
+        st.session_state.corpus = None
+    if 'stream_index' not in st.session_state:
+        st.session_state.stream_index = None
+    if 'page_size' not in st.session_state:
+        st.session_state.page_size = DEFAULT_PAGE_SIZE
+    if 'page_number' not in st.session_state:
+        st.session_state.page_number = 1
+    if 'jump_to' not in st.session_state:
+        st.session_state.jump_to = 1
+    if 'search_query' not in st.session_state:
+        st.session_state.search_query = ""
+    if 'vocabulary_word' not in st.session_state:
+        st.session_state.vocabulary_word = ""
+    if 'vocabulary_level' not in st.session_state:
+        st.session_state.vocabulary_level = None
+    if 'vocabulary_top_n' not in st.session_state:
+        st.session_state.vocabulary_top_n = 20
+    if 'prepared_export' not in st.session_state:
+        st.session_state.prepared_export = None
 
 # カスタムCSS
-st.markdown("""
+PAGE_CSS = """
 <style>
     .sentence-card {
         background-color: white;
@@ -82,7 +216,17 @@ st.markdown("""
         border-radius: 3px;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# ページ設定・セッション状態・CSSを適用する（CLIからのimport時には実行しない）
+def setup_page():
+    st.set_page_config(
+        page_title="英語学習アプリ - 文法・語彙解析",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    init_session_state()
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
 
 # コールバック関数
 def go_prev():
@@ -99,136 +243,855 @@ def toggle_show_all():
 def toggle_edit_mode():
     st.session_state.edit_mode = not st.session_state.edit_mode
 
+def request_stream(index):
+    st.session_state.stream_index = index
+
+def reset_page():
+    st.session_state.page_number = 1
+
+def jump_to_sentence():
+    # 指定した文（フィルター中は、それ以降で最初に該当する文）を含むページへ移動
+    indices = get_visible_indices()
+    position = jump_position(
+        indices, st.session_state.jump_to - 1, ranked=bool(st.session_state.search_query.strip())
+    )
+    if position is not None:
+        st.session_state.page_number = position // st.session_state.page_size + 1
+        st.session_state.current_index = indices[position]
+
+def clear_prepared_export():
+    st.session_state.prepared_export = None
+
 def save_edit(index):
     japanese_key = f"japanese_{index}"
     grammar_key = f"grammar_{index}"
     
+    # 編集内容は共有コーパスではなく、このセッションの差分として保存する
+    fields = {}
     if japanese_key in st.session_state:
-        st.session_state.sentences[index]['japanese'] = st.session_state[japanese_key]
+        fields['japanese'] = st.session_state[japanese_key]
     if grammar_key in st.session_state:
-        st.session_state.sentences[index]['grammar'] = st.session_state[grammar_key]
+        fields['grammar'] = st.session_state[grammar_key]
+    st.session_state.sentences.update(index, **fields)
+
+# 性能計測
+class PerformanceMetrics:
+    """処理ごとの所要時間と、トークン数などの件数をプロセス全体で集計する"""
+    
+    # パーセンタイルの計算に使う直近の計測数
+    SAMPLE_SIZE = 1000
+    
+    def __init__(self):
+        self._timers: Dict[str, Dict[str, object]] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # プロセスで最初の実行（起動時間）を計測済みか
+        self.started = False
+    
+    def observe(self, name: str, seconds: float) -> None:
+        """1回分の所要時間を記録"""
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = {
+                    'count': 0, 'total': 0.0, 'max': 0.0, 'samples': deque(maxlen=self.SAMPLE_SIZE)
+                }
+            timer['count'] += 1
+            timer['total'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            timer['samples'].append(seconds)
+    
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """ブロックの所要時間を記録（例外で抜けた場合も記録する）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+    
+    def increment(self, name: str, value: float = 1) -> None:
+        """件数を加算"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+    
+    def reset(self) -> None:
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+    
+    def snapshot(self, extra_counters: Optional[Dict[str, float]] = None) -> Dict[str, Dict]:
+        """所要時間の統計（ミリ秒）と件数を返す"""
+        with self._lock:
+            timers = {}
+            for name, timer in sorted(self._timers.items()):
+                samples = sorted(timer['samples'])
+                timers[name] = {
+                    'count': timer['count'],
+                    'total_ms': timer['total'] * 1000,
+                    'mean_ms': timer['total'] / timer['count'] * 1000,
+                    'p50_ms': samples[int(len(samples) * 0.5)] * 1000,
+                    'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+                    'max_ms': timer['max'] * 1000
+                }
+            counters = dict(sorted({**self._counters, **(extra_counters or {})}.items()))
+        return {'timers': timers, 'counters': counters}
+    
+    def to_json(self, extra_counters: Optional[Dict[str, float]] = None) -> str:
+        return json.dumps(self.snapshot(extra_counters), ensure_ascii=False, indent=2)
+    
+    def to_prometheus(self, extra_counters: Optional[Dict[str, float]] = None) -> str:
+        """Prometheusのテキスト形式で出力"""
+        snapshot = self.snapshot(extra_counters)
+        lines = [
+            '# HELP english_study_duration_seconds Duration of instrumented operations.',
+            '# TYPE english_study_duration_seconds summary'
+        ]
+        for name, timer in snapshot['timers'].items():
+            for quantile, key in (('0.5', 'p50_ms'), ('0.99', 'p99_ms')):
+                lines.append(
+                    f'english_study_duration_seconds{{operation="{name}",quantile="{quantile}"}} '
+                    f'{timer[key] / 1000:.6f}'
+                )
+            lines.append(f'english_study_duration_seconds_sum{{operation="{name}"}} {timer["total_ms"] / 1000:.6f}')
+            lines.append(f'english_study_duration_seconds_count{{operation="{name}"}} {timer["count"]}')
+        for name, value in snapshot['counters'].items():
+            metric = f'english_study_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            # 件数は丸めずにそのまま出力する（:gでは7桁以上が指数表記に丸められる）
+            lines.append(f'{metric} {value if isinstance(value, int) else repr(float(value))}')
+        return '\n'.join(lines) + '\n'
+
+@st.cache_resource
+def get_metrics() -> PerformanceMetrics:
+    """プロセス全体で共有する性能計測を取得"""
+    return PerformanceMetrics()
+
+def collect_metrics() -> Dict[str, float]:
+    """性能計測に含める、LLMキャッシュとAPIスケジューラの件数"""
+    cache_stats = get_llm_cache().stats()
+    counters = {
+        'llm_cache_hits': cache_stats['hits'],
+        'llm_cache_misses': cache_stats['misses']
+    }
+    scheduler = get_default_scheduler()
+    if scheduler is not None:
+        for name, value in scheduler.stats().items():
+            counters[f'llm_{name}'] = value
+    return counters
+
+# LLMキャッシュ
+class LLMCache:
+    """LLMの応答をSQLiteに保存する永続キャッシュ"""
+    
+    def __init__(self, path: str, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_age_days: float = LLM_CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)"
+            )
+            self._conn.commit()
+        self.evict()
+    
+    @staticmethod
+    def make_key(model: str, prompt_template: str, temperature: float, text: str) -> str:
+        """モデル・プロンプト・温度・入力文からキャッシュキーを作成"""
+        payload = json.dumps([model, prompt_template, temperature, text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str):
+        """キャッシュされた値を取得（なければNone）"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+    
+    def set(self, key: str, value) -> None:
+        """値をキャッシュに保存"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._conn.commit()
+            self._writes += 1
+            should_evict = self._writes % 100 == 0
+        if should_evict:
+            self.evict()
+    
+    def evict(self) -> None:
+        """期限切れのエントリと、上限を超えた古いエントリを削除"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?",
+                (time.time() - self.max_age_seconds,)
+            )
+            self._conn.execute(
+                """DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+    
+    def clear(self) -> None:
+        """キャッシュを全て削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> Dict[str, int]:
+        """ヒット数・ミス数・エントリ数を返す"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+@st.cache_resource
+def get_llm_cache() -> LLMCache:
+    """プロセス全体で共有するLLMキャッシュを取得"""
+    return LLMCache(LLM_CACHE_PATH)
+
+# OpenAI APIリクエストのスケジューラ
+def retryable_errors() -> tuple:
+    """再試行すれば成功する可能性のあるエラー"""
+    import openai
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+class RequestCancelled(Exception):
+    """生成が取り消されたため、リクエストを送らずに中断した"""
+
+class RequestScheduler:
+    """1つのOpenAIクライアントを共有し、RPM/TPM制限とリトライ付きでリクエストを実行する"""
+    
+    def __init__(self, api_key: str, rpm_limit: int = OPENAI_RPM_LIMIT,
+                 tpm_limit: int = OPENAI_TPM_LIMIT, timeout: float = OPENAI_REQUEST_TIMEOUT,
+                 max_retries: int = OPENAI_MAX_RETRIES, base_url: Optional[str] = None,
+                 metrics: Optional[PerformanceMetrics] = None):
+        # リトライはスケジューラ側で行うため、クライアント自身のリトライは無効にする
+        # base_urlを省略した場合はOPENAI_BASE_URL、なければOpenAIのAPIに接続する
+        self._client_options = {
+            'api_key': api_key, 'base_url': base_url, 'timeout': timeout, 'max_retries': 0
+        }
+        self._client = None
+        # SDKの読み込みにはレート制限の確認を止めないよう、クライアント専用のロックを使う
+        self._client_lock = threading.Lock()
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.throttled_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # リクエストごとの所要時間を記録する先（省略時は記録しない）
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        # 直近60秒間のリクエスト時刻と、(時刻, トークン数)
+        self._request_times = deque()
+        self._token_usage = deque()
+        self._tokens_in_window = 0
+    
+    @property
+    def client(self):
+        """OpenAIクライアント（生成済みのコーパスではSDKが不要なため、最初のリクエストで読み込んで作る）"""
+        with self._client_lock:
+            if self._client is None:
+                import openai
+                self._client = openai.OpenAI(**self._client_options)
+            return self._client
+    
+    def _expire(self, now: float) -> None:
+        while self._request_times and now - self._request_times[0] >= 60:
+            self._request_times.popleft()
+        while self._token_usage and now - self._token_usage[0][0] >= 60:
+            self._tokens_in_window -= self._token_usage.popleft()[1]
+    
+    @staticmethod
+    def _sleep(seconds: float, cancel_event: Optional[threading.Event] = None) -> None:
+        """指定時間待つ（待っている間に取り消されたら中断する）"""
+        if cancel_event is None:
+            time.sleep(seconds)
+        elif cancel_event.wait(seconds):
+            raise RequestCancelled()
+    
+    def _acquire(self, tokens: int, cancel_event: Optional[threading.Event] = None) -> None:
+        """RPM/TPMの枠が空くまで待ってから枠を確保する"""
+        # 1リクエストで上限を超える場合でも永久に待たないようにする
+        tokens = min(tokens, self.tpm_limit)
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+            with self._lock:
+                now = time.time()
+                self._expire(now)
+                wait = 0.0
+                if len(self._request_times) >= self.rpm_limit:
+                    wait = max(wait, 60 - (now - self._request_times[0]))
+                if self._tokens_in_window + tokens > self.tpm_limit and self._token_usage:
+                    wait = max(wait, 60 - (now - self._token_usage[0][0]))
+                if wait <= 0:
+                    self._request_times.append(now)
+                    self._token_usage.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    self.requests += 1
+                    return
+                self.throttled_seconds += wait
+            self._sleep(wait, cancel_event)
+    
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """Retry-Afterヘッダーがあればそれに従い、なければジッター付きの指数バックオフ"""
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                return min(float(response.headers.get('retry-after')), OPENAI_BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+        return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+    
+    def _record(self, name: str, started: float, response=None, failed: bool = False) -> None:
+        """1回のリクエストの所要時間・トークン数・失敗を記録"""
+        if self.metrics is not None:
+            self.metrics.observe(name, time.perf_counter() - started)
+        usage = getattr(response, 'usage', None)
+        with self._lock:
+            if failed:
+                self.errors += 1
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+    
+    def chat(self, messages: List[Dict[str, str]], max_tokens: int,
+             cancel_event: Optional[threading.Event] = None, **kwargs):
+        """チャット補完を実行（レート制限・タイムアウト・リトライ付き、取り消しはリクエストごとに確認する）"""
+        tokens = sum(estimate_tokens(m['content']) for m in messages) + max_tokens
+        for attempt in range(self.max_retries + 1):
+            self._acquire(tokens, cancel_event)
+            # SDKの読み込み・クライアントの作成をリクエストの所要時間に含めない
+            client = self.client
+            started = time.perf_counter()
+            try:
+                response = client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    timeout=self.timeout,
+                    **kwargs
+                )
+                self._record('llm_request', started, response)
+                return response
+            except retryable_errors() as e:
+                self._record('llm_request', started, failed=True)
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                self._sleep(self._backoff(attempt, e), cancel_event)
+            except Exception:
+                self._record('llm_request', started, failed=True)
+                raise
+    
+    def chat_stream(self, messages: List[Dict[str, str]], max_tokens: int, **kwargs) -> Iterator[str]:
+        """チャット補完をストリーミングで実行し、届いたテキストを順に返す"""
+        tokens = sum(estimate_tokens(m['content']) for m in messages) + max_tokens
+        for attempt in range(self.max_retries + 1):
+            self._acquire(tokens)
+            client = self.client
+            started = time.perf_counter()
+            try:
+                # リトライするのは最初のトークンを受け取る前のエラーのみ
+                stream = client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    timeout=self.timeout,
+                    stream=True,
+                    **kwargs
+                )
+                self._record('llm_stream_start', started)
+                break
+            except retryable_errors() as e:
+                self._record('llm_stream_start', started, failed=True)
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self._backoff(attempt, e))
+            except Exception:
+                self._record('llm_stream_start', started, failed=True)
+                raise
+        
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception:
+            # 受信中に切断された場合も失敗として数える
+            self._record('llm_stream', started, failed=True)
+            raise
+        self._record('llm_stream', started)
+    
+    def stats(self) -> Dict[str, float]:
+        """リクエスト数・リトライ数・待機時間・トークン数を返す"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'errors': self.errors,
+                'throttled_seconds': self.throttled_seconds,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens
+            }
+
+@st.cache_resource
+def get_request_scheduler(api_key: str) -> RequestScheduler:
+    """APIキーごとにプロセス全体で共有するスケジューラを取得"""
+    return RequestScheduler(api_key, metrics=get_metrics())
+
+def get_default_scheduler() -> Optional[RequestScheduler]:
+    """環境変数のAPIキーに対応するスケジューラを取得（キーがなければNone）"""
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        return None
+    return get_request_scheduler(api_key)
+
+# 文のストア
+SENTENCE_FIELDS = ('english', 'japanese', 'grammar')
+
+def is_incomplete(sentence) -> bool:
+    """日本語訳または文法ポイントが未入力か"""
+    return not sentence['japanese'] or not sentence['grammar']
+
+class SentenceRecord:
+    """SentenceStoreの1文を辞書と同じように読み書きするための軽量な参照"""
+    
+    __slots__ = ('store', 'index')
+    
+    def __init__(self, store: 'SentenceStore', index: int):
+        self.store = store
+        self.index = index
+    
+    def __getitem__(self, field: str) -> str:
+        return self.store.columns[field][self.index]
+    
+    def __setitem__(self, field: str, value: str) -> None:
+        self.store.set_field(self.index, field, value)
+    
+    def get(self, field: str, default=None):
+        column = self.store.columns.get(field)
+        return column[self.index] if column is not None else default
+    
+    def keys(self):
+        return SENTENCE_FIELDS
+    
+    def to_dict(self) -> Dict[str, str]:
+        return {field: self[field] for field in SENTENCE_FIELDS}
+    
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+class SentenceStore:
+    """文を列ごとのリストで保持する省メモリなストア（同じ文法ポイントの文字列は1つを共有する）"""
+    
+    def __init__(self):
+        self.columns: Dict[str, List[str]] = {field: [] for field in SENTENCE_FIELDS}
+        self._grammar_pool: Dict[str, str] = {}
+        self._incomplete = 0
+        self._version = 0
+        self._memory_cache = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_records(cls, records: Iterable) -> 'SentenceStore':
+        """文の辞書のイテラブルから作成（ジェネレーターを渡せば1文ずつ取り込む）"""
+        store = cls()
+        for record in records:
+            store.append(record)
+        return store
+    
+    def _intern(self, value: str) -> str:
+        return self._grammar_pool.setdefault(value, value)
+    
+    def append(self, record) -> None:
+        with self._lock:
+            self.columns['english'].append(record['english'])
+            self.columns['japanese'].append(record['japanese'])
+            self.columns['grammar'].append(self._intern(record['grammar']))
+            self._incomplete += is_incomplete(record)
+            self._version += 1
+    
+    def set_field(self, index: int, field: str, value: str) -> None:
+        """1文の1つの欄を更新"""
+        with self._lock:
+            record = SentenceRecord(self, index)
+            was_incomplete = is_incomplete(record)
+            self.columns[field][index] = self._intern(value) if field == 'grammar' else value
+            self._incomplete += is_incomplete(record) - was_incomplete
+            self._version += 1
+    
+    def __len__(self) -> int:
+        return len(self.columns['english'])
+    
+    def __getitem__(self, index: int) -> SentenceRecord:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return SentenceRecord(self, index)
+    
+    def __iter__(self) -> Iterator[SentenceRecord]:
+        for i in range(len(self)):
+            yield SentenceRecord(self, i)
+    
+    def incomplete_count(self) -> int:
+        """日本語訳または文法ポイントが未入力の文の数"""
+        return self._incomplete
+    
+    def build_category_index(self) -> 'GrammarCategoryIndex':
+        """文法・語彙のポイントから文法カテゴリーインデックスを作成"""
+        return GrammarCategoryIndex(self)
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """列のリストと、そこから参照される文字列の合計バイト数（変更がなければ前回の結果を使う）"""
+        with self._lock:
+            if self._memory_cache is not None and self._memory_cache[0] == self._version:
+                return self._memory_cache[1]
+            seen = set()
+            total = 0
+            for column in self.columns.values():
+                total += sys.getsizeof(column)
+                for value in column:
+                    if id(value) not in seen:
+                        seen.add(id(value))
+                        total += sys.getsizeof(value)
+            usage = {
+                'bytes': total,
+                'sentences': len(self.columns['english']),
+                'unique_grammar': len(self._grammar_pool)
+            }
+            self._memory_cache = (self._version, usage)
+            return usage
 
 # ヘルパー関数
+def page_bounds(total: int, page_size: int, page_number: int) -> Tuple[int, int, int]:
+    """件数とページ番号から、ページ数・範囲内に収めたページ番号・そのページの先頭の位置を返す"""
+    total_pages = max(1, -(-total // page_size))
+    page_number = min(max(page_number, 1), total_pages)
+    return total_pages, page_number, (page_number - 1) * page_size
+
+def jump_position(indices: Sequence[int], target: int, ranked: bool = False) -> Optional[int]:
+    """表示対象の中で、指定した文（なければそれ以降で最初の文、それもなければ最後の文）の位置"""
+    if ranked:
+        # 検索結果は関連度順のため、指定した文以降で番号が最も近い文を探す
+        following = [p for p, i in enumerate(indices) if i >= target]
+        position = min(following, key=lambda p: indices[p]) if following else len(indices) - 1
+    else:
+        position = bisect.bisect_left(indices, target)
+    if position >= len(indices):
+        position = len(indices) - 1
+    return position if position >= 0 else None
+
+def create_executor(max_workers: int) -> ThreadPoolExecutor:
+    """Streamlitの実行コンテキストを引き継ぐスレッドプールを作成"""
+    # ワーカースレッドからもst.errorなどを表示できるように実行コンテキストを引き継ぐ
+    ctx = get_script_run_ctx()
+    
+    def attach_ctx():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+    
+    return ThreadPoolExecutor(max_workers=max(1, max_workers), initializer=attach_ctx)
+
 def parse_tsv_content(content: str) -> List[Dict[str, str]]:
     """TSVファイルの内容を解析"""
-    sentences = []
-    lines = content.strip().split('\n')
-    
-    # ヘッダー行をスキップ
-    start_index = 0
-    if lines and lines[0].strip():
-        first_line = lines[0].lower()
-        # 最初のタブ区切りの要素をチェック
-        parts = lines[0].split('\t')
-        if len(parts) >= 4:  # インデックス + 3つのカラム
-            # 2番目の要素が「英文」というヘッダーかチェック
-            if parts[1].strip() == '英文':
-                start_index = 1
-        elif 'english' in first_line or 'japanese' in first_line or 'grammar' in first_line:
-            start_index = 1
-    
-    for i in range(start_index, len(lines)):
-        line = lines[i]
-        if line.strip():
+    return list(iter_tsv_records(io.StringIO(content)))
+
+def iter_content_lines(lines: Iterable[str]) -> Iterator[str]:
+    """空行を除いた行を返す（全文をstrip()した場合と同じく、先頭行の前と最終行の後の空白は除く）"""
+    pending = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if pending is None:
+            line = line.lstrip()
+        else:
+            yield pending
+        pending = line
+    if pending is not None:
+        yield pending.rstrip()
+
+def iter_tsv_records(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """TSVを1行ずつ読み込み、文を順に返す"""
+    first = True
+    for line in iter_content_lines(lines):
+        if first:
+            first = False
+            # ヘッダー行をスキップ
+            first_line = line.lower()
+            # 最初のタブ区切りの要素をチェック
             parts = line.split('\t')
-            # インデックス番号がある場合は、2番目の要素から取得
-            if len(parts) >= 4 and parts[0].strip().isdigit():
-                sentence = {
-                    'english': parts[1].strip() if parts[1] else '',
-                    'japanese': parts[2].strip() if len(parts) > 2 and parts[2] else '',
-                    'grammar': parts[3].strip() if len(parts) > 3 and parts[3] else ''
-                }
-            elif len(parts) >= 3:
-                sentence = {
-                    'english': parts[0].strip() if parts[0] else '',
-                    'japanese': parts[1].strip() if len(parts) > 1 and parts[1] else '',
-                    'grammar': parts[2].strip() if len(parts) > 2 and parts[2] else ''
-                }
-            else:
+            if len(parts) >= 4:  # インデックス + 3つのカラム
+                # 2番目の要素が「英文」というヘッダーかチェック
+                if parts[1].strip() == '英文':
+                    continue
+            elif 'english' in first_line or 'japanese' in first_line or 'grammar' in first_line:
                 continue
-            
-            # 空の英文はスキップ
-            if sentence['english'] and sentence['english'] not in ['英文', 'english']:
-                sentences.append(sentence)
-    
-    return sentences
+        
+        parts = line.split('\t')
+        # インデックス番号がある場合は、2番目の要素から取得
+        if len(parts) >= 4 and parts[0].strip().isdigit():
+            sentence = {
+                'english': parts[1].strip() if parts[1] else '',
+                'japanese': parts[2].strip() if len(parts) > 2 and parts[2] else '',
+                'grammar': parts[3].strip() if len(parts) > 3 and parts[3] else ''
+            }
+        elif len(parts) >= 3:
+            sentence = {
+                'english': parts[0].strip() if parts[0] else '',
+                'japanese': parts[1].strip() if len(parts) > 1 and parts[1] else '',
+                'grammar': parts[2].strip() if len(parts) > 2 and parts[2] else ''
+            }
+        else:
+            continue
+        
+        # 空の英文はスキップ
+        if sentence['english'] and sentence['english'] not in ['英文', 'english']:
+            yield sentence
+
+def json_item_to_sentence(item: Dict) -> Dict[str, str]:
+    """JSONの1要素を文の辞書に変換"""
+    return {
+        'english': str(item.get('english', item.get('text', item.get('sentence', '')))),
+        'japanese': str(item.get('japanese', item.get('translation', ''))),
+        'grammar': str(item.get('grammar', item.get('grammar_points', '')))
+    }
 
 def parse_json_content(content: str) -> List[Dict[str, str]]:
     """JSONファイルの内容を解析"""
     try:
-        data = json.loads(content)
-        
-        if isinstance(data, list):
-            sentences = []
-            for item in data:
-                if isinstance(item, dict):
-                    sentence = {
-                        'english': str(item.get('english', item.get('text', item.get('sentence', '')))),
-                        'japanese': str(item.get('japanese', item.get('translation', ''))),
-                        'grammar': str(item.get('grammar', item.get('grammar_points', '')))
-                    }
-                    sentences.append(sentence)
-            return sentences
-        elif isinstance(data, dict) and 'sentences' in data:
-            return parse_json_content(json.dumps(data['sentences']))
-    except:
-        pass
-    return []
+        return list(iter_json_records(io.StringIO(content)))
+    except ValueError:
+        return []
+
+class JsonStreamReader:
+    """テキストストリームを少しずつ読みながらJSONの値を1つずつ取り出す"""
+    
+    def __init__(self, stream: TextIO, chunk_size: int = 65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+    
+    def _fill(self) -> bool:
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # 読み終えた部分は捨てて、バッファが入力全体に膨らまないようにする
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+    
+    def peek(self) -> str:
+        """空白を読み飛ばし、次の文字を返す（終端なら空文字列）"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+    
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"JSONの解析に失敗しました: '{char}'が必要です")
+        self.pos += 1
+    
+    def value(self):
+        """次のJSONの値を1つ読み込む"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # 数値などはバッファの終端で途切れている可能性がある
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+    
+    def items(self) -> Iterator:
+        """JSON配列の要素を1つずつ返す"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError("JSONの解析に失敗しました: 配列が正しく閉じられていません")
+
+def iter_json_records(stream: TextIO) -> Iterator[Dict[str, str]]:
+    """JSON（文の配列、または"sentences"キーを持つオブジェクト）を少しずつ読み込み、文を順に返す"""
+    reader = JsonStreamReader(stream)
+    yield from _iter_json_value_records(reader)
+
+def _iter_json_value_records(reader: JsonStreamReader) -> Iterator[Dict[str, str]]:
+    char = reader.peek()
+    if char == '[':
+        for item in reader.items():
+            if isinstance(item, dict):
+                yield json_item_to_sentence(item)
+    elif char == '{':
+        # "sentences"キーの配列だけを読み込み、それ以外の値は読み飛ばす
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key == 'sentences':
+                yield from _iter_json_value_records(reader)
+                return
+            reader.value()
+            char = reader.peek()
+            reader.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError("JSONの解析に失敗しました: オブジェクトが正しく閉じられていません")
+    else:
+        reader.value()
+
+def iter_json_lines_records(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """JSON Lines（1行に1つのJSONオブジェクト）を1行ずつ読み込み、文を順に返す"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(item, dict):
+            yield json_item_to_sentence(item)
 
 def parse_pipe_text(content: str) -> List[Dict[str, str]]:
     """パイプ区切りテキストを解析"""
-    sentences = []
-    lines = content.strip().split('\n')
-    
+    return list(iter_pipe_records(io.StringIO(content)))
+
+def iter_pipe_records(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """パイプ区切りテキストを1行ずつ読み込み、文を順に返す"""
     for line in lines:
         line = line.strip()
         if line and '｜' in line:
             line = re.sub(r'^\d+[.、]\s*', '', line)
             parts = line.split('｜')
             if len(parts) >= 1:
-                sentence = {
+                yield {
                     'english': parts[0].strip(),
                     'japanese': parts[1].strip() if len(parts) > 1 else '',
                     'grammar': parts[2].strip() if len(parts) > 2 else ''
                 }
-                sentences.append(sentence)
-    
-    return sentences
 
-def split_text_with_llm(text: str) -> List[str]:
-    """GPT-4o-miniを使用してテキストを適切な文単位に分割"""
+@contextlib.contextmanager
+def open_text_stream(stream: BinaryIO) -> Iterator[TextIO]:
+    """バイナリストリームをUTF-8のテキストとして読む（元のストリームは閉じない）"""
+    stream.seek(0)
+    wrapper = io.TextIOWrapper(stream, encoding='utf-8')
     try:
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            # API Keyがない場合は簡易的な分割を行う
-            return simple_split_sentences(text)
-        
-        client = openai.OpenAI(api_key=api_key)
-        
-        prompt = f"""以下のテキストを、意味のある文単位に正確に分割してください。
-各文は独立して理解できる完全な文になるようにしてください。
-略語（Dr., Mr., etc.）や数字（1.5, 3:00）に注意してください。
+        yield wrapper
+    finally:
+        wrapper.detach()
 
-テキスト:
-{text}
+def hash_stream(stream: BinaryIO, chunk_size: int = 1 << 20) -> str:
+    """ストリームの内容のSHA-256を少しずつ読みながら計算"""
+    stream.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
 
-以下の形式で、分割された文を1行ずつ出力してください：
-1. [最初の文]
-2. [2番目の文]
-3. [3番目の文]
-...以下同様"""
+def split_chunk_with_llm(
+    text: str,
+    cache: Optional[LLMCache] = None,
+    scheduler: Optional[RequestScheduler] = None
+) -> List[str]:
+    """GPT-4o-miniを使用して1つのチャンクを適切な文単位に分割"""
+    try:
+        if scheduler is None:
+            scheduler = get_default_scheduler()
+            if scheduler is None:
+                # API Keyがない場合は簡易的な分割を行う
+                return simple_split_sentences(text)
+        
+        if cache is None:
+            cache = get_llm_cache()
+        cache_key = LLMCache.make_key(LLM_MODEL, SPLIT_PROMPT_TEMPLATE, SPLIT_TEMPERATURE, text)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        prompt = SPLIT_PROMPT_TEMPLATE.format(text=text)
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        response = scheduler.chat(
             messages=[
-                {"role": "system", "content": "あなたは英文を適切に分割する専門家です。"},
+                {"role": "system", "content": SPLIT_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.3,
+            temperature=SPLIT_TEMPERATURE,
             max_tokens=2000
         )
         
         content = response.choices[0].message.content
+        if response.choices[0].finish_reason == 'length':
+            # 出力が途中で切れた場合は文が失われるので簡易分割を使う
+            return simple_split_sentences(text)
+        
         sentences = []
         
         # レスポンスから文を抽出
@@ -241,12 +1104,78 @@ def split_text_with_llm(text: str) -> List[str]:
                 if sentence:
                     sentences.append(sentence)
         
-        return sentences if sentences else simple_split_sentences(text)
+        # 文の欠落がないか、英数字の量で出力が入力をほぼ網羅しているか確認する
+        if not sentences or count_word_chars(' '.join(sentences)) < count_word_chars(text) * 0.9:
+            return simple_split_sentences(text)
+        
+        cache.set(cache_key, sentences)
+        return sentences
         
     except Exception as e:
         st.warning(f"LLMでの文分割に失敗しました。簡易分割を使用します。")
         return simple_split_sentences(text)
 
+def count_word_chars(text: str) -> int:
+    """空白・記号を除いた文字数を数える"""
+    return len(re.findall(r'\w', text))
+
+def chunk_text(text: str, max_chars: int = SPLIT_CHUNK_CHARS) -> List[str]:
+    """段落の区切りでテキストをチャンクに分ける（長すぎる段落は簡易分割した文単位で分ける）"""
+    chunks = []
+    current = []
+    current_len = 0
+    
+    def flush():
+        nonlocal current, current_len
+        if current:
+            chunks.append('\n\n'.join(current))
+            current = []
+            current_len = 0
+    
+    for paragraph in re.split(r'\n\s*\n', text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > max_chars:
+            # 長い段落は文の境界で区切る
+            pieces = simple_split_sentences(paragraph)
+        else:
+            pieces = [paragraph]
+        for piece in pieces:
+            if current and current_len + len(piece) > max_chars:
+                flush()
+            current.append(piece)
+            current_len += len(piece)
+    flush()
+    
+    return chunks
+
+def split_text_with_llm(
+    text: str,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    cache: Optional[LLMCache] = None,
+    scheduler: Optional[RequestScheduler] = None
+) -> List[str]:
+    """テキストを段落単位のチャンクに分け、GPT-4o-miniで並行して文分割して順番に結合"""
+    if scheduler is None:
+        scheduler = get_default_scheduler()
+        if scheduler is None:
+            # API Keyがない場合は簡易的な分割を行う
+            return simple_split_sentences(text)
+    
+    if cache is None:
+        cache = get_llm_cache()
+    chunks = chunk_text(text)
+    if len(chunks) <= 1:
+        return split_chunk_with_llm(text, cache, scheduler)
+    
+    with create_executor(min(max_concurrency, len(chunks))) as executor:
+        results = list(executor.map(
+            lambda chunk: split_chunk_with_llm(chunk, cache, scheduler), chunks
+        ))
+    
+    return [sentence for chunk_sentences in results for sentence in chunk_sentences]
+
 def simple_split_sentences(text: str) -> List[str]:
     """簡易的な文分割（フォールバック用）"""
     # 改行で分割
@@ -263,12 +1192,17 @@ def simple_split_sentences(text: str) -> List[str]:
     
     return sentences
 
-def parse_plain_text(content: str) -> List[Dict[str, str]]:
+def parse_plain_text(
+    content: str,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    cache: Optional[LLMCache] = None,
+    scheduler: Optional[RequestScheduler] = None
+) -> List[Dict[str, str]]:
     """プレーンテキストを解析"""
     sentences = []
     
     # LLMを使って文を分割
-    split_sentences = split_text_with_llm(content)
+    split_sentences = split_text_with_llm(content, max_concurrency, cache, scheduler)
     
     for sentence_text in split_sentences:
         if sentence_text:
@@ -281,127 +1215,2130 @@ def parse_plain_text(content: str) -> List[Dict[str, str]]:
     
     return sentences
 
-def generate_translation_and_grammar(english_text: str) -> Dict[str, str]:
-    """GPT-4o-miniを使用して日本語訳と文法・語彙ポイントを生成"""
+def parse_uploaded_file(
+    name: str,
+    stream: BinaryIO,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    cache: Optional[LLMCache] = None,
+    scheduler: Optional[RequestScheduler] = None
+) -> SentenceStore:
+    """アップロードされたファイルを拡張子と内容に応じて、少しずつ読み込みながら解析"""
+    if name.endswith(PREPARED_CORPUS_EXTENSION):
+        try:
+            return open_prepared_corpus(stream)
+        except ValueError:
+            return SentenceStore()
+    
+    with open_text_stream(stream) as text:
+        if name.endswith('.tsv'):
+            return SentenceStore.from_records(iter_tsv_records(text))
+        elif name.endswith('.jsonl'):
+            return SentenceStore.from_records(iter_json_lines_records(text))
+        elif name.endswith('.json'):
+            try:
+                return SentenceStore.from_records(iter_json_records(text))
+            except ValueError:
+                return SentenceStore()
+        # パイプ区切りかどうかは、行を保持せずに1度読み流して判定する
+        is_pipe = any('｜' in line for line in text)
+    
+    with open_text_stream(stream) as text:
+        if is_pipe:
+            return SentenceStore.from_records(iter_pipe_records(text))
+        # プレーンテキストは文分割に全文が必要なため、まとめて読み込む
+        return SentenceStore.from_records(parse_plain_text(
+            text.read(), max_concurrency, cache, scheduler
+        ))
+
+def generate_translation_and_grammar(
+    english_text: str,
+    cache: Optional[LLMCache] = None,
+    scheduler: Optional[RequestScheduler] = None,
+    cancel_event: Optional[threading.Event] = None
+) -> Dict[str, str]:
+    """GPT-4o-miniを使用して日本語訳と文法・語彙ポイントを生成（APIキーがない場合はルールで文法ポイントのみ作る）"""
     try:
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            return {'japanese': '', 'grammar': ''}
+        if scheduler is None:
+            scheduler = get_default_scheduler()
+            if scheduler is None:
+                return rule_based_annotation(english_text)
         
-        client = openai.OpenAI(api_key=api_key)
+        if cache is None:
+            cache = get_llm_cache()
+        cache_key = LLMCache.make_key(
+            LLM_MODEL, TRANSLATION_PROMPT_TEMPLATE, TRANSLATION_TEMPERATURE, english_text
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        prompt = f"""以下の英文について、日本語訳と文法・語彙のポイントを提供してください。
-
-英文: {english_text}
-
-以下の形式で回答してください：
-日本語訳: [自然な日本語訳]
-文法・語彙のポイント: [重要な文法事項、語彙、表現の解説]"""
+        prompt = TRANSLATION_PROMPT_TEMPLATE.format(text=english_text)
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        response = scheduler.chat(
             messages=[
-                {"role": "system", "content": "あなたは英語教育の専門家です。"},
+                {"role": "system", "content": TRANSLATION_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.7,
-            max_tokens=500
+            temperature=TRANSLATION_TEMPERATURE,
+            max_tokens=500,
+            cancel_event=cancel_event
         )
         
-        content = response.choices[0].message.content
-        
-        # レスポンスを解析
-        japanese = ''
-        grammar = ''
-        
-        lines = content.split('\n')
-        for i, line in enumerate(lines):
-            if line.startswith('日本語訳:'):
-                japanese = line.replace('日本語訳:', '').strip()
-            elif line.startswith('文法・語彙のポイント:'):
-                grammar = line.replace('文法・語彙のポイント:', '').strip()
-                # 複数行にわたる場合の処理
-                for j in range(i+1, len(lines)):
-                    if lines[j].strip() and not lines[j].startswith('日本語訳:'):
-                        grammar += ' ' + lines[j].strip()
-        
-        return {'japanese': japanese, 'grammar': grammar}
+        result = parse_translation_response(response.choices[0].message.content)
+        # 解析に成功した応答のみキャッシュする
+        if result['japanese']:
+            cache.set(cache_key, result)
+        return result
         
+    except RequestCancelled:
+        raise
     except Exception as e:
         st.error(f"GPT-4o-miniでの生成エラー: {str(e)}")
-        return {'japanese': '', 'grammar': ''}
+        return failed_annotation(english_text)
 
-def highlight_grammar_points(text: str) -> str:
-    """文法ポイントをハイライト"""
-    # 接続詞
-    conjunctions = ['However', 'Therefore', 'Although', 'Because', 'Since', 'While', 'When', 'If', 'Unless', 'As']
-    for conj in conjunctions:
-        text = text.replace(conj, f'<span class="highlight">{conj}</span>')
+def parse_translation_response(content: str) -> Dict[str, str]:
+    """「日本語訳:」「文法・語彙のポイント:」形式の応答を解析（途中までの応答にも対応）"""
+    japanese = ''
+    grammar = ''
     
-    # 関係詞
-    relatives = ['which', 'who', 'whom', 'whose', 'that', 'where', 'when']
-    for rel in relatives:
-        pattern = r'\b' + rel + r'\b'
-        text = re.sub(pattern, f'<span class="highlight">{rel}</span>', text, flags=re.IGNORECASE)
+    lines = content.split('\n')
+    for i, line in enumerate(lines):
+        if line.startswith('日本語訳:'):
+            japanese = line.replace('日本語訳:', '').strip()
+        elif line.startswith('文法・語彙のポイント:'):
+            grammar = line.replace('文法・語彙のポイント:', '').strip()
+            # 複数行にわたる場合の処理
+            for j in range(i+1, len(lines)):
+                if lines[j].strip() and not lines[j].startswith('日本語訳:'):
+                    grammar += ' ' + lines[j].strip()
     
-    return text
+    return {'japanese': japanese, 'grammar': grammar}
 
-def extract_grammar_categories(sentences: List[Dict[str, str]]) -> List[str]:
-    """文法カテゴリーを抽出"""
-    categories = set()
-    grammar_patterns = {
-        '現在完了形': r'現在完了|have\s+\w+ed|has\s+\w+ed',
-        '過去完了形': r'過去完了|had\s+\w+ed',
-        '関係詞': r'関係[代名]?詞|which|who|whom|whose|that節',
-        '仮定法': r'仮定法|would\s+have|could\s+have|should\s+have',
-        '受動態': r'受[動身]態|be\s+\w+ed|was\s+\w+ed|were\s+\w+ed',
-        '不定詞': r'不定詞|to\s+\w+',
-        '動名詞': r'動名詞|ing形',
-        '分詞構文': r'分詞構文|ing\s*句',
-        '比較級': r'比較級|more\s+\w+|er\s+than',
-        '最上級': r'最上級|most\s+\w+|est'
-    }
+def stream_translation_and_grammar(
+    english_text: str,
+    cache: Optional[LLMCache] = None,
+    scheduler: Optional[RequestScheduler] = None
+) -> Iterator[Dict[str, str]]:
+    """日本語訳と文法・語彙ポイントをストリーミングで生成し、途中経過を順に返す"""
+    if cache is None:
+        cache = get_llm_cache()
+    cache_key = LLMCache.make_key(
+        LLM_MODEL, TRANSLATION_PROMPT_TEMPLATE, TRANSLATION_TEMPERATURE, english_text
+    )
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
     
-    for sentence in sentences:
-        grammar_text = sentence.get('grammar', '')
-        for category, pattern in grammar_patterns.items():
-            if re.search(pattern, grammar_text, re.IGNORECASE):
-                categories.add(category)
+    if scheduler is None:
+        scheduler = get_default_scheduler()
+        if scheduler is None:
+            yield rule_based_annotation(english_text)
+            return
     
-    return sorted(list(categories))
+    content = ''
+    result = {'japanese': '', 'grammar': ''}
+    for delta in scheduler.chat_stream(
+        messages=[
+            {"role": "system", "content": TRANSLATION_SYSTEM_PROMPT},
+            {"role": "user", "content": TRANSLATION_PROMPT_TEMPLATE.format(text=english_text)}
+        ],
+        temperature=TRANSLATION_TEMPERATURE,
+        max_tokens=500
+    ):
+        content += delta
+        result = parse_translation_response(content)
+        yield result
+    
+    if result['japanese']:
+        cache.set(cache_key, result)
 
-def display_sentence(index: int, sentence: Dict[str, str]):
-    """文を表示"""
-    with st.container():
-        st.markdown(f'<div class="sentence-card">', unsafe_allow_html=True)
-        st.markdown(f'<span class="sentence-number">文 {index + 1}</span>', unsafe_allow_html=True)
+def estimate_tokens(text: str) -> int:
+    """トークン数を概算（英数字は約4文字、日本語などは約1文字で1トークン）"""
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+def make_batches(
+    texts: List[str],
+    token_budget: int = BATCH_TOKEN_BUDGET,
+    max_size: int = BATCH_MAX_SIZE
+) -> List[List[int]]:
+    """入力と出力の推定トークン数が予算に収まるように文のインデックスをまとめる"""
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text) + BATCH_OUTPUT_TOKENS_PER_SENTENCE
+        if current and (current_tokens + cost > token_budget or len(current) >= max_size):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += cost
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_batch_response(content: str, count: int) -> List[Optional[Dict[str, str]]]:
+    """バッチ応答のJSONを文ごとの結果に分解（解析できなかった文はNone）"""
+    results = [None] * count
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return results
+    
+    items = data.get('results', []) if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return results
+    
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            position = int(item.get('id', 0)) - 1
+        except (TypeError, ValueError):
+            continue
+        japanese = str(item.get('japanese') or '').strip()
+        grammar = str(item.get('grammar') or '').strip()
+        if 0 <= position < count and japanese:
+            results[position] = {'japanese': japanese, 'grammar': grammar}
+    return results
+
+def generate_translations_batch(
+    english_texts: List[str],
+    cache: Optional[LLMCache] = None,
+    scheduler: Optional[RequestScheduler] = None,
+    cancel_event: Optional[threading.Event] = None
+) -> List[Dict[str, str]]:
+    """複数の英文を1回のリクエストにまとめて日本語訳と文法・語彙ポイントを生成"""
+    results: List[Optional[Dict[str, str]]] = [None] * len(english_texts)
+    
+    if scheduler is None:
+        scheduler = get_default_scheduler()
+        if scheduler is None:
+            return [rule_based_annotation(text) for text in english_texts]
+    
+    if cache is None:
+        cache = get_llm_cache()
+    cache_keys = [
+        LLMCache.make_key(LLM_MODEL, BATCH_PROMPT_TEMPLATE, TRANSLATION_TEMPERATURE, text)
+        for text in english_texts
+    ]
+    for i, key in enumerate(cache_keys):
+        # 1文ずつ生成された結果（バッチで解析に失敗した文の再試行分を含む）も利用する
+        results[i] = cache.get(key) or cache.get(LLMCache.make_key(
+            LLM_MODEL, TRANSLATION_PROMPT_TEMPLATE, TRANSLATION_TEMPERATURE, english_texts[i]
+        ))
+    
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        numbered = '\n'.join(
+            f"{n}. {english_texts[i]}" for n, i in enumerate(pending, start=1)
+        )
+        try:
+            response = scheduler.chat(
+                messages=[
+                    {"role": "system", "content": TRANSLATION_SYSTEM_PROMPT},
+                    {"role": "user", "content": BATCH_PROMPT_TEMPLATE.format(text=numbered)}
+                ],
+                temperature=TRANSLATION_TEMPERATURE,
+                max_tokens=BATCH_OUTPUT_TOKENS_PER_SENTENCE * len(pending),
+                response_format={"type": "json_object"},
+                cancel_event=cancel_event
+            )
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            # リトライしても失敗した場合は、1文ずつ再試行せずに失敗として返す
+            st.error(f"GPT-4o-miniでの一括生成エラー: {str(e)}")
+            return [result or failed_annotation(text) for result, text in zip(results, english_texts)]
         
-        # 英文
-        english_highlighted = highlight_grammar_points(sentence['english'])
-        st.markdown(f'<div class="english-text">{english_highlighted}</div>', unsafe_allow_html=True)
+        parsed = parse_batch_response(response.choices[0].message.content, len(pending))
         
-        if st.session_state.edit_mode:
-            # 編集モード
-            col1, col2 = st.columns(2)
-            with col1:
-                new_japanese = st.text_area(
-                    "日本語訳",
-                    value=sentence['japanese'],
-                    key=f"japanese_{index}",
-                    height=100
-                )
-            with col2:
-                new_grammar = st.text_area(
-                    "文法・語彙",
-                    value=sentence['grammar'],
-                    key=f"grammar_{index}",
-                    height=100
-                )
-            
-            if st.button("💾 保存", key=f"save_{index}", on_click=save_edit, args=(index,)):
-                st.success("保存しました")
-        else:
-            # 表示モード
+        for i, result in zip(pending, parsed):
+            if result is not None:
+                results[i] = result
+                cache.set(cache_keys[i], result)
+    
+    # 解析に失敗した文だけを1文ずつ再試行する
+    for i, result in enumerate(results):
+        if result is None:
+            results[i] = generate_translation_and_grammar(english_texts[i], cache, scheduler, cancel_event)
+    
+    return results
+
+def annotate_sentences(
+    sentences: List[Dict[str, str]],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    batch_mode: bool = True,
+    result_callback: Optional[Callable[[int, Dict[str, str]], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    cache: Optional[LLMCache] = None,
+    checkpoint: Optional['AnnotationCheckpoint'] = None,
+    scheduler: Optional[RequestScheduler] = None,
+    near_duplicates: bool = False,
+    dedup_callback: Optional[Callable[[Dict[str, int]], None]] = None,
+    rules_first: bool = False
+) -> List[Dict[str, str]]:
+    """日本語訳・文法ポイントが未入力の文をスレッドプールで並行して生成し、元の順序で書き戻す"""
+    all_targets = annotation_targets(sentences)
+    total = len(all_targets)
+    if total == 0:
+        return sentences
+    
+    def apply(i: int, result: Dict[str, str]) -> None:
+        # 既に入力されている欄は上書きしない（ルールで作った文法ポイントはAPIの結果で置き換える）
+        if not sentences[i]['japanese']:
+            sentences[i]['japanese'] = result['japanese']
+        if not sentences[i]['grammar'] or (
+            result['grammar'] and not result.get('rule_based') and has_rule_based_grammar(sentences[i])
+        ):
+            sentences[i]['grammar'] = result['grammar']
+        if checkpoint is not None and result['japanese']:
+            checkpoint.record(i, sentences[i])
+        if result_callback:
+            result_callback(i, result)
+    
+    # 重複する文は代表の1文だけを生成し、残りは代表の結果や入力済みの同じ文の結果を使う
+    plan = plan_deduplication(sentences, all_targets, near_duplicates)
+    if dedup_callback:
+        dedup_callback(plan.stats())
+    for i, source in plan.reused.items():
+        apply(i, {'japanese': sentences[source]['japanese'], 'grammar': sentences[source]['grammar']})
+    done = len(plan.reused)
+    targets = plan.representatives
+    
+    # ワーカースレッドではst.cache_resourceが使えない場合があるため、ここで取得して渡す
+    if scheduler is None:
+        scheduler = get_default_scheduler()
+    
+    # ルールで文法ポイントを作れる文はすぐに埋め、APIはルールで判定できない文の生成だけに使う
+    # （APIが使えない場合は、全ての文をルールだけで処理する）
+    if rules_first or scheduler is None:
+        remaining = []
+        for i in targets:
+            result = rule_based_annotation(sentences[i]['english'])
+            # 入力済みの文法ポイントがある文は、以前ルールで作ったものでなければAPIで日本語訳を生成する
+            if not result['grammar'] or sentences[i]['grammar'] not in ('', result['grammar']):
+                remaining.append(i)
+                continue
+            apply(i, result)
+            for duplicate in plan.duplicates.get(i, ()):
+                apply(duplicate, result)
+            done += 1 + len(plan.duplicates.get(i, ()))
+        targets = remaining if scheduler is not None else []
+    
+    if progress_callback and done:
+        progress_callback(done, total)
+    if not targets:
+        return sentences
+    
+    if cache is None:
+        cache = get_llm_cache()
+    
+    # バッチモードでは複数の文を1リクエストにまとめ、1文ずつの場合はバッチサイズ1とする
+    # 最初の文はすぐに表示できるよう単独で生成する
+    if batch_mode and len(targets) > 1:
+        rest = targets[1:]
+        batches = [[targets[0]]] + [
+            [rest[j] for j in batch]
+            for batch in make_batches([sentences[i]['english'] for i in rest])
+        ]
+    else:
+        batches = [[i] for i in targets]
+    
+    def run_batch(batch: List[int]) -> List[Dict[str, str]]:
+        if cancel_event is not None and cancel_event.is_set():
+            return []
+        texts = [sentences[i]['english'] for i in batch]
+        # 取り消された場合は、実行中のバッチでも次のリクエスト（リトライ・待機を含む）の前に中断する
+        try:
+            if len(batch) == 1:
+                return [generate_translation_and_grammar(texts[0], cache, scheduler, cancel_event)]
+            return generate_translations_batch(texts, cache, scheduler, cancel_event)
+        except RequestCancelled:
+            return []
+    
+    with create_executor(min(max_concurrency, len(batches))) as executor:
+        futures = {executor.submit(run_batch, batch): batch for batch in batches}
+        # 進捗の更新はメインスレッドで行う
+        for future in as_completed(futures):
+            batch = futures[future]
+            for i, result in zip(batch, future.result()):
+                apply(i, result)
+                for duplicate in plan.duplicates.get(i, ()):
+                    apply(duplicate, result)
+            done += sum(1 + len(plan.duplicates.get(i, ())) for i in batch)
+            if progress_callback:
+                progress_callback(done, total)
+    
+    return sentences
+
+def normalize_sentence(text: str) -> str:
+    """空白と大文字小文字の違いを除いた重複判定用の文"""
+    return ' '.join(text.split()).lower()
+
+class NearDuplicateIndex:
+    """文字n-gramのMinHashで候補を絞り込み、Jaccard係数でほぼ同じ文を探すインデックス"""
+    
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                 num_perm: int = MINHASH_NUM_PERM, bands: int = MINHASH_BANDS):
+        self.threshold = threshold
+        self.bins = num_perm
+        self.rows = num_perm // bands
+        self._buckets: Dict[tuple, List[int]] = {}
+        self._shingles: Dict[int, frozenset] = {}
+    
+    @staticmethod
+    def shingles(text: str) -> frozenset:
+        text = re.sub(r'[^\w]+', ' ', normalize_sentence(text)).strip()
+        if len(text) <= NEAR_DUPLICATE_SHINGLE_SIZE:
+            return frozenset([text])
+        return frozenset(
+            text[i:i + NEAR_DUPLICATE_SHINGLE_SIZE]
+            for i in range(len(text) - NEAR_DUPLICATE_SHINGLE_SIZE + 1)
+        )
+    
+    def _band_keys(self, shingles: frozenset) -> List[tuple]:
+        # 1回のハッシュで署名を作るため、ハッシュ値を区間に振り分けて区間ごとの最小値を取る
+        empty = 1 << 64
+        signature = [empty] * self.bins
+        for shingle in shingles:
+            h = hash(shingle) & 0xFFFFFFFFFFFFFFFF
+            b = h % self.bins
+            value = h // self.bins
+            if value < signature[b]:
+                signature[b] = value
+        # 空の区間は右隣の空でない区間の値で埋める（短い文でも署名が揃うようにする）
+        if empty in signature:
+            original = list(signature)
+            for b in range(self.bins):
+                if original[b] == empty:
+                    offset = 1
+                    while original[(b + offset) % self.bins] == empty:
+                        offset += 1
+                    signature[b] = (original[(b + offset) % self.bins], offset)
+        return [
+            (band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+            for band in range(self.bins // self.rows)
+        ]
+    
+    def add(self, key: int, text: str) -> None:
+        self.find_or_add(key, text, find=False)
+    
+    def find_or_add(self, key: int, text: str, find: bool = True) -> Optional[int]:
+        """類似度が閾値以上で最も近い登録済みの文のキーを返し、なければこの文を登録してNoneを返す"""
+        shingles = self.shingles(text)
+        band_keys = self._band_keys(shingles)
+        if find:
+            similar = self._find(shingles, band_keys)
+            if similar is not None:
+                return similar
+        self._shingles[key] = shingles
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(key)
+        return None
+    
+    def _find(self, shingles: frozenset, band_keys: List[tuple]) -> Optional[int]:
+        candidates = set()
+        for band_key in band_keys:
+            candidates.update(self._buckets.get(band_key, ()))
+        best, best_similarity = None, self.threshold
+        for key in sorted(candidates):
+            other = self._shingles[key]
+            similarity = len(shingles & other) / len(shingles | other)
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return best
+
+class DeduplicationPlan:
+    """生成する代表の文と、その結果を使い回す文の対応"""
+    
+    def __init__(self):
+        self.representatives: List[int] = []
+        # 代表の文 → 同じ結果を使う文
+        self.duplicates: Dict[int, List[int]] = {}
+        # 入力済みの文の結果をそのまま使う文 → 入力済みの文
+        self.reused: Dict[int, int] = {}
+        self.exact = 0
+        self.near = 0
+    
+    def stats(self) -> Dict[str, int]:
+        """重複の除去で生成を省略した文の数"""
+        return {
+            'skipped': self.exact + self.near,
+            'exact': self.exact,
+            'near': self.near
+        }
+
+def plan_deduplication(sentences, targets: List[int], near_duplicates: bool = False) -> DeduplicationPlan:
+    """同じ文（空白・大文字小文字の違いを除く）、必要ならほぼ同じ文をまとめて、生成する文を決める"""
+    plan = DeduplicationPlan()
+    target_set = set(targets)
+    # 入力済みの文は、重複する未入力の文の結果として使える
+    completed: Dict[str, int] = {}
+    near_index = NearDuplicateIndex() if near_duplicates else None
+    for i, sentence in enumerate(sentences):
+        if i not in target_set and sentence['japanese'] and sentence['grammar']:
+            key = normalize_sentence(sentence['english'])
+            if key not in completed:
+                completed[key] = i
+                if near_index is not None:
+                    near_index.add(i, sentence['english'])
+    
+    representatives: Dict[str, int] = {}
+    for i in targets:
+        key = normalize_sentence(sentences[i]['english'])
+        if key in completed:
+            plan.reused[i] = completed[key]
+            plan.exact += 1
+        elif key in representatives:
+            plan.duplicates[representatives[key]].append(i)
+            plan.exact += 1
+        else:
+            similar = near_index.find_or_add(i, sentences[i]['english']) if near_index is not None else None
+            if similar is None:
+                representatives[key] = i
+                plan.representatives.append(i)
+                plan.duplicates[i] = []
+            elif similar in plan.duplicates:
+                plan.duplicates[similar].append(i)
+                plan.near += 1
+            else:
+                plan.reused[i] = similar
+                plan.near += 1
+    
+    return plan
+
+def annotation_targets(sentences: List[Dict[str, str]]) -> List[int]:
+    """日本語訳または文法ポイントが欠けている文のインデックスを返す"""
+    if hasattr(sentences, 'annotation_targets'):
+        # 準備済みコーパスは全行を読まずにファイルから該当する文だけを探す
+        return sentences.annotation_targets()
+    return [
+        i for i, s in enumerate(sentences)
+        if s['english'] and (not s['japanese'] or not s['grammar'])
+    ]
+
+class AnnotationCheckpoint:
+    """生成済みの結果を1件ずつJSON Linesで追記し、中断後に再開できるようにする"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_sentences(cls, sentences: List[Dict[str, str]]) -> 'AnnotationCheckpoint':
+        """英文の並びから決まるチェックポイントを取得"""
+        fingerprint = getattr(sentences, 'fingerprint', None) or hashlib.sha256(
+            '\n'.join(s['english'] for s in sentences).encode('utf-8')
+        ).hexdigest()
+        return cls(os.path.join(ANNOTATION_CHECKPOINT_DIR, f"{fingerprint}.jsonl"))
+    
+    def restore(self, sentences: List[Dict[str, str]]) -> List[int]:
+        """チェックポイントの結果を空欄に書き戻し、復元した文のインデックスを返す"""
+        if not os.path.exists(self.path):
+            return []
+        
+        restored = []
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    index = entry['index']
+                except (ValueError, KeyError, TypeError):
+                    # 書き込み途中で中断された行は無視する
+                    continue
+                if not 0 <= index < len(sentences) or sentences[index]['english'] != entry.get('english'):
+                    continue
+                sentence = sentences[index]
+                if (not sentence['japanese'] and entry.get('japanese')) or \
+                        (not sentence['grammar'] and entry.get('grammar')):
+                    sentence['japanese'] = sentence['japanese'] or entry.get('japanese', '')
+                    sentence['grammar'] = sentence['grammar'] or entry.get('grammar', '')
+                    restored.append(index)
+        return restored
+    
+    def record(self, index: int, sentence: Dict[str, str]) -> None:
+        """1文分の結果を追記"""
+        entry = {
+            'index': index,
+            'english': sentence['english'],
+            'japanese': sentence['japanese'],
+            'grammar': sentence['grammar']
+        }
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+    
+    def remove(self) -> None:
+        """チェックポイントを削除"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+class AnnotationJob:
+    """セッションに紐づけてバックグラウンドで日本語訳・文法ポイントを生成するジョブ"""
+    
+    def __init__(self, sentences: List[Dict[str, str]], max_concurrency: int, batch_mode: bool,
+                 on_update: Optional[Callable[[int], None]] = None, near_duplicates: bool = False,
+                 rules_first: bool = False):
+        self.sentences = sentences
+        self.max_concurrency = max_concurrency
+        self.batch_mode = batch_mode
+        self.near_duplicates = near_duplicates
+        self.rules_first = rules_first
+        # 重複の除去で生成を省略した文の数
+        self.dedup: Dict[str, int] = {}
+        # 文の欄が埋まるたびに呼び出し、派生インデックスを更新する
+        self.on_update = on_update
+        # 前回中断した生成の結果があれば復元し、残りの文だけを生成する
+        self.checkpoint = AnnotationCheckpoint.for_sentences(sentences)
+        restored = self.checkpoint.restore(sentences)
+        self.restored = len(restored)
+        if on_update is not None:
+            # 派生インデックスは復元した文の分だけ更新する
+            for i in restored:
+                on_update(i)
+        self.pending = set(annotation_targets(sentences))
+        self.total = len(self.pending)
+        self.failed = 0
+        # 日本語訳なしで、ルールによる文法ポイントだけを埋めた文の数
+        self.rule_annotated = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        # 結果を表示中のセッションと、最後に再実行された時刻
+        self._watchers: Dict[str, float] = {}
+        self._finished = threading.Event()
+        # ワーカーからはst.cache_resourceを参照できないため、開始時に取得しておく
+        self._cache = get_llm_cache()
+        self._scheduler = get_default_scheduler()
+        self._metrics = get_metrics()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._monitor = threading.Thread(target=self._expire_watchers, daemon=True)
+    
+    def start(self) -> 'AnnotationJob':
+        self._thread.start()
+        self._monitor.start()
+        return self
+    
+    def watch(self, session_id: str) -> None:
+        """このセッションが結果を表示中であることを記録（再実行のたびに呼び出す）"""
+        with self._lock:
+            self._watchers[session_id] = time.time()
+    
+    def unwatch(self, session_id: str) -> None:
+        """このセッションが表示をやめたことを記録（表示中のセッションがなくなれば生成を取り消す）"""
+        with self._lock:
+            removed = self._watchers.pop(session_id, None) is not None
+            empty = not self._watchers
+        if removed and empty:
+            self.cancel()
+    
+    def _expire_watchers(self) -> None:
+        # 一定時間再実行されていないセッションは閉じられたとみなして外す
+        while not self._finished.wait(ANNOTATION_POLL_INTERVAL):
+            now = time.time()
+            with self._lock:
+                expired = [
+                    session_id for session_id, seen in self._watchers.items()
+                    if now - seen > ANNOTATION_WATCHER_TIMEOUT
+                ]
+                for session_id in expired:
+                    del self._watchers[session_id]
+                empty = not self._watchers
+            if expired and empty:
+                self.cancel()
+    
+    def wait(self, timeout: float) -> bool:
+        """完了するまで最大timeout秒待つ（完了していればTrue）"""
+        return self._finished.wait(timeout)
+    
+    def cancel(self) -> None:
+        """送信前のリクエストを取り消して生成を中断する"""
+        self._cancel_event.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+    
+    def is_running(self) -> bool:
+        return self._thread.is_alive()
+    
+    def is_pending(self, index: int) -> bool:
+        with self._lock:
+            return index in self.pending
+    
+    @property
+    def done(self) -> int:
+        with self._lock:
+            return self.total - len(self.pending)
+    
+    def _on_result(self, index: int, result: Dict[str, str]) -> None:
+        if self.on_update is not None:
+            self.on_update(index)
+        with self._lock:
+            self.pending.discard(index)
+            if result.get('failed') or not (result['japanese'] or result.get('rule_based')):
+                self.failed += 1
+            elif result.get('rule_based'):
+                self.rule_annotated += 1
+    
+    def _on_dedup(self, stats: Dict[str, int]) -> None:
+        self.dedup = stats
+    
+    def _run(self) -> None:
+        started = time.perf_counter()
+        try:
+            annotate_sentences(
+                self.sentences,
+                max_concurrency=self.max_concurrency,
+                batch_mode=self.batch_mode,
+                result_callback=self._on_result,
+                near_duplicates=self.near_duplicates,
+                dedup_callback=self._on_dedup,
+                rules_first=self.rules_first,
+                cancel_event=self._cancel_event,
+                cache=self._cache,
+                checkpoint=self.checkpoint,
+                scheduler=self._scheduler
+            )
+            # 全て完了したらチェックポイントは不要
+            if not self._cancel_event.is_set() and not annotation_targets(self.sentences):
+                self.checkpoint.remove()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self._metrics.observe('annotation_job', time.perf_counter() - started)
+            self._metrics.increment('annotated_sentences', self.done)
+            self._metrics.increment('deduplicated_sentences', self.dedup.get('skipped', 0))
+            self._metrics.increment('rule_annotated_sentences', self.rule_annotated)
+            with self._lock:
+                self.pending.clear()
+                self._finished.set()
+
+def current_annotation_job() -> Optional[AnnotationJob]:
+    """表示中のコーパスのバックグラウンド生成ジョブを取得"""
+    corpus = st.session_state.corpus
+    return corpus.annotation_job if corpus is not None else None
+
+def unwatch_annotation_job() -> None:
+    """このセッションが表示していたコーパスの生成ジョブの監視をやめる"""
+    job = current_annotation_job()
+    ctx = get_script_run_ctx()
+    if job is not None and ctx is not None:
+        job.unwatch(ctx.session_id)
+
+class GrammarHighlighter:
+    """接続詞（大文字小文字を区別）と関係詞（区別しない）を1つの正規表現で1回の走査でハイライトする"""
+    
+    def __init__(self, conjunctions: List[str], relatives: List[str],
+                 cache_size: int = HIGHLIGHT_CACHE_SIZE):
+        alternatives = []
+        if conjunctions:
+            alternatives.append(self._alternation(conjunctions))
+        if relatives:
+            alternatives.append('(?i:' + self._alternation(relatives) + ')')
+        self.pattern = re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b') if alternatives else None
+        self.signature = highlight_signature(conjunctions, relatives)
+        # 同じ文は何度も表示されるため、結果を文ごとに記憶する
+        self.highlight = functools.lru_cache(maxsize=cache_size)(self._highlight)
+    
+    @staticmethod
+    def _alternation(words: List[str]) -> str:
+        # 長い語を先に並べて、短い語が先に一致しないようにする
+        return '|'.join(re.escape(w) for w in sorted(set(words), key=len, reverse=True))
+    
+    def _highlight(self, text: str) -> str:
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(r'<span class="highlight">\g<0></span>', text)
+
+def load_highlight_words():
+    """ハイライトする接続詞・関係詞のリストを取得"""
+    if HIGHLIGHT_WORDS_PATH and os.path.exists(HIGHLIGHT_WORDS_PATH):
+        return read_highlight_words(HIGHLIGHT_WORDS_PATH, os.path.getmtime(HIGHLIGHT_WORDS_PATH))
+    return tuple(HIGHLIGHT_CONJUNCTIONS), tuple(HIGHLIGHT_RELATIVES)
+
+@st.cache_resource(show_spinner=False)
+def read_highlight_words(path: str, mtime: float):
+    """語のリストのファイルを読み込む（再実行のたびに読み直さず、更新されたときだけ読み直す）"""
+    with open(path, encoding='utf-8') as f:
+        words = json.load(f)
+    conjunctions = words.get('conjunctions', HIGHLIGHT_CONJUNCTIONS)
+    relatives = words.get('relatives', HIGHLIGHT_RELATIVES)
+    return tuple(conjunctions), tuple(relatives)
+
+def highlight_signature(conjunctions, relatives) -> str:
+    """ハイライトする語のリストの識別子（準備済みコーパスのハイライト済みHTMLが使えるかの判定に使う）"""
+    words = [sorted(set(conjunctions)), sorted(set(relatives))]
+    return hashlib.sha256(json.dumps(words).encode('utf-8')).hexdigest()
+
+@st.cache_resource
+def get_highlighter(conjunctions: tuple, relatives: tuple) -> GrammarHighlighter:
+    """語のリストごとにプロセス全体で共有するハイライターを取得"""
+    return GrammarHighlighter(list(conjunctions), list(relatives))
+
+def highlight_grammar_points(text: str, highlighter: Optional[GrammarHighlighter] = None) -> str:
+    """文法ポイントをハイライト"""
+    if highlighter is None:
+        highlighter = get_highlighter(*load_highlight_words())
+    return highlighter.highlight(text)
+
+# 文法カテゴリーの判定パターン（並び順がビットマスクのビット位置になる）
+GRAMMAR_CATEGORY_PATTERNS = [
+    (category, re.compile(pattern, re.IGNORECASE))
+    for category, pattern in [
+        ('現在完了形', r'現在完了|have\s+\w+ed|has\s+\w+ed'),
+        ('過去完了形', r'過去完了|had\s+\w+ed'),
+        ('関係詞', r'関係[代名]?詞|which|who|whom|whose|that節'),
+        ('仮定法', r'仮定法|would\s+have|could\s+have|should\s+have'),
+        ('受動態', r'受[動身]態|be\s+\w+ed|was\s+\w+ed|were\s+\w+ed'),
+        ('不定詞', r'不定詞|to\s+\w+'),
+        ('動名詞', r'動名詞|ing形'),
+        ('分詞構文', r'分詞構文|ing\s*句'),
+        ('比較級', r'比較級|more\s+\w+|er\s+than'),
+        ('最上級', r'最上級|most\s+\w+|est')
+    ]
+]
+
+# 判定パターンの識別子（準備済みコーパスのビットマスクが使えるかの判定に使う）
+GRAMMAR_CATEGORY_SIGNATURE = hashlib.sha256(json.dumps(
+    [(category, pattern.pattern) for category, pattern in GRAMMAR_CATEGORY_PATTERNS]
+).encode('utf-8')).hexdigest()
+
+def grammar_category_mask(grammar_text: str) -> int:
+    """文法・語彙のポイントに含まれる文法カテゴリーをビットマスクで返す"""
+    mask = 0
+    for bit, (_, pattern) in enumerate(GRAMMAR_CATEGORY_PATTERNS):
+        if pattern.search(grammar_text):
+            mask |= 1 << bit
+    return mask
+
+def extract_grammar_categories(sentences: List[Dict[str, str]]) -> List[str]:
+    """文法カテゴリーを抽出"""
+    mask = 0
+    for sentence in sentences:
+        mask |= grammar_category_mask(sentence.get('grammar', ''))
+    
+    return sorted(
+        category for bit, (category, _) in enumerate(GRAMMAR_CATEGORY_PATTERNS)
+        if mask & (1 << bit)
+    )
+
+# ルールベースの文法解析（APIを使わずに即座に文法ポイントを作る）
+# 過去分詞（規則変化の -ed と主な不規則動詞）
+PAST_PARTICIPLE = (
+    r"(?:(?!(?:need|indeed|speed|seed|feed|hundred|sacred|naked|wicked)\b)[a-z]{2,}ed|been|done|gone|seen|taken|given|written|known|made|found|told|said|thought|"
+    r"brought|bought|taught|caught|built|sent|spent|left|kept|held|felt|heard|met|paid|put|set|"
+    r"become|begun|broken|chosen|driven|eaten|fallen|forgotten|gotten|got|grown|hidden|lost|"
+    r"shown|spoken|stolen|thrown|understood|won|worn|drawn|flown|born|cut|hit|hurt|read|run|"
+    r"sold|led|fed|meant|sung|struck|woken|ridden|risen|shaken|torn)"
+)
+# -ing形（-ingで終わる名詞などを除く）
+ING_FORM = (
+    r"(?!(?:thing|nothing|something|anything|everything|during|morning|evening|king|ring|sing|"
+    r"bring|spring|string|swing|wing|sting|ceiling|sibling|pudding|wedding|building|meaning|"
+    r"feeling|painting|beginning|ending|including|according|regarding|concerning)\b)[a-z]{2,}ing"
+)
+# 助動詞と本動詞の間に入る副詞
+GRAMMAR_ADVERB = r"(?:(?:not|never|already|just|ever|yet|recently|also|always|often|still)\s+)?"
+# 後ろに不定詞をとりやすい語
+INFINITIVE_TRIGGERS = (
+    r"(?:want|need|try|tri|decide|plan|hope|expect|seem|refuse|agree|promise|learn|choose|manage|"
+    r"fail|intend|wish|offer|prepare|afford|able|likely|used|order|enough)"
+)
+# -estで終わる最上級以外の語
+NON_SUPERLATIVE_EST = (
+    r"(?!(?:rest|test|west|interest|forest|request|contest|guest|chest|nest|protest|quest|"
+    r"honest|modest|earnest|harvest|suggest|invest|arrest|digest|manifest|east|least|best)\b)"
+)
+
+# (文法項目, 英文に対するパターン, 解説) の並び（文法項目の名前は文法カテゴリーの判定にも使われる）
+# 先に並べた項目が優先され、その該当箇所に含まれる後の項目の一致は使わない
+GRAMMAR_RULES = [
+    (label, re.compile(pattern, re.IGNORECASE), explanation)
+    for label, pattern, explanation in [
+        ('仮定法過去完了', rf"\b(?:would|could|might|should)\s+(?:not\s+)?have\s+{PAST_PARTICIPLE}\b",
+         '助動詞の過去形 + have + 過去分詞で、過去の事実に反する仮定や推量を表す'),
+        ('現在完了進行形', rf"\b(?:have|has)\s+{GRAMMAR_ADVERB}been\s+{ING_FORM}\b",
+         'have/has been + -ing で、過去から今まで続いている動作を表す'),
+        ('現在完了形', rf"\b(?:have|has)\s+{GRAMMAR_ADVERB}{PAST_PARTICIPLE}\b",
+         'have/has + 過去分詞で、完了・経験・継続を表す'),
+        ('過去完了形', rf"\bhad\s+{GRAMMAR_ADVERB}{PAST_PARTICIPLE}\b",
+         'had + 過去分詞で、過去のある時点までの完了・経験・継続を表す'),
+        ('仮定法過去', r"\b(?:if|wish|as\s+if)\s+(?:I|he|she|it|we|you|they)\s+were\b",
+         'were などの過去形で、現在の事実に反する仮定を表す'),
+        ('受動態', rf"\b(?:am|is|are|was|were|be|being|been)\s+{GRAMMAR_ADVERB}{PAST_PARTICIPLE}\b",
+         'be動詞 + 過去分詞で「〜される」を表す（行為者は by で示す）'),
+        ('未来表現', r"\b(?:will|won't|(?:am|is|are|[a-z]+'(?:re|m))\s+going\s+to)\s+(?:not\s+)?[a-z]+\b",
+         'will / be going to + 動詞の原形で、未来の予定や意志を表す'),
+        ('現在進行形', rf"\b(?:am|is|are)\s+(?:not\s+)?(?!going\s+to\b){ING_FORM}\b",
+         'am/is/are + -ing で、今まさに行われている動作を表す'),
+        ('過去進行形', rf"\b(?:was|were)\s+(?:not\s+)?{ING_FORM}\b",
+         'was/were + -ing で、過去のある時点で行われていた動作を表す'),
+        ('関係代名詞', r"(?<=[a-z])(?:,\s*|\s+)(?:which|who|whom|whose)\b",
+         '直前の名詞（先行詞）を後ろから説明する節を導く'),
+        ('不定詞', rf"\b{INFINITIVE_TRIGGERS}[a-z]*\s+to\s+(?!the\b|a\b|an\b|my\b|his\b|her\b|their\b)[a-z]+\b|"
+                   r"\bit\s+(?:is|was)\s+[a-z]+\s+(?:for\s+[a-z]+\s+)?to\s+[a-z]+\b",
+         'to + 動詞の原形で、名詞的・形容詞的・副詞的な意味を加える'),
+        ('分詞構文', rf"^(?:not\s+)?(?:{ING_FORM}|having\s+{PAST_PARTICIPLE})\b[^,.;]*,|,\s+{ING_FORM}\b",
+         '分詞で始まる句が、時・理由・付帯状況などを表して主節を補う'),
+        ('動名詞', rf"\b(?:of|in|for|about|by|without|before|after|enjoy|enjoyed|finish|finished|avoid|"
+                   rf"avoided|stop|stopped|mind|keep|kept)\s+{ING_FORM}\b|^{ING_FORM}\b[^,]*?\s(?:is|was)\b",
+         '-ing形が名詞として主語・目的語・前置詞の目的語になる'),
+        ('比較級', r"\b(?:more|less)\s+[a-z]+\s+than\b|\b(?!(?:other|rather|never|either|whether)\b)[a-z]+er\s+than\b|\b(?:better|worse)\s+than\b",
+         '比較級 + than で、2つのものを比べる'),
+        ('原級比較', r"\bas\s+[a-z]+\s+as\b",
+         'as + 原級 + as で、「同じくらい〜」を表す'),
+        ('最上級', rf"\bthe\s+(?:most|least)\s+[a-z]+\b|\bthe\s+{NON_SUPERLATIVE_EST}[a-z]+est\b|\bthe\s+best\b",
+         'the + 最上級で、3つ以上の中で「最も〜」を表す')
+    ]
+]
+
+def analyze_grammar(english_text: str) -> List[Tuple[str, str, str]]:
+    """英文に含まれる文法項目を (文法項目, 該当箇所, 解説) の一覧として英文中の出現順に返す"""
+    found = []
+    for label, pattern, explanation in GRAMMAR_RULES:
+        match = pattern.search(english_text)
+        if match is None:
+            continue
+        # 現在完了進行形の中の現在完了形のように、既に見つけた項目の一部である一致は除く
+        if any(start <= match.start() and match.end() <= end for start, end, *_ in found):
+            continue
+        found.append((match.start(), match.end(), label, match.group(0).strip(' ,'), explanation))
+    found.sort(key=lambda item: item[0])
+    return [(label, matched, explanation) for _, _, label, matched, explanation in found]
+
+def rule_based_grammar(english_text: str) -> str:
+    """ルールで判定した文法ポイント（判定できる項目がなければ空文字列）"""
+    return ' / '.join(
+        f"{label}「{matched}」: {explanation}"
+        for label, matched, explanation in analyze_grammar(english_text)
+    )
+
+def rule_based_annotation(english_text: str) -> Dict[str, str]:
+    """ルールによる生成結果（日本語訳なし、ルールで作ったことを示す印付き）"""
+    return {'japanese': '', 'grammar': rule_based_grammar(english_text), 'rule_based': True}
+
+def failed_annotation(english_text: str) -> Dict[str, str]:
+    """APIでの生成に失敗した文の結果（ルールで判定できる文法ポイントだけを埋め、失敗として数える）"""
+    return {**rule_based_annotation(english_text), 'failed': True}
+
+def has_rule_based_grammar(sentence) -> bool:
+    """文法ポイントがルールで作ったもの（APIの結果で置き換えてよいもの）か"""
+    # ルールの判定は英文だけで決まるため、同じ英文から作り直して一致するかで判定する
+    return bool(sentence['grammar']) and sentence['grammar'] == rule_based_grammar(sentence['english'])
+
+
+class GrammarCategoryIndex:
+    """文ごとの文法カテゴリーのビットマスクと、カテゴリーごとの文インデックスの転置インデックス"""
+    
+    def __init__(self, sentences: Optional[List[Dict[str, str]]] = None):
+        self.masks: List[int] = []
+        self.postings: Dict[str, set] = {category: set() for category, _ in GRAMMAR_CATEGORY_PATTERNS}
+        self._lock = threading.Lock()
+        self._filter_cache = {}
+        for sentence in sentences or []:
+            self._add(len(self.masks), grammar_category_mask(sentence.get('grammar', '')))
+    
+    def __len__(self) -> int:
+        return len(self.masks)
+    
+    def _add(self, index: int, mask: int) -> None:
+        if index == len(self.masks):
+            self.masks.append(0)
+        old_mask = self.masks[index]
+        for bit, (category, _) in enumerate(GRAMMAR_CATEGORY_PATTERNS):
+            flag = 1 << bit
+            if mask & flag and not old_mask & flag:
+                self.postings[category].add(index)
+            elif old_mask & flag and not mask & flag:
+                self.postings[category].discard(index)
+        self.masks[index] = mask
+    
+    def update(self, index: int, grammar_text: str) -> None:
+        """1文の文法・語彙のポイントが変更されたときに差分だけ更新"""
+        mask = grammar_category_mask(grammar_text)
+        with self._lock:
+            if self.masks[index] != mask:
+                self._add(index, mask)
+                self._filter_cache.clear()
+    
+    def categories(self) -> List[str]:
+        """コーパスに含まれる文法カテゴリー"""
+        with self._lock:
+            return sorted(category for category, indices in self.postings.items() if indices)
+    
+    def filter(self, selected: List[str]) -> List[int]:
+        """選択したカテゴリーのいずれかに該当する文のインデックス（昇順）"""
+        key = frozenset(selected)
+        with self._lock:
+            if key not in self._filter_cache:
+                matched = set()
+                for category in selected:
+                    matched |= self.postings.get(category, set())
+                self._filter_cache[key] = sorted(matched)
+            return self._filter_cache[key]
+
+def is_filtered() -> bool:
+    """文法フィルター・キーワード検索・語の絞り込みのいずれかを使っているか"""
+    return bool(
+        st.session_state.grammar_filter
+        or st.session_state.search_query.strip()
+        or st.session_state.vocabulary_word.strip()
+    )
+
+def get_visible_indices():
+    """フィルターと検索を適用した表示対象の文のインデックス（検索中は関連度順、それ以外は昇順）"""
+    metrics = get_metrics()
+    query = st.session_state.search_query.strip()
+    word = st.session_state.vocabulary_word.strip()
+    with_word = None
+    if word:
+        with metrics.timer('vocabulary_filter'):
+            with_word = st.session_state.sentences.vocabulary().sentences_with(word)
+    if query:
+        with metrics.timer('search'):
+            results = st.session_state.sentences.search(query)
+        if st.session_state.grammar_filter:
+            with metrics.timer('category_filter'):
+                allowed = set(get_category_index().filter(st.session_state.grammar_filter))
+            results = [i for i in results if i in allowed]
+        if with_word is not None:
+            allowed = set(with_word)
+            results = [i for i in results if i in allowed]
+        return results
+    if st.session_state.grammar_filter:
+        with metrics.timer('category_filter'):
+            indices = get_category_index().filter(st.session_state.grammar_filter)
+        if with_word is not None:
+            allowed = set(with_word)
+            indices = [i for i in indices if i in allowed]
+        return indices
+    if with_word is not None:
+        return with_word
+    return range(len(st.session_state.sentences))
+
+def category_mask(categories: List[str]) -> int:
+    """文法カテゴリー名のリストをビットマスクに変換"""
+    mask = 0
+    for bit, (category, _) in enumerate(GRAMMAR_CATEGORY_PATTERNS):
+        if category in categories:
+            mask |= 1 << bit
+    return mask
+
+class OverlayCategoryIndex:
+    """共有の文法カテゴリーインデックスに、セッションで編集した文の差分を重ねる"""
+    
+    def __init__(self, base: GrammarCategoryIndex, masks: Optional[Dict[int, int]] = None):
+        self.base = base
+        self.masks: Dict[int, int] = dict(masks or {})
+    
+    def __len__(self) -> int:
+        return len(self.base)
+    
+    def update(self, index: int, grammar_text: str) -> None:
+        self.masks[index] = grammar_category_mask(grammar_text)
+    
+    def categories(self) -> List[str]:
+        categories = set(self.base.categories())
+        for mask in self.masks.values():
+            for bit, (category, _) in enumerate(GRAMMAR_CATEGORY_PATTERNS):
+                if mask & (1 << bit):
+                    categories.add(category)
+        return sorted(categories)
+    
+    def filter(self, selected: List[str]) -> List[int]:
+        indices = self.base.filter(selected)
+        if not self.masks:
+            return indices
+        # 編集した文は共有インデックスの結果を使わず、編集後の内容で判定する
+        selected_mask = category_mask(selected)
+        kept = [i for i in indices if i not in self.masks]
+        edited = [i for i, mask in self.masks.items() if mask & selected_mask]
+        return sorted(kept + edited)
+
+def get_category_index():
+    """表示中のコーパスの文法カテゴリーインデックスを取得"""
+    sentences = st.session_state.sentences
+    if not sentences:
+        return GrammarCategoryIndex()
+    return sentences.category_index
+
+# 全文検索
+SEARCH_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+SEARCH_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uff66-\uff9f]+')
+# 欄ごとの重み（英文・日本語訳での一致を文法ポイントでの一致より高く評価する）
+SEARCH_FIELD_WEIGHTS = {'english': 3, 'japanese': 2, 'grammar': 1}
+SEARCH_CACHE_SIZE = 64
+
+def search_terms(text: str) -> List[str]:
+    """英語は単語、日本語は文字2-gram（1文字だけの場合はその文字）に分割"""
+    text = text.lower()
+    terms = SEARCH_WORD_PATTERN.findall(text)
+    for run in SEARCH_CJK_PATTERN.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+def search_document_terms(sentence) -> Dict[str, int]:
+    """1文の検索語ごとの重み（出現回数×欄の重み）"""
+    weights: Dict[str, int] = {}
+    for field, field_weight in SEARCH_FIELD_WEIGHTS.items():
+        for term in search_terms(sentence[field]):
+            weights[term] = weights.get(term, 0) + field_weight
+    return weights
+
+class SearchOverrides:
+    """変更された文の検索語（文ごとの検索語と、検索で使う検索語ごとの転置マップ）"""
+    
+    def __init__(self, terms: Optional[Dict[int, Dict[str, int]]] = None):
+        self.terms: Dict[int, Dict[str, int]] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        for index, weights in (terms or {}).items():
+            self.set(index, weights)
+    
+    def __len__(self) -> int:
+        return len(self.terms)
+    
+    def __contains__(self, index: int) -> bool:
+        return index in self.terms
+    
+    def set(self, index: int, weights: Dict[str, int]) -> None:
+        """1文の検索語を差し替える"""
+        self.discard(index)
+        self.terms[index] = weights
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[index] = weight
+    
+    def discard(self, index: int) -> None:
+        weights = self.terms.pop(index, None)
+        for term in weights or ():
+            entry = self.postings[term]
+            del entry[index]
+            if not entry:
+                del self.postings[term]
+    
+    def copy(self) -> 'SearchOverrides':
+        overrides = SearchOverrides()
+        overrides.terms = dict(self.terms)
+        overrides.postings = {term: dict(entry) for term, entry in self.postings.items()}
+        return overrides
+
+class SearchIndex:
+    """英文・日本語訳・文法ポイントの全文検索用の転置インデックス"""
+    
+    def __init__(self, sentences, build: bool = True):
+        self.sentences = sentences
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[str, List[int]]' = OrderedDict()
+        self._postings: Dict[str, tuple] = {}
+        self._size = 0
+        self._overrides = SearchOverrides()
+        if build:
+            self.rebuild()
+    
+    def rebuild(self) -> None:
+        """転置インデックスを作り直す（作り直している間の変更は差し替えとして残す）"""
+        with self._lock:
+            applied = dict(self._overrides.terms)
+        lists: Dict[str, tuple] = {}
+        for index, sentence in enumerate(self.sentences):
+            for term, weight in search_document_terms(sentence).items():
+                entry = lists.get(term)
+                if entry is None:
+                    entry = lists[term] = ([], [])
+                entry[0].append(index)
+                entry[1].append(weight)
+        # 検索語ごとに文のインデックスと重みを配列で持ち、文ごとの辞書よりメモリを抑える
+        postings = {term: (array('i', indices), array('I', weights)) for term, (indices, weights) in lists.items()}
+        del lists
+        with self._lock:
+            self._postings = postings
+            self._size = len(self.sentences)
+            # 構築後に変更された文の検索語だけを差し替えとして残す（転置インデックスの該当文より優先する）
+            for index, terms in applied.items():
+                if self._overrides.terms.get(index) is terms:
+                    self._overrides.discard(index)
+            self._cache.clear()
+    
+    def update(self, index: int) -> None:
+        """1文が変更されたときに、その文の検索語だけを差し替える"""
+        terms = search_document_terms(self.sentences[index])
+        with self._lock:
+            self._overrides.set(index, terms)
+            self._cache.clear()
+    
+    def needs_rebuild(self) -> bool:
+        """差し替えが増え、作り直して検索を速く保つべきか"""
+        with self._lock:
+            return len(self._overrides) > max(1000, self._size // 4)
+    
+    def _expand(self, term: str, overrides: List[SearchOverrides]) -> List[str]:
+        # 日本語1文字の検索語は、その文字を含む2-gramすべてに展開する
+        if len(term) == 1 and SEARCH_CJK_PATTERN.match(term):
+            expanded = {t for t in self._postings if term in t}
+            for source in overrides:
+                expanded.update(t for t in source.postings if term in t)
+            return sorted(expanded)
+        return [term]
+    
+    def search(self, query: str, overrides: Optional[SearchOverrides] = None) -> List[int]:
+        """検索語を多く含み、重みの大きい文から順に、いずれかの検索語を含む文のインデックスを返す"""
+        terms = list(dict.fromkeys(search_terms(query)))
+        if not terms:
+            return []
+        with self._lock:
+            if not overrides and query in self._cache:
+                self._cache.move_to_end(query)
+                return self._cache[query]
+            # セッションの差し替えを共有の差し替えより優先する
+            session = overrides if overrides else None
+            sources = [source for source in (session, self._overrides) if source]
+            if len(sources) > 1:
+                overridden = sources[0].terms.keys() | sources[1].terms.keys()
+            else:
+                overridden = sources[0].terms if sources else {}
+            
+            scores: Dict[int, float] = {}
+            matched: Dict[int, int] = {}
+            for term in terms:
+                expanded = self._expand(term, sources)
+                df = sum(len(self._postings[t][0]) for t in expanded if t in self._postings)
+                idf = math.log(1 + self._size / (1 + df))
+                term_scores: Dict[int, int] = {}
+                for t in expanded:
+                    entry = self._postings.get(t)
+                    if entry is None:
+                        continue
+                    if not term_scores:
+                        term_scores = dict(zip(*entry))
+                    else:
+                        for index, weight in zip(*entry):
+                            term_scores[index] = term_scores.get(index, 0) + weight
+                if overridden:
+                    # 変更された文は構築時ではなく変更後の検索語で評価する（少ない方を走査して除く）
+                    if len(overridden) < len(term_scores):
+                        for index in overridden:
+                            term_scores.pop(index, None)
+                    elif term_scores:
+                        term_scores = {
+                            index: weight for index, weight in term_scores.items() if index not in overridden
+                        }
+                    # 差し替えは検索語ごとの転置マップから、クエリの検索語の分だけ引く
+                    for t in expanded:
+                        if session is not None:
+                            for index, weight in session.postings.get(t, {}).items():
+                                term_scores[index] = term_scores.get(index, 0) + weight
+                        for index, weight in self._overrides.postings.get(t, {}).items():
+                            if session is None or index not in session.terms:
+                                term_scores[index] = term_scores.get(index, 0) + weight
+                if not scores:
+                    scores = {index: idf * weight for index, weight in term_scores.items()}
+                    matched = dict.fromkeys(term_scores, 1)
+                    continue
+                for index, weight in term_scores.items():
+                    scores[index] = scores.get(index, 0.0) + idf * weight
+                    matched[index] = matched.get(index, 0) + 1
+            
+            if len(terms) == 1:
+                results = sorted(scores, key=scores.__getitem__, reverse=True)
+            else:
+                results = sorted(scores, key=lambda i: (-matched[i], -scores[i], i))
+            if not overrides:
+                self._cache[query] = results
+                if len(self._cache) > SEARCH_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+            return results
+
+# 語彙の頻度インデックス
+VOCABULARY_WORD_PATTERN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+# 短縮形は元の語として数える（n'tは否定なので、助動詞・be動詞として数える）
+VOCABULARY_CONTRACTIONS = {"can't": 'can', "won't": 'will', "shan't": 'shall', "ain't": 'be'}
+VOCABULARY_CONTRACTION_SUFFIXES = ("'s", "'d", "'ll", "'re", "'ve", "'m", "n't")
+# 規則変化しない語形と、その元の形
+VOCABULARY_IRREGULAR_FORMS = {
+    'be': 'am is are was were been being',
+    'have': 'has had having',
+    'do': 'does did done doing',
+    'go': 'goes went gone going',
+    'see': 'saw seen', 'take': 'took taken', 'give': 'gave given', 'write': 'wrote written',
+    'know': 'knew known', 'make': 'made', 'find': 'found', 'tell': 'told', 'say': 'said',
+    'think': 'thought', 'bring': 'brought', 'buy': 'bought', 'teach': 'taught', 'catch': 'caught',
+    'build': 'built', 'send': 'sent', 'spend': 'spent', 'leave': 'left', 'keep': 'kept',
+    'hold': 'held', 'feel': 'felt', 'hear': 'heard', 'meet': 'met', 'pay': 'paid', 'become': 'became',
+    'begin': 'began begun', 'break': 'broke broken', 'choose': 'chose chosen', 'drive': 'drove driven',
+    'eat': 'ate eaten', 'fall': 'fell fallen', 'forget': 'forgot forgotten', 'get': 'got gotten',
+    'grow': 'grew grown', 'hide': 'hid hidden', 'lose': 'lost', 'show': 'showed shown',
+    'speak': 'spoke spoken', 'steal': 'stole stolen', 'throw': 'threw thrown',
+    'understand': 'understood', 'win': 'won', 'wear': 'wore worn', 'draw': 'drew drawn',
+    'fly': 'flew flown', 'run': 'ran', 'sell': 'sold', 'lead': 'led', 'feed': 'fed', 'mean': 'meant',
+    'sing': 'sang sung', 'come': 'came', 'stand': 'stood', 'sit': 'sat', 'sleep': 'slept',
+    'wake': 'woke woken', 'ride': 'rode ridden', 'rise': 'rose risen', 'shake': 'shook shaken',
+    'tear': 'tore torn', 'child': 'children', 'man': 'men', 'woman': 'women', 'foot': 'feet',
+    'tooth': 'teeth', 'mouse': 'mice', 'good': 'better best', 'bad': 'worse worst'
+}
+VOCABULARY_IRREGULAR = {
+    form: lemma for lemma, forms in VOCABULARY_IRREGULAR_FORMS.items() for form in forms.split()
+}
+# 珍しい語・頻出語の一覧から除く機能語
+VOCABULARY_STOPWORDS = frozenset(
+    'a an the and or but if of to in on at by for with from as into about than then so not no '
+    'be have do will would can could shall should may might must i you he she it we they me him her '
+    'us them my your his its our their this that these those there here what which who whom whose '
+    'when where why how all any some each every one'.split()
+)
+# 語尾が -s でも複数形・三人称単数形ではない語（news -> new のように別の語にまとめないようにする）
+VOCABULARY_INVARIANT = frozenset(
+    'news series species means physics mathematics economics politics always perhaps whereas '
+    'lens gas bus yes'.split()
+)
+# 元の形の候補とする語の最短の長さ（used -> us のような、短すぎる語幹を除く）
+VOCABULARY_MIN_STEM = 3
+VOCABULARY_CACHE_SIZE = 16
+
+def vocabulary_tokens(text: str) -> List[str]:
+    """英文を小文字の語に分割し、短縮形は元の語にする"""
+    tokens = []
+    for token in VOCABULARY_WORD_PATTERN.findall(text.lower()):
+        if "'" in token:
+            if token in VOCABULARY_CONTRACTIONS:
+                token = VOCABULARY_CONTRACTIONS[token]
+            else:
+                for suffix in VOCABULARY_CONTRACTION_SUFFIXES:
+                    if token.endswith(suffix):
+                        token = token[:-len(suffix)]
+                        break
+                else:
+                    token = token.split("'")[0]
+            if not token:
+                continue
+        tokens.append(token)
+    return tokens
+
+def lemma_candidates(word: str) -> List[str]:
+    """語形変化（-s・-ed・-ing）を取り除いた元の形の候補を、可能性の高い順に返す（最後は語形そのもの）"""
+    irregular = VOCABULARY_IRREGULAR.get(word)
+    if irregular is not None:
+        return [irregular]
+    if word in VOCABULARY_INVARIANT:
+        return [word]
+    # 機能語や短すぎる語幹は、別の語を誤って元の形とみなしやすいため候補にしない
+    return [
+        candidate for candidate in _inflection_candidates(word)
+        if candidate == word
+        or (len(candidate) >= VOCABULARY_MIN_STEM and candidate not in VOCABULARY_STOPWORDS)
+    ]
+
+def _inflection_candidates(word: str) -> List[str]:
+    if len(word) > 4 and word.endswith(('ies', 'ied')):
+        return [word[:-3] + 'y', word]
+    if len(word) > 3 and word.endswith('es'):
+        stem = word[:-2]
+        if stem.endswith(('s', 'x', 'z', 'ch', 'sh', 'o')):
+            return [stem, word[:-1], word]
+        return [word[:-1], stem, word]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return [word[:-1], word]
+    for suffix in ('ed', 'ing'):
+        stem = word[:-len(suffix)]
+        if len(stem) < 2 or not word.endswith(suffix) or not re.search('[aeiouy]', stem):
+            continue
+        candidates = [stem, stem + 'e']
+        if len(stem) > 2 and stem[-1] == stem[-2] and stem[-1] not in 'aeiouls':
+            # stopped -> stop のように子音字を重ねた形
+            candidates.insert(0, stem[:-1])
+        elif re.search('(?:^|[^aeiou])[aeiou][^aeiouwxy]$', stem) and len(re.findall('[aeiou]+', stem)) == 1:
+            # liked -> like のように、1音節で「子音+母音+子音」で終わる語は -e を補う
+            candidates.reverse()
+        return candidates + [word]
+    return [word]
+
+def lemmatize(word: str, known: Optional[set] = None, shared: Optional[Dict[str, int]] = None) -> str:
+    """語の元の形（既知の語にある候補、なければ複数の語形に共通する候補を使い、どれもなければ語形のまま）"""
+    candidates = lemma_candidates(word)
+    if known is None or word in VOCABULARY_IRREGULAR:
+        return candidates[0]
+    for candidate in candidates[:-1]:
+        if candidate in known:
+            return candidate
+    # visits と visited のように、元の形がコーパスにない活用形どうしは共通の候補にまとめる
+    if shared:
+        for candidate in candidates[:-1]:
+            if shared.get(candidate, 0) >= 2:
+                return candidate
+    return word
+
+def load_vocabulary_levels() -> Dict[str, str]:
+    """語彙レベルの一覧（VOCABULARY_LEVELS_PATHがなければ空）"""
+    if VOCABULARY_LEVELS_PATH and os.path.exists(VOCABULARY_LEVELS_PATH):
+        return read_vocabulary_levels(VOCABULARY_LEVELS_PATH, os.path.getmtime(VOCABULARY_LEVELS_PATH))
+    return {}
+
+@st.cache_resource(show_spinner=False)
+def read_vocabulary_levels(path: str, mtime: float) -> Dict[str, str]:
+    """「語<TAB>レベル」の行か {"語": "レベル"} のJSONを読み込む（更新されたときだけ読み直す）"""
+    with open(path, encoding='utf-8') as f:
+        if path.lower().endswith('.json'):
+            return {word.strip().lower(): str(level).strip() for word, level in json.load(f).items()}
+        levels = {}
+        for line in f:
+            fields = line.rstrip('\n').replace(',', '\t').split('\t')
+            if len(fields) >= 2 and fields[0].strip() and not line.startswith('#'):
+                levels[fields[0].strip().lower()] = fields[1].strip()
+        return levels
+
+class VocabularyIndex:
+    """英文の語を元の形にまとめた出現回数と、語ごとの文インデックスの転置インデックス"""
+    
+    def __init__(self, sentences, levels: Optional[Dict[str, str]] = None):
+        self.sentences = sentences
+        self.levels = levels or {}
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[tuple, Dict[int, int]]' = OrderedDict()
+        self._build()
+    
+    def _lemma_id(self, word: str) -> int:
+        # 同じ語形は1度だけ元の形に変換する
+        lemma_id = self._surface_ids.get(word)
+        if lemma_id is None:
+            candidates = lemma_candidates(word)
+            lemma = lemmatize(word, self._known, self._shared)
+            lemma_id = self._lemma_ids.get(lemma)
+            if lemma_id is None:
+                lemma_id = self._lemma_ids[lemma] = len(self.lemmas)
+                self.lemmas.append(lemma)
+                self._counts.append(0)
+            self._surface_ids[word] = lemma_id
+            # 元の形がコーパスにない語形（visited だけがあり visit がない場合など）も、元の形の候補で引けるようにする
+            for candidate in candidates:
+                if candidate != lemma:
+                    self._candidate_ids.setdefault(candidate, set()).add(lemma_id)
+        return lemma_id
+    
+    def _query_ids(self, word: str) -> set:
+        """語（活用形を含む）に当たる元の形のIDの集合"""
+        lemma = self.lemma(word)
+        ids = set(self._candidate_ids.get(lemma, ()))
+        if lemma in self._lemma_ids:
+            ids.add(self._lemma_ids[lemma])
+        return ids
+    
+    def _build(self) -> None:
+        tokens = [vocabulary_tokens(sentence['english']) for sentence in self.sentences]
+        # コーパスに現れる語形と語彙レベルの一覧の語を、元の形の候補を選ぶ手がかりにする
+        surfaces = set()
+        for words in tokens:
+            surfaces.update(words)
+        self._known = surfaces | set(self.levels)
+        # 元の形の候補ごとの、その候補を持つ語形の数
+        self._shared: Dict[str, int] = {}
+        for word in surfaces:
+            for candidate in lemma_candidates(word)[:-1]:
+                self._shared[candidate] = self._shared.get(candidate, 0) + 1
+        self.lemmas: List[str] = []
+        self._lemma_ids: Dict[str, int] = {}
+        self._surface_ids: Dict[str, int] = {}
+        self._candidate_ids: Dict[str, set] = {}
+        self._counts = array('I')
+        # 文ごとの語（元の形のID）を1つの配列に詰め、offsetsで文の範囲を表す
+        ids = array('i')
+        offsets = array('I', [0])
+        lists: Dict[int, List[int]] = {}
+        for index, words in enumerate(tokens):
+            sentence_ids = [self._lemma_id(word) for word in words]
+            ids.extend(sentence_ids)
+            offsets.append(len(ids))
+            for lemma_id in sentence_ids:
+                self._counts[lemma_id] += 1
+            for lemma_id in dict.fromkeys(sentence_ids):
+                entry = lists.get(lemma_id)
+                if entry is None:
+                    entry = lists[lemma_id] = []
+                entry.append(index)
+        del tokens
+        self._ids = ids
+        self._offsets = offsets
+        # 英文はアプリ内で編集されないため、作成後に差し替えることはない
+        self._postings = {lemma_id: array('i', indices) for lemma_id, indices in lists.items()}
+    
+    def lemma(self, word: str) -> str:
+        """語の元の形（went -> go など）"""
+        tokens = vocabulary_tokens(word)
+        return lemmatize(tokens[0], self._known, self._shared) if tokens else ''
+    
+    def count(self, word: str) -> int:
+        """コーパス全体での出現回数（活用形を含む）"""
+        with self._lock:
+            return sum(self._counts[lemma_id] for lemma_id in self._query_ids(word))
+    
+    def level(self, lemma: str) -> Optional[str]:
+        return self.levels.get(lemma)
+    
+    def sentences_with(self, word: str) -> List[int]:
+        """指定した語（活用形を含む）を含む文のインデックスを昇順で返す"""
+        with self._lock:
+            lemma_ids = self._query_ids(word)
+            postings = [self._postings[lemma_id] for lemma_id in lemma_ids if lemma_id in self._postings]
+            if len(postings) == 1:
+                return list(postings[0])
+            return sorted({i for indices in postings for i in indices})
+    
+    def unit_counts(self, indices: Optional[Iterable[int]] = None) -> Dict[int, int]:
+        """指定した範囲の文（省略時は全体）での、元の形のIDごとの出現回数"""
+        with self._lock:
+            if indices is None:
+                return {lemma_id: count for lemma_id, count in enumerate(self._counts) if count}
+            key = tuple(indices)
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+            ids = self._ids
+            offsets = self._offsets
+            counts: Dict[int, int] = {}
+            for index in key:
+                for lemma_id in ids[offsets[index]:offsets[index + 1]]:
+                    counts[lemma_id] = counts.get(lemma_id, 0) + 1
+            self._cache[key] = counts
+            if len(self._cache) > VOCABULARY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return counts
+    
+    def _rows(self, counts: Dict[int, int], lemma_ids: List[int]) -> List[Dict[str, object]]:
+        return [
+            {
+                'lemma': self.lemmas[lemma_id],
+                'unit_count': counts[lemma_id],
+                'corpus_count': self._counts[lemma_id],
+                'level': self.levels.get(self.lemmas[lemma_id])
+            }
+            for lemma_id in lemma_ids
+        ]
+    
+    def _candidates(self, counts: Dict[int, int], level: Optional[str]) -> List[int]:
+        # 機能語は除き、レベルの指定があればそのレベルの語に絞る
+        return [
+            lemma_id for lemma_id in counts
+            if self.lemmas[lemma_id] not in VOCABULARY_STOPWORDS
+            and (level is None or self.levels.get(self.lemmas[lemma_id]) == level)
+        ]
+    
+    def rare_words(self, n: int, indices: Optional[Iterable[int]] = None,
+                   level: Optional[str] = None) -> List[Dict[str, object]]:
+        """範囲内の語のうち、コーパス全体での出現回数が少ないものから n 語を返す"""
+        counts = self.unit_counts(indices)
+        lemma_ids = heapq.nsmallest(
+            n, self._candidates(counts, level),
+            key=lambda lemma_id: (self._counts[lemma_id], self.lemmas[lemma_id])
+        )
+        return self._rows(counts, lemma_ids)
+    
+    def frequent_words(self, n: int, indices: Optional[Iterable[int]] = None,
+                       level: Optional[str] = None) -> List[Dict[str, object]]:
+        """範囲内で出現回数の多い語から n 語を返す"""
+        counts = self.unit_counts(indices)
+        lemma_ids = heapq.nsmallest(
+            n, self._candidates(counts, level),
+            key=lambda lemma_id: (-counts[lemma_id], self.lemmas[lemma_id])
+        )
+        return self._rows(counts, lemma_ids)
+    
+    def memory_usage(self) -> int:
+        """配列と転置インデックスのおおよそのバイト数"""
+        return (
+            self._ids.itemsize * len(self._ids) + self._offsets.itemsize * len(self._offsets)
+            + sum(p.itemsize * len(p) for p in self._postings.values())
+        )
+
+# 準備済みコーパス
+class PreparedRecord(dict):
+    """準備済みコーパスの1文（欄への書き込みはファイルにも反映する）"""
+    
+    __slots__ = ('store', 'index')
+    
+    def __init__(self, store: 'PreparedSentenceStore', index: int, fields: Dict[str, str]):
+        super().__init__(fields)
+        self.store = store
+        self.index = index
+    
+    def __setitem__(self, field: str, value: str) -> None:
+        self.store.set_field(self.index, field, value)
+        super().__setitem__(field, value)
+
+class PreparedSentenceStore:
+    """準備済みコーパスのSQLiteファイルを開き、表示する行だけを読み込むストア"""
+    
+    ROW_CACHE_SIZE = 1024
+    
+    def __init__(self, path: str, highlight_signature: Optional[str] = None, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._rows: 'OrderedDict[int, tuple]' = OrderedDict()
+        try:
+            meta = dict(self._conn.execute('SELECT key, value FROM meta'))
+        except sqlite3.DatabaseError as e:
+            self.close()
+            raise ValueError(f"準備済みコーパスではありません: {path}") from e
+        if meta.get('format') != PREPARED_CORPUS_FORMAT:
+            self.close()
+            raise ValueError(f"対応していない準備済みコーパスの形式です: {meta.get('format')}")
+        
+        self.stats: Dict[str, int] = json.loads(meta['stats'])
+        self.category_counts: Dict[str, int] = json.loads(meta['category_counts'])
+        self.source_hash: Optional[str] = meta.get('source_hash') or None
+        # ハイライトする語が書き出し時と同じ場合だけ、保存済みのHTMLを使う
+        self.use_html = highlight_signature is not None and meta.get('highlight_signature') == highlight_signature
+        # 判定パターンが変わっていればビットマスクを作り直す（読み取り専用の場合は作り直さない）
+        if meta.get('category_signature') != GRAMMAR_CATEGORY_SIGNATURE and not read_only:
+            self._rebuild_category_masks()
+    
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # 閉じた後も参照しているセッションがあれば開き直す
+        if self._connection is None:
+            if self.read_only:
+                # 統計を確認するだけの場合などは、ファイルを書き換えないよう読み取り専用で開く
+                self._connection = sqlite3.connect(
+                    f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro", uri=True, check_same_thread=False
+                )
+            else:
+                self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        return self._connection
+    
+    @property
+    def fingerprint(self) -> str:
+        """チェックポイントの識別子（全行を読まないよう、内容のハッシュから付けたファイル名を使う）"""
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        return hashlib.sha256(f"prepared:{name}".encode('utf-8')).hexdigest()
+    
+    def _rebuild_category_masks(self) -> None:
+        with self._lock:
+            rows = self._conn.execute('SELECT idx, grammar FROM sentences').fetchall()
+            counts = {category: 0 for category, _ in GRAMMAR_CATEGORY_PATTERNS}
+            updates = []
+            for index, grammar in rows:
+                mask = grammar_category_mask(grammar)
+                updates.append((mask, index))
+                for bit, (category, _) in enumerate(GRAMMAR_CATEGORY_PATTERNS):
+                    if mask & (1 << bit):
+                        counts[category] += 1
+            self._conn.executemany('UPDATE sentences SET category_mask = ? WHERE idx = ?', updates)
+            self.category_counts = counts
+            self._write_meta(category_signature=GRAMMAR_CATEGORY_SIGNATURE)
+            self._conn.commit()
+    
+    def _write_meta(self, **values) -> None:
+        values.setdefault('stats', json.dumps(self.stats))
+        values.setdefault('category_counts', json.dumps(self.category_counts, ensure_ascii=False))
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', values.items()
+        )
+    
+    def _row(self, index: int) -> tuple:
+        row = self._rows.get(index)
+        if row is not None:
+            self._rows.move_to_end(index)
+            return row
+        row = self._conn.execute(
+            'SELECT english, japanese, grammar, english_html FROM sentences WHERE idx = ?', (index,)
+        ).fetchone()
+        self._rows[index] = row
+        if len(self._rows) > self.ROW_CACHE_SIZE:
+            self._rows.popitem(last=False)
+        return row
+    
+    def _record(self, index: int, row: tuple) -> PreparedRecord:
+        fields = dict(zip(SENTENCE_FIELDS, row))
+        if self.use_html:
+            fields['english_html'] = row[3]
+        return PreparedRecord(self, index, fields)
+    
+    def __len__(self) -> int:
+        return self.stats['total']
+    
+    def __getitem__(self, index: int) -> PreparedRecord:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        with self._lock:
+            return self._record(index, self._row(index))
+    
+    def __iter__(self) -> Iterator[PreparedRecord]:
+        # 全件を一度に読み込まないよう、一定数ずつ読み出す
+        for start in range(0, len(self), self.ROW_CACHE_SIZE):
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT idx, english, japanese, grammar, english_html FROM sentences '
+                    'WHERE idx >= ? AND idx < ? ORDER BY idx',
+                    (start, start + self.ROW_CACHE_SIZE)
+                ).fetchall()
+            for row in rows:
+                yield self._record(row[0], row[1:])
+    
+    def set_field(self, index: int, field: str, value: str) -> None:
+        """1文の1つの欄を更新してファイルに書き込む（統計・ビットマスクも同じトランザクションで更新する）"""
+        if field not in SENTENCE_FIELDS:
+            raise KeyError(field)
+        if self.read_only:
+            raise ValueError(f"読み取り専用で開いた準備済みコーパスです: {self.path}")
+        with self._lock:
+            row = self._row(index)
+            fields = dict(zip(SENTENCE_FIELDS, row))
+            was_incomplete = is_incomplete(fields)
+            fields[field] = value
+            with self._conn:
+                self._conn.execute(f'UPDATE sentences SET {field} = ? WHERE idx = ?', (value, index))
+                self.stats['incomplete'] += is_incomplete(fields) - was_incomplete
+                if field == 'grammar':
+                    # カテゴリーインデックスの更新で改めて書き込まずに済むよう、ここで反映する
+                    self._update_category_mask(index, grammar_category_mask(value))
+                self._write_meta()
+            self._rows[index] = tuple(fields[f] for f in SENTENCE_FIELDS) + row[3:]
+    
+    def _update_category_mask(self, index: int, mask: int) -> bool:
+        old_mask = self._conn.execute(
+            'SELECT category_mask FROM sentences WHERE idx = ?', (index,)
+        ).fetchone()[0]
+        if old_mask == mask:
+            return False
+        for bit, (category, _) in enumerate(GRAMMAR_CATEGORY_PATTERNS):
+            flag = 1 << bit
+            self.category_counts[category] = self.category_counts.get(category, 0) + \
+                bool(mask & flag) - bool(old_mask & flag)
+        self._conn.execute('UPDATE sentences SET category_mask = ? WHERE idx = ?', (mask, index))
+        return True
+    
+    def set_category_mask(self, index: int, mask: int) -> None:
+        """1文の文法カテゴリーのビットマスクとカテゴリーごとの文数を更新"""
+        with self._lock:
+            with self._conn:
+                if self._update_category_mask(index, mask):
+                    self._write_meta()
+    
+    def close(self) -> None:
+        """ファイルを閉じる（閉じた後に参照された場合は開き直す）"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+    
+    def annotation_targets(self) -> List[int]:
+        """日本語訳または文法ポイントが欠けている文のインデックス（該当する行のインデックスだけを読む）"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT idx FROM sentences WHERE english != '' AND (japanese = '' OR grammar = '') ORDER BY idx"
+            )]
+    
+    def indices_with_categories(self, mask: int) -> List[int]:
+        """ビットマスクのカテゴリーのいずれかに該当する文のインデックス（昇順）"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                'SELECT idx FROM sentences WHERE category_mask & ? != 0 ORDER BY idx', (mask,)
+            )]
+    
+    def incomplete_count(self) -> int:
+        """日本語訳または文法ポイントが未入力の文の数"""
+        return self.stats['incomplete']
+    
+    def build_category_index(self) -> 'PreparedCategoryIndex':
+        """保存済みのビットマスクを使う文法カテゴリーインデックスを作成"""
+        return PreparedCategoryIndex(self)
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """読み込み済みの行が使うバイト数"""
+        with self._lock:
+            total = sys.getsizeof(self._rows) + sum(
+                sum(sys.getsizeof(value) for value in row) for row in self._rows.values()
+            )
+        return {
+            'bytes': total,
+            'sentences': len(self),
+            'unique_grammar': self.stats.get('unique_grammar', 0)
+        }
+
+class PreparedCategoryIndex:
+    """準備済みコーパスに保存したビットマスクで文法カテゴリーを絞り込むインデックス"""
+    
+    def __init__(self, store: PreparedSentenceStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._filter_cache = {}
+    
+    def __len__(self) -> int:
+        return len(self.store)
+    
+    def update(self, index: int, grammar_text: str) -> None:
+        """1文の文法・語彙のポイントが変更されたときに差分だけ更新"""
+        self.store.set_category_mask(index, grammar_category_mask(grammar_text))
+        with self._lock:
+            self._filter_cache.clear()
+    
+    def categories(self) -> List[str]:
+        """コーパスに含まれる文法カテゴリー"""
+        return sorted(category for category, count in self.store.category_counts.items() if count)
+    
+    def filter(self, selected: List[str]) -> List[int]:
+        """選択したカテゴリーのいずれかに該当する文のインデックス（昇順）"""
+        key = frozenset(selected)
+        with self._lock:
+            if key not in self._filter_cache:
+                self._filter_cache[key] = self.store.indices_with_categories(category_mask(selected))
+            return self._filter_cache[key]
+
+def export_prepared_corpus(
+    path: str,
+    sentences: Iterable,
+    highlighter: Optional[GrammarHighlighter] = None,
+    source_hash: Optional[str] = None
+) -> Dict[str, int]:
+    """文と文法カテゴリーのビットマスク・ハイライト済みHTML・統計を準備済みコーパスとして書き出す"""
+    if highlighter is None:
+        highlighter = GrammarHighlighter(*map(list, load_highlight_words()))
+    
+    stats = {'total': 0, 'incomplete': 0, 'unique_grammar': 0}
+    category_counts = {category: 0 for category, _ in GRAMMAR_CATEGORY_PATTERNS}
+    grammar_seen = set()
+    
+    def rows():
+        for index, sentence in enumerate(sentences):
+            mask = grammar_category_mask(sentence['grammar'])
+            for bit, (category, _) in enumerate(GRAMMAR_CATEGORY_PATTERNS):
+                if mask & (1 << bit):
+                    category_counts[category] += 1
+            stats['total'] += 1
+            stats['incomplete'] += is_incomplete(sentence)
+            grammar_seen.add(sentence['grammar'])
+            yield (
+                index, sentence['english'], sentence['japanese'], sentence['grammar'],
+                mask, highlighter.highlight(sentence['english'])
+            )
+    
+    # 書き込み途中で中断されても壊れたファイルが残らないよう、一時ファイルから置き換える
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        conn.execute(
+            'CREATE TABLE sentences ('
+            'idx INTEGER PRIMARY KEY, english TEXT NOT NULL, japanese TEXT NOT NULL, '
+            'grammar TEXT NOT NULL, category_mask INTEGER NOT NULL, english_html TEXT NOT NULL)'
+        )
+        conn.executemany('INSERT INTO sentences VALUES (?, ?, ?, ?, ?, ?)', rows())
+        stats['unique_grammar'] = len(grammar_seen)
+        conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [
+            ('format', PREPARED_CORPUS_FORMAT),
+            ('stats', json.dumps(stats)),
+            ('category_counts', json.dumps(category_counts, ensure_ascii=False)),
+            ('category_signature', GRAMMAR_CATEGORY_SIGNATURE),
+            ('highlight_signature', highlighter.signature),
+            # 元のファイルが変わったかを判定できるよう、内容のハッシュを残す
+            ('source_hash', source_hash or '')
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    return stats
+
+def open_prepared_corpus(stream: BinaryIO) -> PreparedSentenceStore:
+    """アップロードされた準備済みコーパスを保存先にコピーして開く（同じ内容のファイルは再利用する）"""
+    path = os.path.join(PREPARED_CORPUS_DIR, f"{hash_stream(stream)}{PREPARED_CORPUS_EXTENSION}")
+    if not os.path.exists(path):
+        os.makedirs(PREPARED_CORPUS_DIR, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+        os.replace(tmp_path, path)
+    return PreparedSentenceStore(path, highlight_signature(*load_highlight_words()))
+
+# 共有コーパス
+class SharedCorpus:
+    """同じファイルを開いた全セッションで共有する、解析・生成済みの文と派生インデックス"""
+    
+    def __init__(self, key: str, sentences):
+        self.key = key
+        # 文は列形式のストア（または準備済みコーパス）で保持する
+        if not hasattr(sentences, 'build_category_index'):
+            sentences = SentenceStore.from_records(sentences)
+        self.sentences = sentences
+        # バックグラウンドのスレッドではst.cache_resourceが使えない場合があるため、ここで取得しておく
+        self._metrics = get_metrics()
+        with self._metrics.timer('category_index'):
+            self.category_index = sentences.build_category_index()
+        self.annotation_job: Optional[AnnotationJob] = None
+        # 作成中に変更された文も差し替えとして残るよう、空のインデックスを先に用意する
+        self._search_index = SearchIndex(sentences, build=False)
+        self._search_ready = threading.Event()
+        self._vocabulary_index: Optional[VocabularyIndex] = None
+        self._rule_grammar: Optional[Tuple[Dict[int, str], Dict[int, int], SearchOverrides]] = None
+        self._lock = threading.Lock()
+        self._search_lock = threading.Lock()
+        self._vocabulary_lock = threading.Lock()
+        # 全文検索インデックスは読み込み時にバックグラウンドで作成し、作り直しも同じスレッドで行う
+        # （準備済みコーパスは表示する行だけを読むため、最初に検索するときに作成する）
+        self._indexer: Optional[threading.Thread] = None
+        if not isinstance(sentences, PreparedSentenceStore):
+            self._start_indexer()
+    
+    def _start_indexer(self) -> None:
+        with self._search_lock:
+            if self._indexer is None:
+                self._indexer = threading.Thread(target=self._run_indexer, daemon=True)
+                self._indexer.start()
+    
+    def _run_indexer(self) -> None:
+        if not self._search_ready.is_set():
+            try:
+                with self._metrics.timer('search_index'):
+                    self._search_index.rebuild()
+            finally:
+                self._search_ready.set()
+        while True:
+            # 作り直しの要求を取りこぼさないよう、終了の判定はロックの中で行う
+            with self._search_lock:
+                if not self._search_index.needs_rebuild():
+                    self._indexer = None
+                    return
+            with self._metrics.timer('search_index_rebuild'):
+                self._search_index.rebuild()
+    
+    def search_index(self) -> SearchIndex:
+        """全文検索インデックスを取得（バックグラウンドでの作成が終わるまで待つ）"""
+        if not self._search_ready.is_set():
+            self._start_indexer()
+        self._search_ready.wait()
+        return self._search_index
+    
+    def vocabulary_index(self) -> VocabularyIndex:
+        """語彙の頻度インデックスを取得（最初に使うときに作成する）"""
+        with self._vocabulary_lock:
+            if self._vocabulary_index is None:
+                with self._metrics.timer('vocabulary_index'):
+                    self._vocabulary_index = VocabularyIndex(self.sentences, load_vocabulary_levels())
+            return self._vocabulary_index
+    
+    def rule_grammar(self) -> Tuple[Dict[int, str], Dict[int, int], SearchOverrides]:
+        """文法ポイントが空の文をルールで判定した結果と、その文法カテゴリーのビットマスク・検索語
+        （APIキーがないセッションで使う。最初に使うときに作成し、全セッションで共有する）"""
+        with self._lock:
+            if self._rule_grammar is None:
+                grammar_by_index, masks, terms = {}, {}, SearchOverrides()
+                with self._metrics.timer('rule_grammar'):
+                    for index, sentence in enumerate(self.sentences):
+                        if sentence['grammar']:
+                            continue
+                        grammar = rule_based_grammar(sentence['english'])
+                        if grammar:
+                            grammar_by_index[index] = grammar
+                            masks[index] = grammar_category_mask(grammar)
+                            terms.set(index, search_document_terms({**sentence, 'grammar': grammar}))
+                self._rule_grammar = (grammar_by_index, masks, terms)
+            return self._rule_grammar
+    
+    def refresh_indexes(self, index: int) -> None:
+        """1文の欄が変更されたときに、派生インデックスを差分だけ更新"""
+        self.category_index.update(index, self.sentences[index]['grammar'])
+        self._search_index.update(index)
+        if self._search_ready.is_set() and self._search_index.needs_rebuild():
+            self._start_indexer()
+    
+    def close(self) -> None:
+        """ストアから外されたコーパスのバックグラウンド生成を取り消し、準備済みコーパスのファイルを閉じる"""
+        job = self.annotation_job
+        if job is not None:
+            job.cancel()
+        if isinstance(self.sentences, PreparedSentenceStore):
+            self.sentences.close()
+    
+    def start_annotation(self, max_concurrency: int, batch_mode: bool,
+                         near_duplicates: bool = False, rules_first: bool = False) -> Optional[AnnotationJob]:
+        """欠けている欄があれば、まだ実行中でない場合に限りバックグラウンド生成を開始"""
+        # APIキーがない場合のルールによる文法ポイントは各セッションのビューで補い、共有コーパスには書き込まない
+        if get_default_scheduler() is None:
+            return self.annotation_job
+        with self._lock:
+            job = self.annotation_job
+            # 取り消されたジョブは終了を待たずに新しいジョブで置き換える
+            if (job is None or job.cancelled or not job.is_running()) and self.sentences.incomplete_count() \
+                    and annotation_targets(self.sentences):
+                self.annotation_job = AnnotationJob(
+                    self.sentences,
+                    max_concurrency=max_concurrency,
+                    batch_mode=batch_mode,
+                    on_update=self.refresh_indexes,
+                    near_duplicates=near_duplicates,
+                    rules_first=rules_first
+                ).start()
+            return self.annotation_job
+
+class SessionCorpusView:
+    """共有コーパスにセッション固有の編集を重ねて、文のリストとして見せるビュー"""
+    
+    def __init__(self, corpus: SharedCorpus, rule_grammar: bool = False):
+        self.corpus = corpus
+        self.edits: Dict[int, Dict[str, str]] = {}
+        # APIキーがない場合は、空の文法ポイントをルールの判定結果で補って見せる（共有コーパスには書き込まない）
+        self.rule_grammar = rule_grammar
+        self._rule_grammar, masks, terms = corpus.rule_grammar() if rule_grammar else ({}, {}, SearchOverrides())
+        # ルールで補った文法ポイントも文法フィルター・検索の対象にする
+        self.category_index = OverlayCategoryIndex(corpus.category_index, masks)
+        # 編集した文の検索語（共有の検索インデックスより優先する）
+        self.search_overrides = terms.copy()
+    
+    def __len__(self) -> int:
+        return len(self.corpus.sentences)
+    
+    def __getitem__(self, index: int) -> Dict[str, str]:
+        sentence = self.corpus.sentences[index]
+        edit = self.edits.get(index)
+        if edit:
+            return {**sentence, **edit}
+        if index in self._rule_grammar and not sentence['grammar']:
+            return {**sentence, 'grammar': self._rule_grammar[index]}
+        return sentence
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    def incomplete_count(self) -> int:
+        """このセッションの編集を反映した未完成の文の数"""
+        count = self.corpus.sentences.incomplete_count()
+        for i in self.edits:
+            count += is_incomplete(self[i]) - is_incomplete(self.corpus.sentences[i])
+        return count
+    
+    def update(self, index: int, **fields) -> None:
+        """セッション内だけで文を編集"""
+        self.edits.setdefault(index, {}).update(fields)
+        if 'grammar' in fields:
+            self.category_index.update(index, fields['grammar'])
+        self.search_overrides.set(index, search_document_terms(self[index]))
+    
+    def search(self, query: str) -> List[int]:
+        """このセッションの編集を反映して全文検索し、関連度の高い順に文のインデックスを返す"""
+        return self.corpus.search_index().search(query, self.search_overrides)
+    
+    def vocabulary(self) -> VocabularyIndex:
+        """語彙の頻度インデックス（編集できるのは日本語訳・文法ポイントのみのため、共有のものを使う）"""
+        return self.corpus.vocabulary_index()
+    
+    def fill_missing(self, index: int, result: Dict[str, str]) -> None:
+        """生成結果で空欄を埋める（編集していない欄は共有コーパスに書き込み、全セッションで使う）"""
+        edit = self.edits.get(index, {})
+        base = self.corpus.sentences[index]
+        for field in ('japanese', 'grammar'):
+            if field in edit:
+                if not edit[field]:
+                    self.update(index, **{field: result[field]})
+            elif not base[field] or (field == 'grammar' and result[field] and has_rule_based_grammar(base)):
+                # ルールで作った文法ポイントはAPIの結果で置き換える
+                base[field] = result[field]
+                self.corpus.refresh_indexes(index)
+
+class CorpusStore:
+    """アップロードされたファイルのハッシュをキーに、コーパスをプロセス全体で共有するストア"""
+    
+    def __init__(self, max_entries: int = CORPUS_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._corpora: 'OrderedDict[str, SharedCorpus]' = OrderedDict()
+        self._loading_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._corpora)
+    
+    def get_or_load(self, key: str, loader: Callable[[], Iterable]) -> SharedCorpus:
+        """共有コーパスを取得し、なければ読み込む（同じファイルの同時読み込みは1回にまとめる）"""
+        with self._lock:
+            corpus = self._corpora.get(key)
+            if corpus is not None:
+                self._corpora.move_to_end(key)
+                return corpus
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+        
+        with loading_lock:
+            with self._lock:
+                corpus = self._corpora.get(key)
+            if corpus is None:
+                try:
+                    corpus = SharedCorpus(key, loader())
+                    evicted = []
+                    with self._lock:
+                        self._corpora[key] = corpus
+                        # 古いコーパスから削除（使用中のセッションは参照を保持し続ける）
+                        while len(self._corpora) > self.max_entries:
+                            evicted.append(self._corpora.popitem(last=False)[1])
+                    for old in evicted:
+                        old.close()
+                finally:
+                    # 読み込みに失敗してもロックを残さない（次の読み込みで新しいロックを使う）
+                    with self._lock:
+                        if self._loading_locks.get(key) is loading_lock:
+                            del self._loading_locks[key]
+        return corpus
+
+@st.cache_resource
+def get_corpus_store() -> CorpusStore:
+    """プロセス全体で共有するコーパスストアを取得"""
+    return CorpusStore()
+
+def display_sentence(index: int, sentence: Dict[str, str],
+                     highlighter: Optional[GrammarHighlighter] = None):
+    """文を表示"""
+    with st.container():
+        st.markdown(f'<div class="sentence-card">', unsafe_allow_html=True)
+        st.markdown(f'<span class="sentence-number">文 {index + 1}</span>', unsafe_allow_html=True)
+        
+        # 英文
+        # 準備済みコーパスにハイライト済みのHTMLがあればそれを使う
+        with get_metrics().timer('highlight'):
+            english_highlighted = sentence.get('english_html') or \
+                highlight_grammar_points(sentence['english'], highlighter)
+        st.markdown(f'<div class="english-text">{english_highlighted}</div>', unsafe_allow_html=True)
+        
+        job = current_annotation_job()
+        if job is not None and job.is_pending(index):
+            # バックグラウンドで生成中
+            st.markdown('<div class="japanese-text">⏳ 日本語訳と文法・語彙のポイントを生成中...</div>', unsafe_allow_html=True)
+        elif st.session_state.stream_index == index:
+            # ストリーミングで生成しながら表示
+            stream_sentence_annotation(index, sentence)
+        elif st.session_state.edit_mode:
+            # 編集モード
+            col1, col2 = st.columns(2)
+            with col1:
+                new_japanese = st.text_area(
+                    "日本語訳",
+                    value=sentence['japanese'],
+                    key=f"japanese_{index}",
+                    height=100
+                )
+            with col2:
+                new_grammar = st.text_area(
+                    "文法・語彙",
+                    value=sentence['grammar'],
+                    key=f"grammar_{index}",
+                    height=100
+                )
+            
+            if st.button("💾 保存", key=f"save_{index}", on_click=save_edit, args=(index,)):
+                st.success("保存しました")
+        else:
+            # 表示モード
             if sentence['japanese']:
                 st.markdown(f'<div class="japanese-text">{sentence["japanese"]}</div>', unsafe_allow_html=True)
             
@@ -410,11 +3347,170 @@ def display_sentence(index: int, sentence: Dict[str, str]):
                 st.markdown('<div class="grammar-title">📚 文法・語彙のポイント</div>', unsafe_allow_html=True)
                 st.markdown(f'<div class="grammar-content">{sentence["grammar"]}</div>', unsafe_allow_html=True)
                 st.markdown('</div>', unsafe_allow_html=True)
+            
+            # 単文表示モードでは未入力の欄をその場で生成できる
+            if (not sentence['japanese'] or not sentence['grammar']) and not st.session_state.show_all \
+                    and get_default_scheduler() is not None:
+                st.button(
+                    "✨ 日本語訳と文法ポイントを生成",
+                    key=f"generate_{index}",
+                    on_click=request_stream,
+                    args=(index,)
+                )
         
         st.markdown('</div>', unsafe_allow_html=True)
 
+def stream_sentence_annotation(index: int, sentence: Dict[str, str]):
+    """日本語訳と文法・語彙ポイントをストリーミングで生成しながらカードに表示"""
+    st.session_state.stream_index = None
+    japanese_placeholder = st.empty()
+    grammar_placeholder = st.empty()
+    
+    result = {'japanese': '', 'grammar': ''}
+    # ルールで作った文法ポイントは生成結果で置き換えて表示する
+    rule_grammar = has_rule_based_grammar(sentence)
+    try:
+        for result in stream_translation_and_grammar(sentence['english']):
+            # 既に入力されている欄はそのまま表示する
+            japanese = sentence['japanese'] or result['japanese']
+            grammar = (result['grammar'] or sentence['grammar']) if rule_grammar else \
+                (sentence['grammar'] or result['grammar'])
+            if japanese:
+                japanese_placeholder.markdown(f'<div class="japanese-text">{japanese}</div>', unsafe_allow_html=True)
+            if grammar:
+                grammar_placeholder.markdown(
+                    '<div class="grammar-points">'
+                    '<div class="grammar-title">📚 文法・語彙のポイント</div>'
+                    f'<div class="grammar-content">{grammar}</div>'
+                    '</div>',
+                    unsafe_allow_html=True
+                )
+    except Exception as e:
+        st.error(f"GPT-4o-miniでの生成エラー: {str(e)}")
+        return
+    
+    st.session_state.sentences.fill_missing(index, result)
+    # 統計情報やフィルターにも反映させる
+    st.rerun()
+
+def render_vocabulary_panel():
+    """表示中の範囲（フィルター・検索の結果、なければ全体）の珍しい語と頻出語を表示"""
+    vocabulary = st.session_state.sentences.vocabulary()
+    # 絞り込んでいなければ全体の出現回数をそのまま使い、再実行のたびに全文を数え直さない
+    unit = get_visible_indices() if is_filtered() else None
+    
+    levels = sorted(set(vocabulary.levels.values()))
+    if levels:
+        st.selectbox(
+            "語彙レベル",
+            [None] + levels,
+            format_func=lambda level: "すべて" if level is None else level,
+            key="vocabulary_level"
+        )
+    level = st.session_state.vocabulary_level if st.session_state.vocabulary_level in levels else None
+    st.number_input("表示する語数", min_value=5, max_value=200, step=5, key="vocabulary_top_n")
+    n = st.session_state.vocabulary_top_n
+    
+    with get_metrics().timer('vocabulary_query'):
+        rare = vocabulary.rare_words(n, unit, level)
+        frequent = vocabulary.frequent_words(n, unit, level)
+    
+    def rows(words):
+        return [
+            {
+                '語': word['lemma'],
+                'この範囲': word['unit_count'],
+                '全体': word['corpus_count'],
+                **({'レベル': word['level'] or ''} if levels else {})
+            }
+            for word in words
+        ]
+    
+    scope = f"表示中の{len(unit)}文" if unit is not None else "コーパス全体"
+    st.caption(f"{scope}の語（活用形をまとめて数えています）")
+    st.markdown("**珍しい語**")
+    st.dataframe(rows(rare), hide_index=True, use_container_width=True)
+    st.markdown("**よく出る語**")
+    st.dataframe(rows(frequent), hide_index=True, use_container_width=True)
+
 # メインアプリ
+def render_performance_panel():
+    """処理ごとの所要時間とAPIの利用状況を表示し、JSON・Prometheus形式で書き出せるようにする"""
+    metrics = get_metrics()
+    counters = collect_metrics()
+    snapshot = metrics.snapshot(counters)
+    if snapshot['timers']:
+        st.dataframe(
+            [
+                {
+                    '処理': name,
+                    '回数': timer['count'],
+                    '平均(ms)': round(timer['mean_ms'], 2),
+                    'p50(ms)': round(timer['p50_ms'], 2),
+                    'p99(ms)': round(timer['p99_ms'], 2),
+                    '最大(ms)': round(timer['max_ms'], 2),
+                    '合計(ms)': round(timer['total_ms'], 1)
+                }
+                for name, timer in snapshot['timers'].items()
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+    st.dataframe(
+        [{'項目': name, '値': value} for name, value in snapshot['counters'].items()],
+        hide_index=True,
+        use_container_width=True
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            "JSON",
+            data=metrics.to_json(counters),
+            file_name="metrics.json",
+            mime="application/json",
+            key="metrics_json_button"
+        )
+    with col2:
+        st.download_button(
+            "Prometheus",
+            data=metrics.to_prometheus(counters),
+            file_name="metrics.prom",
+            mime="text/plain",
+            key="metrics_prometheus_button"
+        )
+    st.button("🔄 計測をリセット", key="metrics_reset_button", on_click=metrics.reset)
+
 def main():
+    loaded = time.perf_counter()
+    setup_page()
+    
+    # スクリプトの読み込みにかかった時間と、1回の再実行にかかった時間を計測する（生成中の待機は含めない）
+    metrics = get_metrics()
+    metrics.observe('script_load', loaded - SCRIPT_STARTED)
+    # 表示中に完了したジョブは、最後の結果を表示するためにもう一度再実行する
+    job = current_annotation_job()
+    was_running = job is not None and job.is_running()
+    with metrics.timer('rerun'):
+        render_app()
+    
+    # プロセスの最初の実行は、読み込みから最初の画面の表示までを起動時間として記録する
+    if not metrics.started:
+        metrics.started = True
+        metrics.observe('cold_start', time.perf_counter() - SCRIPT_STARTED)
+    
+    # バックグラウンド生成中は一定時間ごとに再実行して進捗を表示する（完了したらすぐに再実行する）
+    job = current_annotation_job()
+    if job is not None and (job.is_running() or was_running):
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            # 閉じられたセッションは再実行を続けない（監視が途切れ、表示中のセッションがなくなれば生成を取り消す）
+            if Runtime.exists() and not Runtime.instance().is_active_session(ctx.session_id):
+                return
+            job.watch(ctx.session_id)
+        job.wait(ANNOTATION_POLL_INTERVAL)
+        st.rerun()
+
+def render_app():
     st.title("🎓 英語特講2025 - 文法・語彙解析")
     
     # サイドバー
@@ -425,8 +3521,8 @@ def main():
         st.subheader("📁 ファイル読み込み")
         uploaded_file = st.file_uploader(
             "ファイルを選択",
-            type=['tsv', 'json', 'txt'],
-            help="TSV、JSON、またはテキストファイルをアップロード",
+            type=['tsv', 'json', 'jsonl', 'txt', PREPARED_CORPUS_EXTENSION.lstrip('.')],
+            help="TSV、JSON、JSON Lines、テキスト、または準備済みコーパスのファイルをアップロード",
             key="file_uploader"
         )
         
@@ -440,62 +3536,190 @@ def main():
         if api_key:
             os.environ['OPENAI_API_KEY'] = api_key
         
+        st.number_input(
+            "同時リクエスト数",
+            min_value=1,
+            max_value=32,
+            step=1,
+            key="max_concurrency",
+            help="日本語訳・文法ポイントを並行して生成するリクエスト数の上限"
+        )
+        st.checkbox(
+            "複数の文をまとめて生成",
+            key="batch_mode",
+            help="複数の文を1回のリクエストにまとめ、API呼び出し回数とトークン数を削減します"
+        )
+        st.checkbox(
+            "ほぼ同じ文の結果を再利用",
+            key="near_duplicates",
+            help="記号や一部の語だけが異なる文は、生成済みの似た文の日本語訳・文法ポイントを使います"
+        )
+        st.checkbox(
+            "ルールで判定できる文はAPIを使わない",
+            key="rules_first",
+            help="時制・態・関係詞・不定詞・分詞構文・比較などをルールで判定できた文は文法ポイントをすぐに作り、"
+                 "判定できない文だけをGPT-4o-miniで生成します（ルールで処理した文には日本語訳が付きません）"
+        )
+        
+        # LLMキャッシュの状況
+        cache_stats = get_llm_cache().stats()
+        st.caption(
+            f"💾 キャッシュ: {cache_stats['entries']}件 "
+            f"(ヒット {cache_stats['hits']} / ミス {cache_stats['misses']})"
+        )
+        scheduler = get_default_scheduler()
+        if scheduler is not None:
+            scheduler_stats = scheduler.stats()
+            st.caption(
+                f"📡 APIリクエスト: {scheduler_stats['requests']}回 "
+                f"(リトライ {scheduler_stats['retries']} / "
+                f"待機 {scheduler_stats['throttled_seconds']:.1f}秒)"
+            )
+        if st.button("🗑️ キャッシュをクリア", key="clear_cache_button"):
+            get_llm_cache().clear()
+            st.rerun()
+        
         if uploaded_file is not None and not st.session_state.file_loaded:
-            content = uploaded_file.read().decode('utf-8')
+            # 同じファイルは内容のハッシュで判定し、解析・生成済みの結果を全セッションで共有する
+            name = uploaded_file.name
+            extension = os.path.splitext(name)[1].lower()
+            key = f"{hash_stream(uploaded_file)}:{extension}"
+            if extension == '.txt':
+                # プレーンテキストはAPIキーの有無で文分割の方法が変わるため、分割方法もキーに含める
+                key += ':llm' if get_default_scheduler() is not None else ':simple'
+            max_concurrency = st.session_state.max_concurrency
+            metrics = get_metrics()
             
-            if uploaded_file.name.endswith('.tsv'):
-                sentences = parse_tsv_content(content)
-            elif uploaded_file.name.endswith('.json'):
-                sentences = parse_json_content(content)
-            elif '｜' in content:
-                sentences = parse_pipe_text(content)
-            else:
-                sentences = parse_plain_text(content)
+            def load():
+                with metrics.timer('parse'):
+                    return parse_uploaded_file(name, uploaded_file, max_concurrency)
             
-            if sentences:
-                # 英文のみの場合はGPT-4o-miniで翻訳と文法ポイントを生成
-                if all(not s['japanese'] and not s['grammar'] for s in sentences):
-                    total = len(sentences)
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    for i, sentence in enumerate(sentences):
-                        if sentence['english'] and not sentence['japanese']:
-                            status_text.text(f"処理中... ({i+1}/{total})")
-                            result = generate_translation_and_grammar(sentence['english'])
-                            sentences[i]['japanese'] = result['japanese']
-                            sentences[i]['grammar'] = result['grammar']
-                            progress_bar.progress((i + 1) / total)
-                    
-                    progress_bar.empty()
-                    status_text.empty()
+            corpus = get_corpus_store().get_or_load(key, load)
+            
+            if corpus.sentences:
+                # 日本語訳・文法ポイントが欠けている文はGPT-4o-miniでバックグラウンド生成
+                # （APIキーがない場合は生成せず、このセッションでだけルールによる文法ポイントを表示する）
+                corpus.start_annotation(
+                    max_concurrency,
+                    st.session_state.batch_mode,
+                    st.session_state.near_duplicates,
+                    st.session_state.rules_first
+                )
                 
-                st.session_state.sentences = sentences
+                if st.session_state.corpus is not corpus:
+                    unwatch_annotation_job()
+                st.session_state.corpus = corpus
+                st.session_state.sentences = SessionCorpusView(
+                    corpus, rule_grammar=get_default_scheduler() is None
+                )
                 st.session_state.current_index = 0
                 st.session_state.file_loaded = True
-                st.success(f"{len(sentences)}個の文を読み込みました")
+                st.success(f"{len(corpus.sentences)}個の文を読み込みました")
                 st.rerun()
         
         # ファイルがアップロードされていない状態に戻った場合の処理
+        # （共有コーパスの生成ジョブは、他に表示中のセッションがあれば継続する）
         if uploaded_file is None and st.session_state.file_loaded:
+            unwatch_annotation_job()
             st.session_state.file_loaded = False
+            st.session_state.corpus = None
             st.session_state.sentences = []
             st.session_state.current_index = 0
+            st.session_state.prepared_export = None
             st.rerun()
         
+        # バックグラウンド生成の進捗
+        job = current_annotation_job()
+        if job is not None and job.restored:
+            st.caption(f"♻️ 前回の生成結果から{job.restored}個の文を復元しました")
+        if job is not None and job.dedup.get('skipped'):
+            st.caption(
+                f"🔁 重複する{job.dedup['skipped']}個の文の生成を省略しました"
+                f"（うち類似文 {job.dedup['near']}個）"
+            )
+        if job is not None and job.rule_annotated:
+            st.caption(f"⚡ {job.rule_annotated}個の文はルールで文法ポイントのみ作成しました（日本語訳なし）")
+        if st.session_state.sentences and st.session_state.sentences.rule_grammar:
+            st.caption("⚡ APIキーがないため、空の文法ポイントはルールで判定できるものだけを表示しています（日本語訳なし）")
+        if job is not None and job.total:
+            if job.is_running():
+                st.progress(job.done / job.total, text=f"生成中... ({job.done}/{job.total})")
+            elif job.error:
+                st.error(f"日本語訳・文法ポイントの生成中にエラーが発生しました: {job.error}")
+            elif job.failed:
+                st.warning(
+                    f"{job.failed}個の文で日本語訳・文法ポイントを生成できませんでした"
+                    "（ルールで判定できる文法ポイントのみ埋めています）"
+                )
+        
+        # 準備済みコーパスとして書き出し、次回からは解析し直さずに開けるようにする
+        if st.session_state.sentences:
+            if st.button(
+                "📦 準備済みコーパスを作成",
+                key="export_button",
+                help="文法カテゴリー・ハイライト・統計を含むファイルを作成し、次回すぐに開けるようにします"
+            ):
+                stem = os.path.splitext(uploaded_file.name)[0] if uploaded_file is not None else 'corpus'
+                export_dir = os.path.join(PREPARED_CORPUS_DIR, 'exports')
+                os.makedirs(export_dir, exist_ok=True)
+                fd, path = tempfile.mkstemp(suffix=PREPARED_CORPUS_EXTENSION, dir=export_dir)
+                os.close(fd)
+                try:
+                    export_prepared_corpus(
+                        path, st.session_state.sentences, get_highlighter(*load_highlight_words())
+                    )
+                    with open(path, 'rb') as f:
+                        st.session_state.prepared_export = (
+                            f"{stem}.corpus{PREPARED_CORPUS_EXTENSION}", f.read()
+                        )
+                finally:
+                    os.remove(path)
+            if st.session_state.prepared_export is not None:
+                file_name, data = st.session_state.prepared_export
+                st.download_button(
+                    "⬇️ 準備済みコーパスをダウンロード",
+                    data=data,
+                    file_name=file_name,
+                    mime="application/vnd.sqlite3",
+                    key="export_download_button",
+                    on_click=clear_prepared_export
+                )
+        
         st.divider()
         
         # 文法フィルター
         if st.session_state.sentences:
             st.subheader("🔍 文法フィルター")
-            categories = extract_grammar_categories(st.session_state.sentences)
+            categories = get_category_index().categories()
             selected_categories = st.multiselect(
                 "文法項目を選択",
                 categories,
-                default=st.session_state.grammar_filter,
-                key="grammar_filter_select"
+                default=[c for c in st.session_state.grammar_filter if c in categories],
+                key="grammar_filter_select",
+                on_change=reset_page
             )
             st.session_state.grammar_filter = selected_categories
+            
+            st.text_input(
+                "キーワード検索",
+                key="search_query",
+                on_change=reset_page,
+                help="英文・日本語訳・文法ポイントを検索し、全文表示で関連度の高い順に表示します（複数語はスペース区切り）"
+            )
+            st.text_input(
+                "単語で絞り込み",
+                key="vocabulary_word",
+                on_change=reset_page,
+                help="活用形もまとめて、指定した英単語を含む文だけを表示します（例: go で went・gone を含む文も表示）"
+            )
+            
+            # 語彙の頻度（大きなコーパスでも開いたときだけインデックスを作る）
+            if st.checkbox("📖 語彙の頻度を表示", key="show_vocabulary"):
+                render_vocabulary_panel()
+        
+        # 性能計測
+        with st.expander("⏱️ パフォーマンス", expanded=False):
+            render_performance_panel()
     
     # メインコンテンツ
     if not st.session_state.sentences:
@@ -510,13 +3734,11 @@ def main():
         current = st.session_state.current_index + 1
         st.metric("現在の文", f"{current}/{len(st.session_state.sentences)}")
     with col3:
-        incomplete = sum(1 for s in st.session_state.sentences if not s['japanese'] or not s['grammar'])
+        incomplete = st.session_state.sentences.incomplete_count()
         st.metric("未完成", incomplete)
     with col4:
-        if st.session_state.grammar_filter:
-            filtered = len([s for s in st.session_state.sentences 
-                          if any(cat in s.get('grammar', '') for cat in st.session_state.grammar_filter)])
-            st.metric("フィルター結果", filtered)
+        if is_filtered():
+            st.metric("フィルター結果", len(get_visible_indices()))
     
     st.divider()
     
@@ -558,25 +3780,68 @@ def main():
     st.divider()
     
     # 文の表示
+    highlighter = get_highlighter(*load_highlight_words())
     if st.session_state.show_all:
-        # 全文表示モード
-        for i, sentence in enumerate(st.session_state.sentences):
-            if st.session_state.grammar_filter:
-                if not any(cat in sentence.get('grammar', '') for cat in st.session_state.grammar_filter):
-                    continue
-            
-            display_sentence(i, sentence)
+        # 全文表示モード（表示中のページの文だけを描画する）
+        indices = get_visible_indices()
+        page_size = st.session_state.page_size
+        total_pages, page_number, start = page_bounds(len(indices), page_size, st.session_state.page_number)
+        if st.session_state.page_number != page_number:
+            st.session_state.page_number = page_number
+        if st.session_state.jump_to > len(st.session_state.sentences):
+            st.session_state.jump_to = len(st.session_state.sentences)
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.selectbox(
+                "1ページの表示件数",
+                PAGE_SIZE_OPTIONS,
+                key="page_size",
+                on_change=reset_page
+            )
+        with col2:
+            st.number_input(
+                f"ページ（全{total_pages}ページ）",
+                min_value=1,
+                max_value=total_pages,
+                step=1,
+                key="page_number"
+            )
+        with col3:
+            st.number_input(
+                "文番号へ移動",
+                min_value=1,
+                max_value=len(st.session_state.sentences),
+                step=1,
+                key="jump_to",
+                on_change=jump_to_sentence
+            )
+        
+        for i in indices[start:start + page_size]:
+            display_sentence(i, st.session_state.sentences[i], highlighter)
+        
+        if not indices:
+            st.info("フィルター・検索に該当する文はありません")
     else:
         # 単文表示モード
         if 0 <= st.session_state.current_index < len(st.session_state.sentences):
             sentence = st.session_state.sentences[st.session_state.current_index]
-            display_sentence(st.session_state.current_index, sentence)
+            display_sentence(st.session_state.current_index, sentence, highlighter)
     
     # デバッグ情報（開発中のみ表示）
     with st.expander("デバッグ情報", expanded=False):
         st.write("現在のインデックス:", st.session_state.current_index)
         st.write("総文数:", len(st.session_state.sentences))
         st.write("ファイル読み込み済み:", st.session_state.file_loaded)
+        st.write("共有コーパス数:", len(get_corpus_store()))
+        if st.session_state.corpus is not None:
+            memory = st.session_state.corpus.sentences.memory_usage()
+            st.write(
+                "コーパスのメモリ使用量:",
+                f"{memory['bytes'] / 1024 / 1024:.2f} MB "
+                f"({memory['sentences']}文, 文法ポイント {memory['unique_grammar']}種類)"
+            )
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import annotate_corpus
+
+
+def write_input(path, rows):
+    path.write_text(''.join(f"{english}\t{japanese}\t{grammar}\n" for english, japanese, grammar in rows),
+                    encoding='utf-8')
+
+
+COMPLETE_ROWS = [
+    ('I have a pen.', '私はペンを持っている。', '現在形 have'),
+    ('She was reading.', '彼女は読んでいた。', '過去進行形 was reading'),
+]
+
+
+@pytest.mark.request('user-015')
+def test_collect_inputs_skips_outputs_and_unknown_files(tmp_path):
+    (tmp_path / 'in' / 'sub').mkdir(parents=True)
+    (tmp_path / 'in' / 'a.tsv').write_text('', encoding='utf-8')
+    (tmp_path / 'in' / 'sub' / 'b.txt').write_text('', encoding='utf-8')
+    (tmp_path / 'in' / 'a.annotated.json').write_text('{}', encoding='utf-8')
+    (tmp_path / 'in' / 'notes.md').write_text('', encoding='utf-8')
+    inputs = annotate_corpus.collect_inputs([str(tmp_path / 'in')])
+    assert sorted(relative for _, relative in inputs) == ['a.tsv', 'sub/b.txt']
+
+
+@pytest.mark.request('user-015')
+def test_output_path_for():
+    assert annotate_corpus.output_path_for('in/a.tsv', 'a.tsv', None) == 'in/a.annotated.json'
+    assert annotate_corpus.output_path_for('in/sub/b.txt', 'sub/b.txt', 'out', 'prepared') == \
+        'out/sub/b.corpus.sqlite3'
+
+
+@pytest.mark.request('user-015')
+@pytest.mark.parametrize('output_format', ['json', 'prepared'])
+def test_complete_output_is_skipped_until_input_changes(tmp_path, output_format):
+    source = tmp_path / 'a.tsv'
+    write_input(source, COMPLETE_ROWS)
+    assert annotate_corpus.main([str(source), '--format', output_format]) == 0
+    output = annotate_corpus.output_path_for(str(source), 'a.tsv', None, output_format)
+    assert annotate_corpus.is_complete_output(output, annotate_corpus.source_hash_of(str(source)))
+
+    write_input(source, COMPLETE_ROWS + [('It rains.', '雨が降る。', '現在形 rains')])
+    assert not annotate_corpus.is_complete_output(output, annotate_corpus.source_hash_of(str(source)))
+
+
+@pytest.mark.request('user-015')
+def test_json_output_can_be_loaded_by_the_app(tmp_path):
+    source = tmp_path / 'a.tsv'
+    write_input(source, COMPLETE_ROWS)
+    annotate_corpus.main([str(source)])
+    with open(tmp_path / 'a.annotated.json', encoding='utf-8') as f:
+        corpus = json.load(f)
+    assert set(corpus) == {'source_hash', 'stats', 'sentences'}
+    assert corpus['stats'] == {'total': 2, 'incomplete': 0}
+
+    import english_study_streamlit as app
+    with open(tmp_path / 'a.annotated.json', 'rb') as f:
+        sentences = app.parse_uploaded_file('a.annotated.json', f)
+    assert [sentences[i]['english'] for i in range(len(sentences))] == [row[0] for row in COMPLETE_ROWS]
@@ -0,0 +1,48 @@
+import pytest
+
+import english_study_streamlit as app
+
+
+def make_sentences(*texts):
+    return [{'english': text, 'japanese': '', 'grammar': ''} for text in texts]
+
+
+@pytest.mark.request('user-006')
+def test_targets_are_sentences_with_a_missing_field():
+    sentences = [
+        {'english': 'I run.', 'japanese': '私は走る。', 'grammar': '現在形'},
+        {'english': 'She ran.', 'japanese': '彼女は走った。', 'grammar': ''},
+        {'english': '', 'japanese': '', 'grammar': ''},
+        {'english': 'We walk.', 'japanese': '', 'grammar': '現在形'},
+    ]
+    assert app.annotation_targets(sentences) == [1, 3]
+
+
+@pytest.mark.request('user-006')
+def test_restore_fills_only_empty_fields_of_matching_sentences():
+    sentences = make_sentences('I run.', 'She ran.', 'We walk.')
+    checkpoint = app.AnnotationCheckpoint.for_sentences(sentences)
+    checkpoint.record(0, {'english': 'I run.', 'japanese': '私は走る。', 'grammar': '現在形'})
+    checkpoint.record(1, {'english': 'Other.', 'japanese': '別の文', 'grammar': ''})
+    checkpoint.record(7, {'english': 'We walk.', 'japanese': '範囲外', 'grammar': ''})
+    with open(checkpoint.path, 'a', encoding='utf-8') as f:
+        f.write('{"index": 2, "english": "We wa')
+
+    sentences[0]['grammar'] = '手で入力した解説'
+    restored = app.AnnotationCheckpoint.for_sentences(sentences).restore(sentences)
+    assert restored == [0]
+    assert sentences[0] == {'english': 'I run.', 'japanese': '私は走る。', 'grammar': '手で入力した解説'}
+    assert sentences[1]['japanese'] == ''
+    assert sentences[2]['japanese'] == ''
+
+
+@pytest.mark.request('user-006')
+def test_checkpoint_depends_on_the_sentences_and_can_be_removed():
+    sentences = make_sentences('I run.')
+    checkpoint = app.AnnotationCheckpoint.for_sentences(sentences)
+    assert checkpoint.path != app.AnnotationCheckpoint.for_sentences(make_sentences('I ran.')).path
+    assert checkpoint.restore(sentences) == []
+    checkpoint.record(0, {'english': 'I run.', 'japanese': '私は走る。', 'grammar': ''})
+    checkpoint.remove()
+    assert checkpoint.restore(sentences) == []
+    checkpoint.remove()
@@ -0,0 +1,120 @@
+import threading
+import types
+
+import pytest
+
+import english_study_streamlit as app
+
+
+class GatedScheduler:
+    """gateが開くまで応答を返さず、取り消された後のリクエストは送らない模擬スケジューラ"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.requests = []
+        self.gate = threading.Event()
+        self._lock = threading.Lock()
+
+    def chat(self, messages, max_tokens, cancel_event=None, **kwargs):
+        if cancel_event is not None and cancel_event.is_set():
+            raise app.RequestCancelled()
+        text = messages[1]['content']
+        with self._lock:
+            self.requests.append(text)
+        self.gate.wait(5)
+        if any(word in text for word in self.fail):
+            raise RuntimeError('service unavailable')
+        content = '日本語訳: 訳\n文法・語彙のポイント: 解説'
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+        )
+
+
+def make_sentences(count):
+    return [{'english': f'Sentence number {n}.', 'japanese': '', 'grammar': ''} for n in range(count)]
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = GatedScheduler()
+    monkeypatch.setattr(app, 'get_default_scheduler', lambda: scheduler)
+    return scheduler
+
+
+def start_job(sentences, **options):
+    updated = []
+    job = app.AnnotationJob(
+        sentences, max_concurrency=options.pop('max_concurrency', 2), batch_mode=False,
+        on_update=updated.append, **options
+    ).start()
+    return job, updated
+
+
+@pytest.mark.request('user-005')
+def test_job_reports_progress_and_updates_each_sentence(scheduler):
+    scheduler.fail = {'number 3'}
+    sentences = make_sentences(4)
+    job, updated = start_job(sentences)
+    assert job.total == 4
+    assert job.is_running()
+    scheduler.gate.set()
+    assert job.wait(5)
+    assert not job.is_running() and job.error is None
+    assert (job.done, job.failed) == (4, 1)
+    assert sorted(updated) == [0, 1, 2, 3]
+    assert [s['japanese'] for s in sentences] == ['訳', '訳', '訳', '']
+    assert not any(job.is_pending(i) for i in range(4))
+
+
+@pytest.mark.request('user-005')
+def test_cancel_stops_sending_requests(scheduler):
+    sentences = make_sentences(5)
+    job, _ = start_job(sentences, max_concurrency=1)
+    job.cancel()
+    scheduler.gate.set()
+    assert job.wait(5)
+    assert job.cancelled
+    assert len(scheduler.requests) == 1
+    assert [s['japanese'] for s in sentences].count('訳') == 1
+    # 途中で取り消した場合はチェックポイントを残し、次回に再開できるようにする
+    assert app.os.path.exists(job.checkpoint.path)
+
+
+@pytest.mark.request('user-005')
+def test_last_watcher_leaving_cancels_the_job(scheduler):
+    job, _ = start_job(make_sentences(3))
+    job.unwatch('unknown')
+    assert not job.cancelled
+    job.watch('a')
+    job.watch('b')
+    job.unwatch('a')
+    assert not job.cancelled
+    job.unwatch('b')
+    assert job.cancelled
+    scheduler.gate.set()
+    assert job.wait(5)
+
+
+@pytest.mark.request('user-005')
+def test_sessions_that_stop_rerunning_are_expired(scheduler, monkeypatch):
+    monkeypatch.setattr(app, 'ANNOTATION_POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(app, 'ANNOTATION_WATCHER_TIMEOUT', 0.05)
+    job, _ = start_job(make_sentences(3))
+    job.watch('closed')
+    assert job._cancel_event.wait(5)
+    scheduler.gate.set()
+    assert job.wait(5)
+
+
+@pytest.mark.request('user-005')
+def test_evicted_corpus_cancels_its_job(scheduler):
+    store = app.CorpusStore(max_entries=1)
+    corpus = store.get_or_load('a', lambda: make_sentences(3))
+    job = corpus.start_annotation(max_concurrency=1, batch_mode=False)
+    store.get_or_load('b', lambda: make_sentences(1))
+    assert job.cancelled
+    # 取り消されたジョブは、終了を待たずに新しいジョブで置き換えられる
+    new_job = corpus.start_annotation(max_concurrency=1, batch_mode=False)
+    assert new_job is not job
+    scheduler.gate.set()
+    assert job.wait(5) and new_job.wait(5)
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import english_study_streamlit as app
+
+
+@pytest.mark.request('user-003')
+def test_batches_respect_size_and_token_budget():
+    assert app.make_batches(['a'] * 5, token_budget=10000, max_size=2) == [[0, 1], [2, 3], [4]]
+    cost = app.estimate_tokens('a') + app.BATCH_OUTPUT_TOKENS_PER_SENTENCE
+    assert app.make_batches(['a'] * 5, token_budget=cost * 2, max_size=20) == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.request('user-003')
+def test_sentence_over_budget_gets_its_own_batch():
+    long_text = 'word ' * 2000
+    assert app.make_batches(['a', long_text, 'b'], token_budget=1000) == [[0], [1], [2]]
+
+
+@pytest.mark.request('user-003')
+def test_estimate_tokens_counts_non_ascii_per_character():
+    assert app.estimate_tokens('abcdefgh') == 3
+    assert app.estimate_tokens('日本語') == 4
+
+
+@pytest.mark.request('user-003')
+def test_batch_response_is_matched_by_id():
+    content = json.dumps({'results': [
+        {'id': 2, 'japanese': ' 彼女は走った。 ', 'grammar': '過去形'},
+        {'id': '1', 'japanese': '私は走る。'},
+        {'id': 9, 'japanese': '範囲外'},
+        {'id': 'x', 'japanese': '不正なid'},
+        {'id': 3, 'japanese': ''},
+        'not a dict',
+    ]}, ensure_ascii=False)
+    assert app.parse_batch_response(content, 3) == [
+        {'japanese': '私は走る。', 'grammar': ''},
+        {'japanese': '彼女は走った。', 'grammar': '過去形'},
+        None,
+    ]
+
+
+@pytest.mark.request('user-003')
+@pytest.mark.parametrize('content', ['not json', None, '{"results": "x"}', '42'])
+def test_unparsable_batch_response_returns_no_results(content):
+    assert app.parse_batch_response(content, 2) == [None, None]
+
+
+@pytest.mark.request('user-003')
+def test_batch_response_accepts_a_bare_array():
+    content = json.dumps([{'id': 1, 'japanese': '私は走る。', 'grammar': '現在形'}], ensure_ascii=False)
+    assert app.parse_batch_response(content, 1) == [{'japanese': '私は走る。', 'grammar': '現在形'}]
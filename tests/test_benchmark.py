@@ -0,0 +1,35 @@
+import pytest
+
+import benchmark
+
+
+@pytest.mark.request('user-019')
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert benchmark.percentile(values, 50) == 50.0
+    assert benchmark.percentile(values, 99) == 99.0
+    assert benchmark.percentile([], 50) == 0.0
+
+
+@pytest.mark.request('user-019')
+def test_summarize_timings_reports_min_for_few_runs():
+    summary = benchmark.summarize_timings([0.003, 0.001, 0.002])
+    assert summary == {'p50_ms': pytest.approx(2.0), 'min_ms': pytest.approx(1.0)}
+
+
+@pytest.mark.request('user-019')
+def test_summarize_timings_reports_p99_for_enough_runs():
+    timings = [i / 1000 for i in range(1, benchmark.TAIL_PERCENTILE_MIN_RUNS + 1)]
+    summary = benchmark.summarize_timings(timings)
+    assert set(summary) == {'p50_ms', 'p99_ms'}
+
+
+@pytest.mark.request('user-019')
+def test_measure_runs_and_prints(capsys):
+    calls = []
+    result = benchmark.measure('noop', 10, lambda: calls.append(1), 3)
+    # 3回の測定とピークメモリの測定1回
+    assert len(calls) == 4
+    assert result['runs'] == 3 and 'min_ms' in result and 'p99_ms' not in result
+    benchmark.print_result(result)
+    assert 'min' in capsys.readouterr().out
@@ -0,0 +1,96 @@
+import json
+import re
+import threading
+import time
+import types
+
+import pytest
+
+import english_study_streamlit as app
+
+
+class DelayedScheduler:
+    """後に送られた文ほど早く応答し、指定した番号の文では失敗する模擬スケジューラ"""
+
+    def __init__(self, count, fail=()):
+        self.count = count
+        self.fail = set(fail)
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def chat(self, messages, max_tokens, cancel_event=None, response_format=None, **kwargs):
+        numbers = [int(n) for n in re.findall(r'Sentence number (\d+)\.', messages[1]['content'])]
+        with self._lock:
+            self.threads.append(threading.current_thread())
+        time.sleep((self.count - min(numbers)) * 0.01)
+        if self.fail & set(numbers):
+            raise RuntimeError('service unavailable')
+        if response_format is not None:
+            content = json.dumps({'results': [
+                {'id': position, 'japanese': f'訳{n}', 'grammar': f'解説{n}'}
+                for position, n in enumerate(numbers, start=1)
+            ]})
+        else:
+            content = f'日本語訳: 訳{numbers[0]}\n文法・語彙のポイント: 解説{numbers[0]}'
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+        )
+
+
+def make_sentences(count):
+    return [{'english': f'Sentence number {n}.', 'japanese': '', 'grammar': ''} for n in range(count)]
+
+
+@pytest.fixture
+def attached(monkeypatch):
+    """create_executorがワーカースレッドに引き継いだ実行コンテキストを記録する"""
+    ctx = object()
+    attached = {}
+    monkeypatch.setattr(app, 'get_script_run_ctx', lambda: ctx)
+    monkeypatch.setattr(app, 'add_script_run_ctx', lambda thread, context: attached.update({thread: context}))
+    return ctx, attached
+
+
+@pytest.mark.request('user-001')
+@pytest.mark.parametrize('batch_mode', [False, True])
+def test_results_are_written_back_in_original_order(attached, monkeypatch, batch_mode):
+    make_batches = app.make_batches
+    monkeypatch.setattr(app, 'make_batches', lambda texts: make_batches(texts, max_size=3))
+    sentences = make_sentences(8)
+    scheduler = DelayedScheduler(len(sentences))
+    completed = []
+    progress = []
+    app.annotate_sentences(sentences, 4, batch_mode=batch_mode, scheduler=scheduler,
+                           cache=app.LLMCache('cache.sqlite3'),
+                           result_callback=lambda i, result: completed.append(i),
+                           progress_callback=lambda done, total: progress.append((done, total)))
+    assert [sentence['japanese'] for sentence in sentences] == [f'訳{n}' for n in range(8)]
+    assert [sentence['grammar'] for sentence in sentences] == [f'解説{n}' for n in range(8)]
+    assert len(scheduler.threads) == (4 if batch_mode else 8)
+    assert sorted(completed) == list(range(8))
+    assert progress[-1] == (8, 8)
+    assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+
+
+@pytest.mark.request('user-001')
+def test_partial_failures_do_not_stop_other_sentences(attached):
+    sentences = make_sentences(6)
+    scheduler = DelayedScheduler(len(sentences), fail={1, 4})
+    results = {}
+    app.annotate_sentences(sentences, 3, batch_mode=False, scheduler=scheduler,
+                           cache=app.LLMCache('cache.sqlite3'),
+                           result_callback=lambda i, result: results.update({i: result}))
+    assert sorted(results) == list(range(6))
+    assert {i for i, result in results.items() if result.get('failed')} == {1, 4}
+    assert [sentence['japanese'] for sentence in sentences] == ['訳0', '', '訳2', '訳3', '', '訳5']
+
+
+@pytest.mark.request('user-001')
+def test_worker_threads_inherit_script_run_context(attached):
+    ctx, contexts = attached
+    scheduler = DelayedScheduler(4)
+    app.annotate_sentences(make_sentences(4), 2, batch_mode=False, scheduler=scheduler,
+                           cache=app.LLMCache('cache.sqlite3'))
+    assert threading.current_thread() not in scheduler.threads
+    assert set(scheduler.threads) <= set(contexts)
+    assert set(contexts.values()) == {ctx}
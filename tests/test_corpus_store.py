@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+import english_study_streamlit as app
+
+
+def make_store(*sentences):
+    return app.SentenceStore.from_records(
+        {'english': english, 'japanese': '', 'grammar': ''} for english in sentences
+    )
+
+
+@pytest.mark.request('user-012')
+def test_get_or_load_loads_once_and_shares():
+    store = app.CorpusStore()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return make_store('I have a pen.')
+
+    first = store.get_or_load('a', loader)
+    second = store.get_or_load('a', loader)
+    assert first is second
+    assert len(calls) == 1
+
+
+@pytest.mark.request('user-012')
+def test_get_or_load_evicts_oldest():
+    store = app.CorpusStore(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        store.get_or_load(key, lambda: make_store('Hello.'))
+    assert len(store) == 2
+    calls = []
+    store.get_or_load('a', lambda: calls.append(1) or make_store('Hello.'))
+    assert calls == [1]
+
+
+@pytest.mark.request('user-012')
+def test_get_or_load_failure_releases_loading_lock():
+    store = app.CorpusStore()
+
+    def failing_loader():
+        raise ValueError('broken file')
+
+    with pytest.raises(ValueError):
+        store.get_or_load('a', failing_loader)
+    assert store._loading_locks == {}
+    assert len(store.get_or_load('a', lambda: make_store('Hello.')).sentences) == 1
+
+
+@pytest.mark.request('user-012')
+def test_get_or_load_concurrent_loads_once():
+    store = app.CorpusStore()
+    calls = []
+    started = threading.Event()
+
+    def slow_loader():
+        calls.append(1)
+        started.wait(1)
+        return make_store('Hello.')
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(store.get_or_load('a', slow_loader)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(corpus is results[0] for corpus in results)
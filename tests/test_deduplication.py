@@ -0,0 +1,57 @@
+import pytest
+
+import english_study_streamlit as app
+
+
+def make_sentences(*rows):
+    return [{'english': english, 'japanese': japanese, 'grammar': grammar} for english, japanese, grammar in rows]
+
+
+@pytest.mark.request('user-018')
+def test_exact_duplicates_share_one_representative():
+    sentences = make_sentences(
+        ('I like apples.', '', ''),
+        ('i  like APPLES.', '', ''),
+        ('She runs fast.', '', ''),
+    )
+    plan = app.plan_deduplication(sentences, [0, 1, 2])
+    assert plan.representatives == [0, 2]
+    assert plan.duplicates == {0: [1], 2: []}
+    assert plan.stats() == {'skipped': 1, 'exact': 1, 'near': 0}
+
+
+@pytest.mark.request('user-018')
+def test_completed_sentences_are_reused():
+    sentences = make_sentences(
+        ('I like apples.', '私はりんごが好きだ。', '現在形'),
+        ('I like apples.', '', ''),
+    )
+    plan = app.plan_deduplication(sentences, [1])
+    assert plan.representatives == []
+    assert plan.reused == {1: 0}
+
+
+@pytest.mark.request('user-018')
+def test_near_duplicates_only_when_enabled():
+    sentences = make_sentences(
+        ('The quick brown fox jumps over the lazy dog.', '', ''),
+        ('The quick brown fox jumps over the lazy dog!!', '', ''),
+        ('A completely different sentence about cats.', '', ''),
+    )
+    assert app.plan_deduplication(sentences, [0, 1, 2]).representatives == [0, 1, 2]
+    plan = app.plan_deduplication(sentences, [0, 1, 2], near_duplicates=True)
+    assert plan.representatives == [0, 2]
+    assert plan.duplicates[0] == [1]
+    assert plan.stats()['near'] == 1
+
+
+@pytest.mark.request('user-018')
+def test_near_duplicate_index_threshold():
+    index = app.NearDuplicateIndex(threshold=0.8)
+    index.add(0, 'She has lived in Tokyo for ten years.')
+    assert index.find_or_add(1, 'She has lived in Tokyo for ten years') == 0
+    assert index.find_or_add(2, 'He went to the station by bus yesterday.') is None
+    assert index.find_or_add(3, 'He went to the station by bus yesterday!') == 2
+    # 短い文でも署名が揃い、同じ文なら見つかる
+    index.add(4, 'Hi.')
+    assert index.find_or_add(5, 'hi') == 4
@@ -0,0 +1,41 @@
+import pytest
+
+import english_study_streamlit as app
+
+
+SENTENCES = [
+    {'english': 'I have finished.', 'japanese': '', 'grammar': '現在完了形（have + 過去分詞）'},
+    {'english': 'The book which I read.', 'japanese': '', 'grammar': 'which は関係代名詞'},
+    {'english': 'I want to go.', 'japanese': '', 'grammar': ''},
+]
+
+
+@pytest.mark.request('user-009')
+def test_mask_has_one_bit_per_matching_category():
+    mask = app.grammar_category_mask('現在完了形と関係代名詞 which')
+    names = [category for bit, (category, _) in enumerate(app.GRAMMAR_CATEGORY_PATTERNS) if mask & (1 << bit)]
+    assert names == ['現在完了形', '関係詞']
+    assert app.grammar_category_mask('') == 0
+
+
+@pytest.mark.request('user-009')
+def test_index_lists_categories_and_filters_with_any_match():
+    index = app.GrammarCategoryIndex(SENTENCES)
+    assert len(index) == 3
+    assert index.categories() == ['現在完了形', '関係詞']
+    assert index.categories() == app.extract_grammar_categories(SENTENCES)
+    assert index.filter(['関係詞']) == [1]
+    assert index.filter(['関係詞', '現在完了形']) == [0, 1]
+    assert index.filter(['仮定法']) == []
+    assert index.filter(['存在しないカテゴリー']) == []
+
+
+@pytest.mark.request('user-009')
+def test_update_changes_postings_and_invalidates_cached_filters():
+    index = app.GrammarCategoryIndex(SENTENCES)
+    assert index.filter(['不定詞']) == []
+    index.update(2, '不定詞の名詞的用法')
+    index.update(0, '')
+    assert index.filter(['不定詞']) == [2]
+    assert index.filter(['関係詞', '現在完了形']) == [1]
+    assert index.categories() == ['不定詞', '関係詞']
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import english_study_streamlit as app
+
+
+def highlighted(text):
+    return f'<span class="highlight">{text}</span>'
+
+
+@pytest.mark.request('user-010')
+def test_conjunctions_are_case_sensitive_and_relatives_are_not():
+    highlighter = app.GrammarHighlighter(['However', 'As'], ['which'])
+    assert highlighter.highlight('However, WHICH one? however') == \
+        f'{highlighted("However")}, {highlighted("WHICH")} one? however'
+
+
+@pytest.mark.request('user-010')
+def test_whole_words_only_and_longer_words_win():
+    highlighter = app.GrammarHighlighter(['As', 'As soon as'], ['who', 'whom'])
+    assert highlighter.highlight('As soon as whom Aspen whoever') == \
+        f'{highlighted("As soon as")} {highlighted("whom")} Aspen whoever'
+
+
+@pytest.mark.request('user-010')
+def test_text_is_highlighted_in_a_single_pass():
+    # 挿入したタグの中の語を二重にハイライトしない
+    highlighter = app.GrammarHighlighter(['span'], ['class'])
+    assert highlighter.highlight('span class') == f'{highlighted("span")} {highlighted("class")}'
+
+
+@pytest.mark.request('user-010')
+def test_empty_word_lists_leave_text_unchanged():
+    assert app.GrammarHighlighter([], []).highlight('However, which') == 'However, which'
+
+
+@pytest.mark.request('user-010')
+def test_signature_ignores_order_and_duplicates():
+    assert app.highlight_signature(['If', 'As'], ['who']) == app.highlight_signature(['As', 'If', 'If'], ['who'])
+    assert app.highlight_signature(['If'], ['who']) != app.highlight_signature(['If'], ['whom'])
+
+
+@pytest.mark.request('user-010')
+def test_word_lists_can_be_overridden_by_file(tmp_path, monkeypatch):
+    path = tmp_path / 'words.json'
+    path.write_text(json.dumps({'conjunctions': ['Yet']}), encoding='utf-8')
+    monkeypatch.setattr(app, 'HIGHLIGHT_WORDS_PATH', str(path))
+    assert app.load_highlight_words() == (('Yet',), tuple(app.HIGHLIGHT_RELATIVES))
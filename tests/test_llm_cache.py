@@ -0,0 +1,61 @@
+import pytest
+
+import english_study_streamlit as app
+
+
+@pytest.mark.request('user-002')
+def test_cache_round_trip_and_counts_hits_and_misses(tmp_path):
+    cache = app.LLMCache(str(tmp_path / 'cache.db'))
+    key = app.LLMCache.make_key('model', 'prompt', 0.3, 'I run.')
+    assert cache.get(key) is None
+    cache.set(key, {'japanese': '私は走る。', 'grammar': '現在形'})
+    assert cache.get(key) == {'japanese': '私は走る。', 'grammar': '現在形'}
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 1}
+    # 別のプロセスから開いても残っている
+    assert app.LLMCache(str(tmp_path / 'cache.db')).get(key)['japanese'] == '私は走る。'
+
+
+@pytest.mark.request('user-002')
+def test_key_depends_on_every_input():
+    key = app.LLMCache.make_key('model', 'prompt', 0.3, 'I run.')
+    assert key != app.LLMCache.make_key('other', 'prompt', 0.3, 'I run.')
+    assert key != app.LLMCache.make_key('model', 'other', 0.3, 'I run.')
+    assert key != app.LLMCache.make_key('model', 'prompt', 0.0, 'I run.')
+    assert key != app.LLMCache.make_key('model', 'prompt', 0.3, 'I ran.')
+
+
+@pytest.mark.request('user-002')
+def test_expired_entries_miss_and_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    cache = app.LLMCache(str(tmp_path / 'cache.db'), max_age_days=1)
+    cache.set('key', 'value')
+    now[0] += 2 * 24 * 60 * 60
+    assert cache.get('key') is None
+    cache.evict()
+    assert cache.stats()['entries'] == 0
+
+
+@pytest.mark.request('user-002')
+def test_eviction_keeps_the_most_recently_used_entries(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    cache = app.LLMCache(str(tmp_path / 'cache.db'), max_entries=2)
+    for key in ('a', 'b', 'c'):
+        now[0] += 1
+        cache.set(key, key)
+    now[0] += 1
+    cache.get('a')
+    cache.evict()
+    assert cache.get('a') == 'a'
+    assert cache.get('b') is None
+    assert cache.get('c') == 'c'
+
+
+@pytest.mark.request('user-002')
+def test_clear_removes_entries_and_resets_counts(tmp_path):
+    cache = app.LLMCache(str(tmp_path / 'cache.db'))
+    cache.set('key', 'value')
+    cache.get('key')
+    cache.clear()
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'entries': 0}
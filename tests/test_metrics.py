@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import english_study_streamlit as app
+
+
+@pytest.mark.request('user-020')
+def test_snapshot_summarizes_timers_in_milliseconds():
+    metrics = app.PerformanceMetrics()
+    for seconds in (0.001, 0.002, 0.003, 0.004):
+        metrics.observe('parse', seconds)
+    timer = metrics.snapshot()['timers']['parse']
+    assert timer['count'] == 4
+    assert timer['total_ms'] == pytest.approx(10)
+    assert timer['mean_ms'] == pytest.approx(2.5)
+    assert timer['p50_ms'] == pytest.approx(3)
+    assert timer['p99_ms'] == pytest.approx(4)
+    assert timer['max_ms'] == pytest.approx(4)
+
+
+@pytest.mark.request('user-020')
+def test_timer_records_even_when_the_block_raises():
+    metrics = app.PerformanceMetrics()
+    with pytest.raises(RuntimeError):
+        with metrics.timer('render'):
+            raise RuntimeError()
+    assert metrics.snapshot()['timers']['render']['count'] == 1
+
+
+@pytest.mark.request('user-020')
+def test_counters_merge_extra_counters_and_reset():
+    metrics = app.PerformanceMetrics()
+    metrics.increment('tokens', 3)
+    metrics.increment('tokens')
+    assert metrics.snapshot({'cache_hits': 2})['counters'] == {'cache_hits': 2, 'tokens': 4}
+    assert json.loads(metrics.to_json())['counters'] == {'tokens': 4}
+    metrics.reset()
+    assert metrics.snapshot() == {'timers': {}, 'counters': {}}
+
+
+@pytest.mark.request('user-020')
+def test_prometheus_output():
+    metrics = app.PerformanceMetrics()
+    metrics.observe('parse', 0.5)
+    metrics.increment('tokens', 7)
+    lines = metrics.to_prometheus().splitlines()
+    assert 'english_study_duration_seconds{operation="parse",quantile="0.5"} 0.500000' in lines
+    assert 'english_study_duration_seconds_count{operation="parse"} 1' in lines
+    assert 'english_study_tokens_total 7' in lines
+
+
+@pytest.mark.request('user-020')
+def test_prometheus_counters_are_not_rounded():
+    metrics = app.PerformanceMetrics()
+    metrics.increment('prompt_tokens', 12345678)
+    output = metrics.to_prometheus({'llm_cache_hits': 1234567, 'llm_throttled_seconds': 1.25})
+    lines = output.splitlines()
+    assert 'english_study_prompt_tokens_total 12345678' in lines
+    assert 'english_study_llm_cache_hits_total 1234567' in lines
+    assert 'english_study_llm_throttled_seconds_total 1.25' in lines
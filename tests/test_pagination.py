@@ -0,0 +1,35 @@
+import pytest
+
+import english_study_streamlit as app
+
+
+@pytest.mark.request('user-011')
+@pytest.mark.parametrize('total, page_number, expected', [
+    (0, 1, (1, 1, 0)),
+    (45, 1, (3, 1, 0)),
+    (45, 3, (3, 3, 40)),
+    (40, 3, (2, 2, 20)),
+    (45, 0, (3, 1, 0)),
+])
+def test_page_bounds_clamp_the_page_number(total, page_number, expected):
+    assert app.page_bounds(total, 20, page_number) == expected
+
+
+@pytest.mark.request('user-011')
+def test_jump_to_the_sentence_or_the_next_visible_one():
+    indices = [2, 5, 9, 14]
+    assert app.jump_position(indices, 5) == 1
+    assert app.jump_position(indices, 6) == 2
+    assert app.jump_position(indices, 0) == 0
+    assert app.jump_position(indices, 20) == 3
+    assert app.jump_position(range(100), 42) == 42
+    assert app.jump_position([], 3) is None
+
+
+@pytest.mark.request('user-011')
+def test_jump_in_ranked_results_picks_the_nearest_following_sentence():
+    ranked = [14, 2, 9, 5]
+    assert app.jump_position(ranked, 6, ranked=True) == 2
+    assert app.jump_position(ranked, 5, ranked=True) == 3
+    assert app.jump_position(ranked, 20, ranked=True) == 3
+    assert app.jump_position([], 1, ranked=True) is None
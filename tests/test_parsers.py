@@ -0,0 +1,87 @@
+import io
+import json
+
+import pytest
+
+import english_study_streamlit as app
+
+
+@pytest.mark.request('user-013')
+def test_tsv_records_with_header_and_index_column():
+    content = '\n\n番号\t英文\t日本語訳\t文法\n1\tI run.\t私は走る。\t現在形\n2\tShe ran.\t\t過去形\n\n'
+    assert list(app.iter_tsv_records(io.StringIO(content))) == [
+        {'english': 'I run.', 'japanese': '私は走る。', 'grammar': '現在形'},
+        {'english': 'She ran.', 'japanese': '', 'grammar': '過去形'},
+    ]
+
+
+@pytest.mark.request('user-013')
+def test_tsv_records_without_index_column_skip_english_header():
+    content = 'english\tjapanese\tgrammar\nI run.\t私は走る。\t現在形\nbroken line\n'
+    assert app.parse_tsv_content(content) == [
+        {'english': 'I run.', 'japanese': '私は走る。', 'grammar': '現在形'}
+    ]
+
+
+@pytest.mark.request('user-013')
+def test_json_stream_reader_reads_values_across_small_chunks():
+    data = '[{"english": "I run.", "n": 12345}, 3.25, "text", [1, 2], null]'
+    reader = app.JsonStreamReader(io.StringIO(data), chunk_size=3)
+    assert list(reader.items()) == json.loads(data)
+    # 読み終えた部分はバッファから捨てる
+    assert len(reader.buffer) < len(data)
+
+
+@pytest.mark.request('user-013')
+def test_json_stream_reader_rejects_unclosed_array():
+    reader = app.JsonStreamReader(io.StringIO('[1, 2'), chunk_size=2)
+    with pytest.raises(ValueError):
+        list(reader.items())
+
+
+@pytest.mark.request('user-013')
+@pytest.mark.parametrize('data', [
+    [{'english': 'I run.', 'translation': '私は走る。', 'grammar_points': '現在形'}, 'skipped'],
+    {'meta': {'sentences': 'not this'}, 'count': 2,
+     'sentences': [{'text': 'I run.', 'japanese': '私は走る。', 'grammar': '現在形'}]},
+])
+def test_json_records_from_array_or_sentences_key(data):
+    records = list(app.iter_json_records(io.StringIO(json.dumps(data, ensure_ascii=False))))
+    assert records == [{'english': 'I run.', 'japanese': '私は走る。', 'grammar': '現在形'}]
+
+
+@pytest.mark.request('user-013')
+def test_json_content_returns_empty_list_on_invalid_json():
+    assert app.parse_json_content('{"sentences": [') == []
+    assert app.parse_json_content('{}') == []
+
+
+@pytest.mark.request('user-013')
+def test_json_lines_skip_blank_and_invalid_lines():
+    lines = ['{"english": "I run."}\n', '\n', 'not json\n', '[1]\n', '{"sentence": "She ran."}\n']
+    assert [record['english'] for record in app.iter_json_lines_records(lines)] == ['I run.', 'She ran.']
+
+
+@pytest.mark.request('user-013')
+def test_pipe_records_strip_numbering():
+    content = '1. I run.｜私は走る。｜現在形\nno pipe here\n2、She ran.｜彼女は走った。\n'
+    assert app.parse_pipe_text(content) == [
+        {'english': 'I run.', 'japanese': '私は走る。', 'grammar': '現在形'},
+        {'english': 'She ran.', 'japanese': '彼女は走った。', 'grammar': ''},
+    ]
+
+
+@pytest.mark.request('user-013')
+@pytest.mark.parametrize('name, content, expected', [
+    ('a.tsv', 'I run.\t私は走る。\t現在形\n', ['I run.']),
+    ('a.jsonl', '{"english": "I run."}\n{"english": "She ran."}\n', ['I run.', 'She ran.']),
+    ('a.json', '[{"english": "I run."}]', ['I run.']),
+    ('a.json', '[{"english": ', []),
+    ('a.txt', '1. I run.｜私は走る。\n', ['I run.']),
+    # APIキーがない場合、プレーンテキストは簡易的に文分割する
+    ('a.txt', 'I run. She ran fast.\nWe walk.', ['I run.', 'She ran fast.', 'We walk.']),
+])
+def test_parse_uploaded_file_by_extension(name, content, expected):
+    store = app.parse_uploaded_file(name, io.BytesIO(content.encode('utf-8')))
+    assert [store[i]['english'] for i in range(len(store))] == expected
+
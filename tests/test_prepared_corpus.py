@@ -0,0 +1,116 @@
+import os
+import sqlite3
+
+import pytest
+
+import english_study_streamlit as app
+
+
+def export(tmp_path, records):
+    path = str(tmp_path / 'corpus.sqlite3')
+    stats = app.export_prepared_corpus(
+        path, app.SentenceStore.from_records(records), app.GrammarHighlighter([], [])
+    )
+    return path, stats
+
+
+RECORDS = [
+    {'english': 'The book which I read was long.', 'japanese': '私が読んだ本は長かった。',
+     'grammar': '関係代名詞 which'},
+    {'english': 'I have finished my homework.', 'japanese': '', 'grammar': ''},
+    {'english': 'She is taller than me.', 'japanese': '彼女は私より背が高い。', 'grammar': '比較級 taller'},
+]
+
+
+@pytest.mark.request('user-016')
+def test_export_and_open(tmp_path):
+    path, stats = export(tmp_path, RECORDS)
+    assert stats == {'total': 3, 'incomplete': 1, 'unique_grammar': 3}
+    store = app.PreparedSentenceStore(path)
+    assert len(store) == 3
+    assert store[0]['english'] == RECORDS[0]['english']
+    assert [record['english'] for record in store] == [record['english'] for record in RECORDS]
+    with pytest.raises(IndexError):
+        store[3]
+
+
+@pytest.mark.request('user-016')
+def test_set_field_updates_stats_and_category_mask_in_one_write(tmp_path):
+    path, _ = export(tmp_path, RECORDS)
+    store = app.PreparedSentenceStore(path)
+    index = store.build_category_index()
+    assert index.filter(['現在完了形']) == []
+
+    store[1]['japanese'] = '私は宿題を終えた。'
+    store[1]['grammar'] = '現在完了 have finished'
+    assert store.incomplete_count() == 0
+    index.update(1, '現在完了 have finished')
+    assert index.filter(['現在完了形']) == [1]
+
+    reopened = app.PreparedSentenceStore(path)
+    assert reopened.incomplete_count() == 0
+    assert reopened.category_counts['現在完了形'] == 1
+    assert reopened.indices_with_categories(app.category_mask(['現在完了形'])) == [1]
+
+
+@pytest.mark.request('user-016')
+def test_rejects_files_that_are_not_prepared_corpora(tmp_path):
+    path = tmp_path / 'other.sqlite3'
+    sqlite3.connect(str(path)).close()
+    with pytest.raises(ValueError):
+        app.PreparedSentenceStore(str(path))
+
+
+@pytest.mark.request('user-016')
+def test_read_only_does_not_rebuild_or_write(tmp_path):
+    path, _ = export(tmp_path, RECORDS)
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE meta SET value = 'old' WHERE key = 'category_signature'")
+    conn.commit()
+    conn.close()
+    mtime = os.path.getmtime(path)
+
+    store = app.PreparedSentenceStore(path, read_only=True)
+    assert store.incomplete_count() == 1
+    with pytest.raises(ValueError):
+        store[1]['japanese'] = '訳'
+    store.close()
+    assert os.path.getmtime(path) == mtime
+
+    app.PreparedSentenceStore(path).close()
+    conn = sqlite3.connect(path)
+    assert conn.execute(
+        "SELECT value FROM meta WHERE key = 'category_signature'"
+    ).fetchone()[0] == app.GRAMMAR_CATEGORY_SIGNATURE
+    conn.close()
+
+
+@pytest.mark.request('user-016')
+def test_annotation_setup_reads_only_the_needed_rows(tmp_path, monkeypatch):
+    path, _ = export(tmp_path, RECORDS)
+    store = app.PreparedSentenceStore(path)
+
+    def read_all_rows(self):
+        raise AssertionError('全行を読み込んだ')
+
+    monkeypatch.setattr(app.PreparedSentenceStore, '__iter__', read_all_rows)
+    assert app.annotation_targets(store) == [1]
+    checkpoint = app.AnnotationCheckpoint.for_sentences(store)
+    assert checkpoint.path == app.AnnotationCheckpoint.for_sentences(app.PreparedSentenceStore(path)).path
+    # 検索インデックスは最初に検索するときに作成する
+    corpus = app.SharedCorpus('key', store)
+    assert not corpus._search_ready.is_set()
+    monkeypatch.undo()
+    assert corpus.search_index().search('taller') == [2]
+
+
+@pytest.mark.request('user-016')
+def test_evicted_prepared_corpus_is_closed(tmp_path):
+    path, _ = export(tmp_path, RECORDS)
+    store = app.CorpusStore(max_entries=1)
+    corpus = store.get_or_load('prepared', lambda: app.PreparedSentenceStore(path))
+    assert corpus.sentences._connection is not None
+    store.get_or_load('other', lambda: app.SentenceStore.from_records(RECORDS))
+    assert corpus.sentences._connection is None
+    # 参照し続けているセッションからは開き直して読める
+    assert corpus.sentences[2]['english'] == RECORDS[2]['english']
@@ -0,0 +1,172 @@
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import english_study_streamlit as app
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content='ok'))],
+            usage=types.SimpleNamespace(prompt_tokens=3, completion_tokens=2)
+        )
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """SDKの読み込みに時間がかかり、その間スケジューラのロックが空いているかを記録する模擬モジュール"""
+    state = {'lock_free_during_import': None, 'scheduler': None}
+    completions = FakeCompletions()
+
+    class OpenAI:
+        def __init__(self, **options):
+            scheduler = state['scheduler']
+            state['lock_free_during_import'] = not scheduler._lock.locked()
+            time.sleep(0.05)
+            self.chat = types.SimpleNamespace(completions=completions)
+
+    monkeypatch.setitem(sys.modules, 'openai', types.SimpleNamespace(OpenAI=OpenAI))
+    state['completions'] = completions
+    return state
+
+
+@pytest.mark.request('user-022')
+def test_client_is_created_outside_the_rate_limit_lock_and_request_timing(fake_openai):
+    metrics = app.PerformanceMetrics()
+    scheduler = app.RequestScheduler('key', metrics=metrics)
+    fake_openai['scheduler'] = scheduler
+    response = scheduler.chat([{'role': 'user', 'content': 'hello'}], max_tokens=10)
+    assert response.choices[0].message.content == 'ok'
+    assert fake_openai['lock_free_during_import'] is True
+    # クライアントの作成（50ms）はリクエストの所要時間に含めない
+    assert metrics.snapshot()['timers']['llm_request']['max_ms'] < 50
+    assert scheduler.stats()['prompt_tokens'] == 3
+
+
+@pytest.mark.request('user-022')
+def test_client_is_created_once_across_threads(fake_openai):
+    scheduler = app.RequestScheduler('key')
+    fake_openai['scheduler'] = scheduler
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(scheduler.client)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(client is clients[0] for client in clients)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.timeと待機を置き換え、待った分だけ時計を進める"""
+    state = {'now': 1000.0, 'sleeps': []}
+
+    def sleep(seconds, cancel_event=None):
+        state['sleeps'].append(seconds)
+        state['now'] += seconds
+
+    monkeypatch.setattr(app.time, 'time', lambda: state['now'])
+    monkeypatch.setattr(app.RequestScheduler, '_sleep', staticmethod(sleep))
+    return state
+
+
+@pytest.mark.request('user-007')
+def test_acquire_waits_for_the_oldest_request_when_rpm_is_reached(clock):
+    scheduler = app.RequestScheduler('key', rpm_limit=2, tpm_limit=10000)
+    scheduler._acquire(10)
+    clock['now'] += 15
+    scheduler._acquire(10)
+    assert clock['sleeps'] == []
+    scheduler._acquire(10)
+    # 最初のリクエストが60秒の枠から外れるまで待つ
+    assert clock['sleeps'] == [45]
+    stats = scheduler.stats()
+    assert stats['requests'] == 3
+    assert stats['throttled_seconds'] == 45
+
+
+@pytest.mark.request('user-007')
+def test_acquire_waits_until_tokens_leave_the_tpm_window(clock):
+    scheduler = app.RequestScheduler('key', rpm_limit=100, tpm_limit=100)
+    scheduler._acquire(60)
+    clock['now'] += 10
+    scheduler._acquire(30)
+    scheduler._acquire(30)
+    assert clock['sleeps'] == [50]
+    assert scheduler._tokens_in_window == 60
+
+
+@pytest.mark.request('user-007')
+def test_request_larger_than_tpm_limit_does_not_wait_forever(clock):
+    scheduler = app.RequestScheduler('key', rpm_limit=100, tpm_limit=100)
+    scheduler._acquire(500)
+    scheduler._acquire(500)
+    assert clock['sleeps'] == [60]
+
+
+@pytest.mark.request('user-007')
+def test_chat_retries_retryable_errors_with_backoff(clock, fake_openai, monkeypatch):
+    monkeypatch.setattr(app, 'retryable_errors', lambda: (TimeoutError,))
+    monkeypatch.setattr(app.random, 'uniform', lambda low, high: high)
+    scheduler = app.RequestScheduler('key', max_retries=2)
+    fake_openai['scheduler'] = scheduler
+    completions = fake_openai['completions']
+    create = completions.create
+    failures = [TimeoutError(), TimeoutError()]
+
+    def flaky_create(**kwargs):
+        if failures:
+            raise failures.pop()
+        return create(**kwargs)
+
+    completions.create = flaky_create
+    response = scheduler.chat([{'role': 'user', 'content': 'hello'}], max_tokens=10)
+    assert response.choices[0].message.content == 'ok'
+    assert clock['sleeps'] == [app.OPENAI_BACKOFF_BASE, app.OPENAI_BACKOFF_BASE * 2]
+    stats = scheduler.stats()
+    assert (stats['requests'], stats['retries'], stats['errors']) == (3, 2, 2)
+
+
+@pytest.mark.request('user-007')
+def test_chat_raises_after_the_last_retry_and_on_other_errors(clock, fake_openai, monkeypatch):
+    monkeypatch.setattr(app, 'retryable_errors', lambda: (TimeoutError,))
+    scheduler = app.RequestScheduler('key', max_retries=1)
+    fake_openai['scheduler'] = scheduler
+    completions = fake_openai['completions']
+
+    def timeout(**kwargs):
+        raise TimeoutError()
+
+    completions.create = timeout
+    with pytest.raises(TimeoutError):
+        scheduler.chat([{'role': 'user', 'content': 'hello'}], max_tokens=10)
+    assert scheduler.stats()['retries'] == 1
+
+    def invalid(**kwargs):
+        raise ValueError('bad request')
+
+    completions.create = invalid
+    with pytest.raises(ValueError):
+        scheduler.chat([{'role': 'user', 'content': 'hello'}], max_tokens=10)
+    assert scheduler.stats()['retries'] == 1
+    assert scheduler.stats()['errors'] == 3
+
+
+@pytest.mark.request('user-007')
+def test_backoff_follows_retry_after_header_up_to_the_maximum():
+    scheduler = app.RequestScheduler('key')
+
+    def error(value):
+        return types.SimpleNamespace(response=types.SimpleNamespace(headers={'retry-after': value}))
+
+    assert scheduler._backoff(0, error('3')) == 3
+    assert scheduler._backoff(0, error('100000')) == app.OPENAI_BACKOFF_MAX
+    assert 0 <= scheduler._backoff(1, error(None)) <= app.OPENAI_BACKOFF_BASE * 2
@@ -0,0 +1,136 @@
+import json
+import types
+
+import pytest
+
+import english_study_streamlit as app
+
+
+class FakeScheduler:
+    """番号付きの英文に対してJSONで結果を返す（failをTrueにすると例外を送出する）模擬スケジューラ"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.requests = []
+
+    def chat(self, messages, max_tokens, cancel_event=None, **kwargs):
+        self.requests.append(messages[1]['content'])
+        if self.fail:
+            raise RuntimeError('service unavailable')
+        if kwargs.get('response_format'):
+            count = messages[1]['content'].count('\n') + 1
+            content = json.dumps({'results': [
+                {'id': n, 'japanese': f'訳{n}', 'grammar': f'解説{n}'} for n in range(1, count + 1)
+            ]})
+        else:
+            content = '日本語訳: 訳\n文法・語彙のポイント: 解説'
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+        )
+
+
+def make_sentences(*texts, grammar=''):
+    return [{'english': text, 'japanese': '', 'grammar': grammar} for text in texts]
+
+
+@pytest.mark.request('user-021')
+@pytest.mark.parametrize('text, label, matched', [
+    ('I have finished my homework.', '現在完了形', 'have finished'),
+    ('She has been studying for hours.', '現在完了進行形', 'has been studying'),
+    ('The letter was written by Tom.', '受動態', 'was written'),
+    ('If I had known the answer, I would have told you.', '仮定法過去完了', 'would have told'),
+    ('If I were you, I would go.', '仮定法過去', 'If I were'),
+    ('She is taller than me.', '比較級', 'taller than'),
+    ('This is the most interesting book.', '最上級', 'the most interesting'),
+    ('I want to eat sushi.', '不定詞', 'want to eat'),
+    ('The man who lives here is kind.', '関係代名詞', 'who'),
+    ('Walking along the street, I met her.', '分詞構文', 'Walking along the street'),
+    ("We're going to visit Kyoto.", '未来表現', "We're going to visit"),
+])
+def test_analyze_grammar_detects_patterns(text, label, matched):
+    assert (label, matched) in [(found[0], found[1]) for found in app.analyze_grammar(text)]
+
+
+@pytest.mark.request('user-021')
+def test_analyze_grammar_skips_nested_matches_and_orders_by_position():
+    labels = [label for label, _, _ in app.analyze_grammar('She has been studying since she moved to Tokyo.')]
+    assert '現在完了形' not in labels
+    assert labels[0] == '現在完了進行形'
+    assert app.rule_based_grammar('Thank you.') == ''
+    assert app.rule_based_grammar('I have finished it.').startswith('現在完了形「have finished」: ')
+
+
+@pytest.mark.request('user-021')
+def test_rules_first_sends_only_uncovered_sentences():
+    scheduler = FakeScheduler()
+    sentences = make_sentences('I have finished my homework.', 'Thank you.')
+    app.annotate_sentences(sentences, 2, scheduler=scheduler, cache=app.LLMCache('cache.sqlite3'),
+                           rules_first=True)
+    assert len(scheduler.requests) == 1 and 'Thank you.' in scheduler.requests[0]
+    assert sentences[0]['japanese'] == '' and app.has_rule_based_grammar(sentences[0])
+    assert sentences[1]['japanese'] == '訳'
+
+
+@pytest.mark.request('user-021')
+@pytest.mark.parametrize('batch_mode', [False, True])
+def test_api_failure_falls_back_to_rule_grammar_marked_as_failed(batch_mode):
+    sentences = make_sentences('I have finished my homework.', 'She is taller than me.', 'Thank you.')
+    results = []
+    app.annotate_sentences(sentences, 2, batch_mode=batch_mode, scheduler=FakeScheduler(fail=True),
+                           cache=app.LLMCache('cache.sqlite3'),
+                           result_callback=lambda i, result: results.append(result))
+    assert all(app.has_rule_based_grammar(sentence) for sentence in sentences[:2])
+    assert sentences[2]['grammar'] == ''
+    assert all(result['failed'] and result['rule_based'] for result in results)
+    assert all(not sentence['japanese'] for sentence in sentences)
+
+
+@pytest.mark.request('user-021')
+def test_api_result_replaces_rule_grammar():
+    sentences = make_sentences('I have finished my homework.')
+    sentences[0]['grammar'] = app.rule_based_grammar(sentences[0]['english'])
+    app.annotate_sentences(sentences, 1, scheduler=FakeScheduler(), cache=app.LLMCache('cache.sqlite3'))
+    assert sentences[0] == {'english': 'I have finished my homework.', 'japanese': '訳', 'grammar': '解説'}
+
+    # 入力済みの（ルールで作ったものではない）文法ポイントは上書きしない
+    sentences = make_sentences('I have finished my homework.', grammar='手で書いた解説')
+    app.annotate_sentences(sentences, 1, scheduler=FakeScheduler(), cache=app.LLMCache('cache2.sqlite3'))
+    assert sentences[0]['grammar'] == '手で書いた解説'
+
+
+@pytest.mark.request('user-021')
+def test_job_counts_api_failures_as_failed(monkeypatch):
+    monkeypatch.setattr(app, 'get_default_scheduler', lambda: FakeScheduler(fail=True))
+    store = app.SentenceStore.from_records(make_sentences('I have finished my homework.', 'Thank you.'))
+    job = app.AnnotationJob(store, max_concurrency=1, batch_mode=False).start()
+    job._thread.join()
+    assert job.failed == 2 and job.rule_annotated == 0
+    assert app.has_rule_based_grammar(store[0])
+    # 日本語訳がないため、次回の生成の対象に残る
+    assert app.annotation_targets(store) == [0, 1]
+
+
+@pytest.mark.request('user-021')
+def test_without_api_key_rule_grammar_stays_in_the_session_view():
+    corpus = app.SharedCorpus('key', make_sentences('I have finished my homework.', 'Thank you.'))
+    assert corpus.start_annotation(1, batch_mode=False) is None
+    view = app.SessionCorpusView(corpus, rule_grammar=True)
+    assert view[0]['grammar'].startswith('現在完了形')
+    assert view[1]['grammar'] == ''
+    assert corpus.sentences[0]['grammar'] == ''
+    assert app.SessionCorpusView(corpus)[0]['grammar'] == ''
+
+
+@pytest.mark.request('user-021')
+def test_rule_grammar_in_the_session_view_is_filtered_and_searched():
+    corpus = app.SharedCorpus('key', make_sentences(
+        'I have finished my homework.', 'The man who lives here is kind.', 'Thank you.'
+    ))
+    view = app.SessionCorpusView(corpus, rule_grammar=True)
+    assert view.category_index.categories() == ['現在完了形', '関係詞']
+    assert view.category_index.filter(['関係詞']) == [1]
+    assert view.search('現在完了形') == [0]
+    # ルールの判定は共有コーパスに書き込まず、APIキーのあるセッションには見せない
+    assert corpus.category_index.categories() == []
+    keyed = app.SessionCorpusView(corpus)
+    assert keyed.category_index.categories() == [] and keyed.search('現在完了形') == []
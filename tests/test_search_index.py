@@ -0,0 +1,116 @@
+import pytest
+
+import english_study_streamlit as app
+
+
+def make_sentences(*rows):
+    return app.SentenceStore.from_records(
+        {'english': english, 'japanese': japanese, 'grammar': grammar}
+        for english, japanese, grammar in rows
+    )
+
+
+ROWS = [
+    ('The book which I read was long.', '私が読んだ本は長かった。', '関係代名詞 which'),
+    ('I have finished my homework.', '私は宿題を終えた。', '現在完了形 have finished'),
+    ('She is taller than me.', '彼女は私より背が高い。', '比較級 taller'),
+]
+
+
+@pytest.mark.request('user-017')
+def test_search_terms_split_words_and_japanese_bigrams():
+    assert app.search_terms("I've read 本を読む") == ["i've", 'read', '本を', 'を読', '読む']
+    assert app.search_terms('本') == ['本']
+
+
+@pytest.mark.request('user-017')
+def test_search_ranks_by_matches_and_weight():
+    index = app.SearchIndex(make_sentences(*ROWS))
+    assert index.search('which') == [0]
+    assert index.search('宿題') == [1]
+    # 日本語1文字の検索は、その文字を含む2-gramに展開する
+    assert index.search('本') == [0]
+    assert sorted(index.search('have which')) == [0, 1]
+    assert index.search('zzz') == []
+
+
+@pytest.mark.request('user-017')
+def test_update_overrides_changed_sentence_and_session_overrides():
+    sentences = make_sentences(*ROWS)
+    index = app.SearchIndex(sentences)
+    sentences.set_field(2, 'japanese', '新しい訳')
+    index.update(2)
+    assert index.search('新し') == [2]
+    assert index.search('背が') == []
+    session_overrides = app.SearchOverrides({0: app.search_document_terms({'english': 'A cat.', 'japanese': '', 'grammar': ''})})
+    assert index.search('which', session_overrides) == []
+    assert index.search('which') == [0]
+
+
+@pytest.mark.request('user-017')
+def test_rebuild_keeps_updates_made_while_building(monkeypatch):
+    sentences = make_sentences(*ROWS)
+    index = app.SearchIndex(sentences, build=False)
+    original = app.search_document_terms
+
+    def change_during_build(sentence):
+        # 構築中（最初の文を読んだ時点）に別の文が変更された場合
+        if sentence['english'] == ROWS[0][0] and not sentences.columns['japanese'][1].startswith('変更'):
+            sentences.set_field(1, 'japanese', '変更後の訳')
+            index.update(1)
+        return original(sentence)
+
+    monkeypatch.setattr(app, 'search_document_terms', change_during_build)
+    index.rebuild()
+    monkeypatch.undo()
+    assert index.search('変更') == [1]
+
+
+@pytest.mark.request('user-017')
+def test_needs_rebuild_after_many_updates():
+    sentences = make_sentences(*ROWS * 400)
+    index = app.SearchIndex(sentences)
+    for i in range(1001):
+        index.update(i)
+    assert index.needs_rebuild()
+    index.rebuild()
+    assert not index.needs_rebuild()
+
+
+@pytest.mark.request('user-017')
+def test_shared_corpus_builds_search_index_in_background():
+    corpus = app.SharedCorpus('key', make_sentences(*ROWS))
+    assert corpus.search_index().search('taller') == [2]
+    corpus.sentences.set_field(2, 'japanese', '新しい訳')
+    corpus.refresh_indexes(2)
+    assert corpus.search_index().search('新し') == [2]
+
+
+@pytest.mark.request('user-017')
+def test_restored_checkpoint_refreshes_only_restored_sentences(monkeypatch):
+    monkeypatch.setattr(app, 'get_default_scheduler', lambda: None)
+    sentences = make_sentences(*[(english, '', '') for english, _, _ in ROWS])
+    checkpoint = app.AnnotationCheckpoint.for_sentences(sentences)
+    checkpoint.record(1, {'english': ROWS[1][0], 'japanese': ROWS[1][1], 'grammar': ROWS[1][2]})
+    updated = []
+    job = app.AnnotationJob(sentences, max_concurrency=1, batch_mode=False, on_update=updated.append)
+    assert job.restored == 1
+    assert updated == [1]
+
+
+@pytest.mark.request('user-017')
+def test_session_overrides_take_precedence_over_shared_overrides():
+    sentences = make_sentences(*ROWS)
+    index = app.SearchIndex(sentences)
+    sentences.set_field(0, 'japanese', '子猫がいる。')
+    index.update(0)
+    # 1文字の検索語は、差し替えにだけある2-gramにも展開する
+    assert index.search('猫') == [0]
+    session = app.SearchOverrides({0: app.search_document_terms(
+        {'english': 'A dog.', 'japanese': '犬', 'grammar': ''}
+    )})
+    assert index.search('猫', session) == []
+    assert index.search('dog which', session) == [0]
+    session.discard(0)
+    assert index.search('猫', session) == [0]
+    assert session.postings == {}
@@ -0,0 +1,57 @@
+import pytest
+
+import english_study_streamlit as app
+
+
+RECORDS = [
+    {'english': 'I run.', 'japanese': '私は走る。', 'grammar': '現在形'},
+    {'english': 'We run.', 'japanese': '', 'grammar': '現在形'},
+    {'english': 'She ran.', 'japanese': '', 'grammar': ''},
+]
+
+
+@pytest.mark.request('user-014')
+def test_records_read_like_dicts():
+    store = app.SentenceStore.from_records(iter(RECORDS))
+    assert len(store) == 3
+    assert [record.to_dict() for record in store] == RECORDS
+    record = store[1]
+    assert record['english'] == 'We run.'
+    assert record.get('missing', 'default') == 'default'
+    assert list(record.keys()) == ['english', 'japanese', 'grammar']
+    with pytest.raises(IndexError):
+        store[3]
+
+
+@pytest.mark.request('user-014')
+def test_writes_update_the_column_and_incomplete_count():
+    store = app.SentenceStore.from_records(RECORDS)
+    assert store.incomplete_count() == 2
+    store[1]['japanese'] = '私たちは走る。'
+    assert store.columns['japanese'][1] == '私たちは走る。'
+    assert store.incomplete_count() == 1
+    store[0]['grammar'] = ''
+    assert store.incomplete_count() == 2
+
+
+@pytest.mark.request('user-014')
+def test_equal_grammar_strings_are_shared():
+    store = app.SentenceStore.from_records([
+        {'english': 'I run.', 'japanese': '', 'grammar': ''.join(['現在', '形'])},
+        {'english': 'We run.', 'japanese': '', 'grammar': ''.join(['現', '在形'])},
+    ])
+    assert store.columns['grammar'][0] is store.columns['grammar'][1]
+    store[1]['grammar'] = ''.join(['現在', '形'])
+    assert store.columns['grammar'][0] is store.columns['grammar'][1]
+    assert store.memory_usage()['unique_grammar'] == 1
+
+
+@pytest.mark.request('user-014')
+def test_memory_usage_is_recomputed_after_a_change():
+    store = app.SentenceStore.from_records(RECORDS)
+    usage = store.memory_usage()
+    assert usage['sentences'] == 3
+    assert store.memory_usage() is usage
+    store.append({'english': 'They ran far away.', 'japanese': '', 'grammar': ''})
+    assert store.memory_usage()['sentences'] == 4
+    assert store.memory_usage()['bytes'] > usage['bytes']
@@ -0,0 +1,92 @@
+import types
+
+import pytest
+
+import english_study_streamlit as app
+
+
+def chunk(text):
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])
+
+
+class StreamingScheduler:
+    """応答を少しずつ返す模擬スケジューラ"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.calls = 0
+
+    def chat_stream(self, messages, max_tokens, **kwargs):
+        self.calls += 1
+        yield from self.pieces
+
+
+@pytest.mark.request('user-008')
+def test_stream_yields_partial_results_and_caches_the_final_record(tmp_path):
+    scheduler = StreamingScheduler(['日本語訳: 私は', '走る。\n文法・語彙', 'のポイント: 現在形', '\n主語が一人称'])
+    cache = app.LLMCache(str(tmp_path / 'cache.db'))
+    results = list(app.stream_translation_and_grammar('I run.', cache, scheduler))
+    assert results == [
+        {'japanese': '私は', 'grammar': ''},
+        {'japanese': '私は走る。', 'grammar': ''},
+        {'japanese': '私は走る。', 'grammar': '現在形'},
+        {'japanese': '私は走る。', 'grammar': '現在形 主語が一人称'},
+    ]
+    # 2回目はキャッシュした最終結果を1回で返し、リクエストしない
+    assert list(app.stream_translation_and_grammar('I run.', cache, scheduler)) == [results[-1]]
+    assert scheduler.calls == 1
+
+
+@pytest.mark.request('user-008')
+def test_stream_without_translation_is_not_cached(tmp_path):
+    cache = app.LLMCache(str(tmp_path / 'cache.db'))
+    results = list(app.stream_translation_and_grammar('I run.', cache, StreamingScheduler(['うまく', '答えられません'])))
+    assert results[-1] == {'japanese': '', 'grammar': ''}
+    assert cache.stats()['entries'] == 0
+
+
+@pytest.mark.request('user-008')
+def test_parse_translation_response_handles_partial_and_multiline_content():
+    assert app.parse_translation_response('日本語訳: 私は') == {'japanese': '私は', 'grammar': ''}
+    content = '日本語訳: 私は走る。\n文法・語彙のポイント: 現在形\n主語が一人称'
+    assert app.parse_translation_response(content) == {'japanese': '私は走る。', 'grammar': '現在形 主語が一人称'}
+
+
+def make_scheduler(create):
+    metrics = app.PerformanceMetrics()
+    scheduler = app.RequestScheduler('key', metrics=metrics)
+    scheduler._client = types.SimpleNamespace(chat=types.SimpleNamespace(
+        completions=types.SimpleNamespace(create=create)
+    ))
+    return scheduler, metrics
+
+
+@pytest.mark.request('user-008')
+def test_chat_stream_records_requests_and_failures():
+    scheduler, metrics = make_scheduler(lambda **kwargs: iter([chunk('日本'), chunk(None), chunk('語')]))
+    assert list(scheduler.chat_stream([{'role': 'user', 'content': 'hello'}], max_tokens=10)) == ['日本', '語']
+    assert metrics.snapshot()['timers']['llm_stream']['count'] == 1
+
+    def invalid(**kwargs):
+        raise ValueError('bad request')
+
+    scheduler, metrics = make_scheduler(invalid)
+    with pytest.raises(ValueError):
+        list(scheduler.chat_stream([{'role': 'user', 'content': 'hello'}], max_tokens=10))
+    assert scheduler.stats()['errors'] == 1
+    assert scheduler.stats()['retries'] == 0
+    assert metrics.snapshot()['timers']['llm_stream_start']['count'] == 1
+
+
+@pytest.mark.request('user-008')
+def test_chat_stream_records_a_dropped_stream():
+    def dropped(**kwargs):
+        yield chunk('日本')
+        raise ConnectionError('connection reset')
+
+    scheduler, _ = make_scheduler(lambda **kwargs: dropped())
+    stream = scheduler.chat_stream([{'role': 'user', 'content': 'hello'}], max_tokens=10)
+    assert next(stream) == '日本'
+    with pytest.raises(ConnectionError):
+        next(stream)
+    assert scheduler.stats()['errors'] == 1
@@ -0,0 +1,67 @@
+import re
+import threading
+import types
+
+import pytest
+
+import english_study_streamlit as app
+
+
+class SplittingScheduler:
+    """チャンクの文を番号付きリストで返す（dropを指定するとその文を落とす）模擬スケジューラ"""
+
+    def __init__(self, drop=None):
+        self.drop = drop
+        self.chunks = []
+        self._lock = threading.Lock()
+
+    def chat(self, messages, max_tokens, cancel_event=None, **kwargs):
+        text = messages[1]['content'].split('テキスト:\n', 1)[1].split('\n\n以下の形式', 1)[0]
+        with self._lock:
+            self.chunks.append(text)
+        sentences = [s for s in re.findall(r'[A-Z][^.]*\.', text) if s != self.drop]
+        content = '\n'.join(f'{n}. {s}' for n, s in enumerate(sentences, 1))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(
+            message=types.SimpleNamespace(content=content), finish_reason='stop'
+        )])
+
+
+@pytest.mark.request('user-004')
+def test_chunks_break_at_paragraphs_within_the_limit():
+    text = 'One two.\n\nThree four.\n\n  \n\nFive six seven.'
+    assert app.chunk_text(text, max_chars=20) == ['One two.\n\nThree four.', 'Five six seven.']
+    assert app.chunk_text(text, max_chars=1000) == ['One two.\n\nThree four.\n\nFive six seven.']
+    assert app.chunk_text('   ') == []
+
+
+@pytest.mark.request('user-004')
+def test_long_paragraph_is_split_at_sentence_boundaries():
+    paragraph = ' '.join(f'Sentence number {n}.' for n in range(10))
+    chunks = app.chunk_text(paragraph, max_chars=60)
+    assert len(chunks) > 1
+    assert all(len(chunk.replace('\n\n', '')) <= 60 for chunk in chunks)
+    assert ' '.join(chunks).replace('\n\n', ' ') == paragraph
+
+
+@pytest.mark.request('user-004')
+def test_chunks_are_split_in_parallel_and_joined_in_order(tmp_path):
+    # 1段落がチャンクの上限近くになるようにして、段落ごとに別のチャンクにする
+    paragraphs = [[f'Paragraph {n} starts.'] + ['Filler text goes here.'] * 120 for n in range(4)]
+    text = '\n\n'.join(' '.join(paragraph) for paragraph in paragraphs)
+    scheduler = SplittingScheduler()
+    cache = app.LLMCache(str(tmp_path / 'cache.db'))
+    sentences = app.split_text_with_llm(text, 4, cache, scheduler)
+    assert sentences == [sentence for paragraph in paragraphs for sentence in paragraph]
+    assert len(scheduler.chunks) == 4
+    # 同じチャンクはキャッシュから返す
+    assert app.split_text_with_llm(text, 4, cache, scheduler) == sentences
+    assert len(scheduler.chunks) == 4
+
+
+@pytest.mark.request('user-004')
+def test_chunk_falls_back_to_simple_split_when_sentences_are_lost(tmp_path):
+    scheduler = SplittingScheduler(drop='It ends here.')
+    cache = app.LLMCache(str(tmp_path / 'cache.db'))
+    text = 'Short one. It ends here.'
+    assert app.split_chunk_with_llm(text, cache, scheduler) == ['Short one.', 'It ends here.']
+    assert cache.stats()['entries'] == 0
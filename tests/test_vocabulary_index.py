@@ -0,0 +1,80 @@
+import pytest
+
+import english_study_streamlit as app
+
+
+def make_index(*texts, levels=None):
+    return app.VocabularyIndex(
+        [{'english': text, 'japanese': '', 'grammar': ''} for text in texts], levels
+    )
+
+
+@pytest.mark.request('user-023')
+def test_vocabulary_tokens_expand_contractions():
+    assert app.vocabulary_tokens("I can't go, but she'll come.") == ['i', 'can', 'go', 'but', 'she', 'come']
+    assert app.vocabulary_tokens("Tom's dog isn't here") == ['tom', 'dog', 'is', 'here']
+
+
+@pytest.mark.request('user-023')
+@pytest.mark.parametrize('word, expected', [
+    ('went', ['go']),
+    ('studied', ['study', 'studied']),
+    ('boxes', ['box', 'boxe', 'boxes']),
+    ('stopped', ['stop', 'stopp', 'stoppe', 'stopped']),
+    ('liked', ['like', 'lik', 'liked']),
+    # 機能語や短すぎる語幹は候補にしない
+    ('used', ['use', 'used']),
+    ('tied', ['tie', 'tied']),
+    # 語尾が -s でも変化形ではない語
+    ('news', ['news']),
+])
+def test_lemma_candidates(word, expected):
+    assert app.lemma_candidates(word) == expected
+
+
+@pytest.mark.request('user-023')
+def test_lemmatize_prefers_known_then_shared_candidates():
+    assert app.lemmatize('used', {'us', 'used'}) == 'used'
+    assert app.lemmatize('visits', {'visit', 'visits'}) == 'visit'
+    assert app.lemmatize('visits', {'visits'}, {'visit': 2}) == 'visit'
+    assert app.lemmatize('visits', {'visits'}, {'visit': 1}) == 'visits'
+    assert app.lemmatize('was', {'was'}) == 'be'
+
+
+@pytest.mark.request('user-023')
+def test_used_is_not_counted_as_us():
+    index = make_index('We used the tool.', 'He told us the story.')
+    assert index.sentences_with('us') == [1]
+    assert index.sentences_with('use') == [0]
+    assert index.lemma('used') == 'used'
+
+
+@pytest.mark.request('user-023')
+def test_news_is_not_counted_as_new():
+    index = make_index('I read the news.', 'She bought a new car.')
+    assert index.sentences_with('new') == [1]
+    assert index.sentences_with('news') == [0]
+
+
+@pytest.mark.request('user-023')
+def test_inflections_without_base_form_are_merged():
+    index = make_index('She visits Kyoto.', 'They visited Nara.', 'We enjoy music.')
+    assert index.lemma('visits') == index.lemma('visited') == 'visit'
+    assert index.sentences_with('visit') == [0, 1]
+    assert index.count('visiting') == 2
+    assert [row['lemma'] for row in index.frequent_words(1)] == ['visit']
+
+
+@pytest.mark.request('user-023')
+def test_rare_and_frequent_words_with_levels_and_units():
+    index = make_index(
+        'The cat sleeps.', 'The cat eats fish.', 'A dog barks at the cat.',
+        levels={'cat': 'A1', 'bark': 'B2', 'fish': 'A1'}
+    )
+    assert index.frequent_words(1)[0] == {'lemma': 'cat', 'unit_count': 3, 'corpus_count': 3, 'level': 'A1'}
+    assert [row['lemma'] for row in index.rare_words(2, level='A1')] == ['fish', 'cat']
+    # 範囲を指定した場合は、その範囲の出現回数とコーパス全体の出現回数を返す
+    rows = index.frequent_words(5, indices=[2])
+    assert {row['lemma']: row['unit_count'] for row in rows}['cat'] == 1
+    assert all(row['lemma'] not in app.VOCABULARY_STOPWORDS for row in rows)
+    assert index.memory_usage() > 0